@@ -12,6 +12,10 @@
 # Make sure the logger is configured early:
 from .logger import LOGGER, active_logger
 from .device import VantagePro2
+from .utils import RetryPolicy, MetadataCache
+from .compat import has_asyncio
+if has_asyncio:
+    from .aio import AsyncVantagePro2
 
 VERSION = '0.3.3dev'
 __version__ = VERSION
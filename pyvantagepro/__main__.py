@@ -18,7 +18,7 @@ from datetime import datetime
 from . import VERSION
 from .logger import active_logger
 from .device import VantagePro2
-from .utils import csv_to_dict
+from .utils import csv_to_dict, MetadataCache
 from .compat import stdout
 
 
@@ -55,20 +55,19 @@ def getdata_cmd(args, vp):
 
 def getarchives(args, vp):
     '''Getarchive with progressbar if `args.debug` is True.'''
-    from .utils import ListDict
+    from .utils import ListDict, UniqueRecords
     if args.debug:
-        return vp.get_archives(args.start, args.stop)
+        return vp.get_archives(args.start, args.stop, compact=True)
     from progressbar import ProgressBar, Percentage, Bar
     archives = ListDict()
-    dates = []
+    unique = UniqueRecords()
     generator = vp._get_archives_generator(args.start, args.stop)
     widgets = ['Archives download: ', Percentage(), ' ', Bar()]
     pbar = ProgressBar(widgets=widgets, maxval=2600).start()
     for step, record in enumerate(generator):
         pbar.update(step)
-        if record['Datetime'] not in dates:
-            archives.append(record)
-            dates.append(record['Datetime'])
+        archives.extend(item.to_record() for item in unique.add(record))
+    archives.extend(item.to_record() for item in unique.flush())
     pbar.finish()
     if not archives:
         print("No new records were found﻿")
@@ -76,7 +75,9 @@ def getarchives(args, vp):
         print("1 new record was found")
     else:
         print("%d new records were found" % len(archives))
-    return archives.sorted_by('Datetime')
+    if unique.reordered:
+        return archives.sorted_by('Datetime')
+    return archives
 
 
 def getarchives_cmd(args, vp):
@@ -95,7 +96,7 @@ def update_cmd(args, vp):
     with file(args.db, 'a'):
         os.utime(args.db, None)
     with open(args.db, 'r+a') as file_db:
-        db = csv_to_dict(file_db, delimiter=args.delim)
+        db = csv_to_dict(file_db, delimiter=args.delim, compact=True)
         args.start = None
         args.stop = None
         if len(db) > 0:
@@ -117,6 +118,9 @@ def get_cmd_parser(cmd, subparsers, help, func):
                         help="Connection link timeout")
     parser.add_argument('--debug', action="store_true", default=False,
                         help='Display log')
+    parser.add_argument('--cache', action="store", default=None,
+                        help="File where the station metadata are cached "
+                             "between the commands")
     parser.add_argument('url', action="store",
                         help="Specifiy URL for connection link. "
                              "E.g. tcp:iphost:port "
@@ -194,13 +198,15 @@ def main():
     # Parse argv arguments
     args = parser.parse_args()
 
+    metadata = MetadataCache(args.cache) if args.cache else None
     if args.debug:
         active_logger()
-        vp = VantagePro2.from_url(args.url, args.timeout)
+        vp = VantagePro2.from_url(args.url, args.timeout, metadata=metadata)
         args.func(args, vp)
     else:
         try:
-            vp = VantagePro2.from_url(args.url, args.timeout)
+            vp = VantagePro2.from_url(args.url, args.timeout,
+                                      metadata=metadata)
             args.func(args, vp)
         except Exception as e:
             parser.error('%s' % e)
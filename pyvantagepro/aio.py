@@ -0,0 +1,585 @@
+# -*- coding: utf-8 -*-
+'''
+    pyvantagepro.aio
+    ----------------
+
+    Asynchronous (asyncio) communication with the Davis Vantage Pro2
+    devices, to drive many stations from one event loop. It requires
+    Python 3.6 or later.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+import asyncio
+import functools
+import struct
+import time
+from datetime import datetime, timedelta
+
+from .logger import LOGGER
+from .device import (VantagePro2, NoDeviceException, BadAckException,
+                     BadCRCException, BadDataException, DMP_PAGE_SIZE,
+                     parse_dump_page)
+from .parser import (LoopDataParserRevB, LazyLoopDataParserRevB,
+                     DmpHeaderParser, VantageProCRC, pack_datetime,
+                     unpack_datetime, pack_dmp_date_time, crc16)
+from .utils import retry, bytes_to_hex, ListDict, UniqueRecords
+
+
+class AsyncLink(object):
+    '''Base class of the asynchronous links. The replies are always read
+    as bytes.
+
+    :param timeout: The default read timeout in seconds.
+    '''
+
+    def __init__(self, timeout=1):
+        self.timeout = timeout
+        # the bytes received after the marker of a `read_until`
+        self._pending = b''
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    async def _read_chunk(self, size):
+        '''Reads up to `size` bytes as soon as some are received, or returns
+        an empty bytes if the connection is closed.'''
+        raise NotImplementedError()
+
+    def _deadline(self, timeout=None):
+        '''Returns the event loop time of the read deadline, `timeout`
+        times the link timeout, like the `PyLink` links.'''
+        loop = asyncio.get_event_loop()
+        return loop.time() + (timeout or 1) * (self.timeout or 1)
+
+    async def _receive(self, size, deadline):
+        '''Returns up to `size` bytes as soon as some are received, or an
+        empty bytes after the `deadline`.'''
+        remaining = deadline - asyncio.get_event_loop().time()
+        if remaining <= 0:
+            return b''
+        try:
+            return await asyncio.wait_for(self._read_chunk(size), remaining)
+        except asyncio.TimeoutError:
+            return b''
+
+    async def read(self, size=None, timeout=None):
+        '''Reads `size` bytes, or less if the `timeout` (a factor of the link
+        timeout) expires first. If `size` is None, reads until the
+        `timeout`.'''
+        deadline = self._deadline(timeout)
+        data = self._pending if size is None else self._pending[:size]
+        self._pending = self._pending[len(data):]
+        while size is None or len(data) < size:
+            chunk = await self._receive(4096 if size is None
+                                        else size - len(data), deadline)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    async def read_until(self, marker, timeout=None):
+        '''Reads up to the `marker` included, or the bytes received before
+        the `timeout` (a factor of the link timeout).'''
+        deadline = self._deadline(timeout)
+        data, self._pending = self._pending, b''
+        while marker not in data:
+            chunk = await self._receive(4096, deadline)
+            if not chunk:
+                return data
+            data += chunk
+        end = data.index(marker) + len(marker)
+        data, self._pending = data[:end], data[end:]
+        return data
+
+
+class TCPLink(AsyncLink):
+    '''Asynchronous TCP link over asyncio streams.'''
+
+    def __init__(self, host, port, timeout=1):
+        super(TCPLink, self).__init__(timeout)
+        self.host = host
+        self.port = port
+        self.reader = self.writer = None
+
+    @property
+    def url(self):
+        return 'tcp:%s:%d' % (self.host, self.port)
+
+    async def open(self):
+        '''Opens the connection.'''
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout)
+            LOGGER.info('new %s was initialized' % self.url)
+
+    async def write(self, data):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def _read_chunk(self, size):
+        return await self.reader.read(size)
+
+    async def close(self):
+        '''Closes the connection.'''
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+            self._pending = b''
+
+
+class SerialLink(AsyncLink):
+    '''Asynchronous serial link. The port is opened in non-blocking mode and
+    the event loop is notified when data is received (POSIX systems).'''
+
+    def __init__(self, port, baudrate=19200, bytesize=8, parity='N',
+                 stopbits=1, timeout=1):
+        super(SerialLink, self).__init__(timeout)
+        self.port = port
+        self.baudrate = baudrate
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self._serial = None
+
+    @property
+    def url(self):
+        return 'serial:%s:%d:%d%s%d' % (self.port, self.baudrate,
+                                        self.bytesize, self.parity,
+                                        self.stopbits)
+
+    async def open(self):
+        '''Opens the serial port.'''
+        import serial
+        if self._serial is None:
+            self._serial = serial.Serial(self.port, self.baudrate, timeout=0,
+                                         bytesize=self.bytesize,
+                                         parity=self.parity,
+                                         stopbits=self.stopbits)
+            self._serial.reset_output_buffer()
+            LOGGER.info('new %s was initialized' % self.url)
+
+    async def write(self, data):
+        self._serial.write(data)
+
+    async def _read_chunk(self, size):
+        data = self._serial.read(size)
+        while not data:
+            loop = asyncio.get_event_loop()
+            readable = loop.create_future()
+            fileno = self._serial.fileno()
+            loop.add_reader(fileno, lambda: readable.done() or
+                            readable.set_result(None))
+            try:
+                await readable
+            finally:
+                loop.remove_reader(fileno)
+            data = self._serial.read(size)
+        return data
+
+    async def close(self):
+        '''Closes the serial port.'''
+        if self._serial is not None:
+            self._serial.close()
+            self._serial = None
+            self._pending = b''
+
+
+def link_from_url(url):
+    '''Returns the asynchronous link of a `PyLink` 'tcp' or 'serial' URL.'''
+    args = url.split(':')
+    mode = args[0].lower()
+    try:
+        if mode == 'tcp':
+            return TCPLink(args[1], int(args[2]))
+        elif mode == 'serial':
+            kwargs = {}
+            if len(args) > 2:
+                kwargs['baudrate'] = int(args[2])
+            if len(args) > 3:
+                kwargs.update(bytesize=int(args[3][0]), parity=args[3][1],
+                              stopbits=int(args[3][2]))
+            return SerialLink(args[1], **kwargs)
+    except (IndexError, ValueError):
+        pass
+    raise ValueError('Bad url link sepecified')
+
+
+async def retry_call(policy, func, *args, **kwargs):
+    '''Awaits `func` with `args` and `kwargs` and retries it as the
+    `RetryPolicy.call` method, without blocking the event loop.'''
+    counter = policy.start(func)
+    begin = time.time()
+    delays = policy.delays()
+    for last in policy.attempts():
+        try:
+            ret = await func(*args, **kwargs)
+            if ret or last:
+                if not ret:
+                    policy.failed(counter)
+                return ret
+        except policy.exceptions as e:
+            if last:
+                policy.failed(counter)
+                raise
+            error = e
+        else:
+            error = None
+        delay = policy.next_delay(counter, begin, delays)
+        if delay is None:
+            if error is None:
+                return ret
+            raise error
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class async_retry(retry):
+    '''Retries a coroutine method as `retry`, the delays are awaited.'''
+
+    def __call__(self, f):
+        @functools.wraps(f)
+        async def wrapped_f(*args, **kwargs):
+            policy = self.get_policy(args, f.__name__)
+            return await retry_call(policy, f, *args, **kwargs)
+        return wrapped_f
+
+
+def async_cached(f):
+    '''Caches the result of a coroutine method without arguments, as
+    `cached_property`.'''
+    @functools.wraps(f)
+    async def wrapped_f(self):
+        value = self._cache.get(f.__name__)
+        if value is None:
+            value = self._cache[f.__name__] = await f(self)
+        return value
+    return wrapped_f
+
+
+class AsyncVantagePro2(object):
+    '''Communicates with the station as `VantagePro2`, with the commands as
+    coroutines. Use `from_url` or `from_serial` to get an opened device.
+
+    :param link: An `AsyncLink` connection.
+
+    :param retry_policy: A `RetryPolicy` used by all the retried commands
+        instead of their default tries and delay.
+    '''
+
+    # device reply commands
+    WAKE_STR = b'\n'
+    WAKE_ACK = b'\n\r'
+    ACK = b'\x06'
+    NACK = b'\x21'
+    CANCEL = b'\x18'
+    ESC = b'\x1b'
+    OK = b'\n\rOK\n\r'
+
+    AWAKE_WINDOW = VantagePro2.AWAKE_WINDOW
+
+    def __init__(self, link, retry_policy=None):
+        self.link = link
+        self.retry_policy = retry_policy
+        self.RevA = self.RevB = None
+        # time of the last reply of the console
+        self._reply_time = None
+        self._cache = {}
+
+    @classmethod
+    async def from_url(cls, url, timeout=10, retry_policy=None):
+        ''' Get opened device from url.
+
+        :param url: A `PyLink` 'tcp' or 'serial' connection URL.
+        :param timeout: Set a read timeout value.
+        :param retry_policy: A `RetryPolicy` for the retried commands.
+        '''
+        link = link_from_url(url)
+        link.settimeout(timeout)
+        device = cls(link, retry_policy)
+        await device.open()
+        return device
+
+    @classmethod
+    async def from_serial(cls, tty, baud, timeout=10, retry_policy=None):
+        ''' Get opened device from serial port.
+
+        :param tty: The serial port.
+        :param baud: The baudrate.
+        :param timeout: Set a read timeout value.
+        :param retry_policy: A `RetryPolicy` for the retried commands.
+        '''
+        device = cls(SerialLink(tty, baud, timeout=timeout), retry_policy)
+        await device.open()
+        return device
+
+    async def open(self):
+        '''Opens the link and checks the firmware revision.'''
+        await self.link.open()
+        await self._check_revision()
+
+    async def close(self):
+        '''Closes the link.'''
+        await self.link.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def awake(self):
+        '''True if the console replied during the last `AWAKE_WINDOW`
+        seconds.'''
+        return (self._reply_time is not None and
+                time.time() - self._reply_time < self.AWAKE_WINDOW)
+
+    def _replied(self, ok=True):
+        '''Records a reply of the console, or forgets the awake state if
+        the reply is not the expected one.'''
+        self._reply_time = time.time() if ok else None
+
+    @async_retry(tries=3, delay=1)
+    async def wake_up(self, force=False):
+        '''Wakeup the station console, unless it is known to be `awake`.
+
+        :param force: If True, wakes up the console even if it is `awake`.
+        '''
+        if self.awake and not force:
+            return True
+        LOGGER.info("try wake up console")
+        await self.link.write(self.WAKE_STR)
+        ack = await self.link.read(len(self.WAKE_ACK))
+        if self.WAKE_ACK == ack:
+            LOGGER.info("Check ACK: OK (%s)" % (repr(ack)))
+            self._replied()
+            return True
+        self._replied(False)
+        # realign the input after a 1 byte shift
+        await self.link.read(1)
+        LOGGER.error("Check ACK: BAD (%s != %s)" % (repr(self.WAKE_ACK),
+                                                    repr(ack)))
+        raise NoDeviceException()
+
+    @async_retry(tries=3, delay=0.5)
+    async def send(self, data, wait_ack=None, timeout=None):
+        '''Sends data to station, as `VantagePro2.send`.
+
+         :param data: Can be a byte array or an ASCII command. If this is
+            the case for an ascii command, a <LF> will be added.
+
+         :param wait_ack: If `wait_ack` is not None, the function must check
+            that acknowledgement is the one expected.
+
+         :param timeout: Define this timeout when reading ACK from link,
+            as a factor of the link timeout.
+         '''
+        if isinstance(data, bytes):
+            LOGGER.info("try send : %s" % bytes_to_hex(data))
+        else:
+            if self._reply_time is None and wait_ack is not None:
+                # the last reply was bad, the console may have gone to sleep
+                await self.wake_up()
+            LOGGER.info("try send : %s" % data)
+            data = ("%s\n" % data).encode('ascii')
+        await self.link.write(data)
+        if wait_ack is None:
+            return True
+        ack = await self.link.read(len(wait_ack), timeout=timeout)
+        self._replied(wait_ack == ack)
+        if wait_ack == ack:
+            LOGGER.info("Check ACK: OK (%s)" % (repr(ack)))
+            return True
+        LOGGER.error("Check ACK: BAD (%s != %s)" % (repr(wait_ack), repr(ack)))
+        raise BadAckException()
+
+    async def _read_line(self):
+        '''Returns a text reply, without its end of line, as
+        `VantagePro2._read_line`.'''
+        data = await self.link.read_until(b'\n\r')
+        if not data.endswith(b'\n\r'):
+            self._replied(False)
+            raise BadDataException()
+        return data[:-2].decode('ascii')
+
+    @async_retry(tries=3, delay=1)
+    async def read_from_eeprom(self, hex_address, size):
+        '''Reads from EEPROM the `size` number of bytes starting at the
+        `hex_address`.'''
+        await self.wake_up()
+        await self.link.write(("EEBRD %s %.2X\n" % (hex_address, size))
+                              .encode('ascii'))
+        ack = await self.link.read(len(self.ACK))
+        self._replied(self.ACK == ack)
+        if self.ACK != ack:
+            LOGGER.error("Check ACK: BAD (%s != %s)" % (repr(self.ACK),
+                                                        repr(ack)))
+            raise BadAckException()
+        LOGGER.info("Check ACK: OK (%s)" % (repr(ack)))
+        data = await self.link.read(size + 2)  # 2 bytes for CRC
+        if VantageProCRC(data).check():
+            return data[:-2]
+        raise BadCRCException()
+
+    async def gettime(self):
+        '''Returns the current datetime of the console.'''
+        await self.wake_up()
+        await self.send("GETTIME", self.ACK)
+        return unpack_datetime(await self.link.read(8))
+
+    async def settime(self, dtime):
+        '''Set the given `dtime` on the station.'''
+        await self.wake_up()
+        await self.send("SETTIME", self.ACK)
+        await self.send(pack_datetime(dtime), self.ACK)
+
+    async def get_current_data(self, lazy=False):
+        '''Returns the real-time data as a `Dict`.
+
+        :param lazy: If True, returns a `LazyLoopDataParserRevB`.
+        '''
+        if not self.RevB:
+            raise NotImplementedError('Do not support RevA data format')
+        await self.wake_up()
+        await self.send("LOOP 1", self.ACK)
+        data = await self.link.read(99)
+        self._replied(len(data) == 99)
+        if lazy:
+            return LazyLoopDataParserRevB(data, datetime.now())
+        return LoopDataParserRevB(data, datetime.now())
+
+    async def get_archives(self, start_date=None, stop_date=None,
+                           compact=False, duplicates='first'):
+        '''Get archive records until `start_date` and `stop_date` as
+        ListDict, as `VantagePro2.get_archives`.'''
+        archives = ListDict()
+        unique = UniqueRecords(duplicates)
+        async for item in self.archives(start_date, stop_date):
+            archives.extend(record.to_record() if compact else record
+                            for record in unique.add(item))
+        archives.extend(record.to_record() if compact else record
+                        for record in unique.flush())
+        if unique.reordered:
+            return archives.sorted_by('Datetime')
+        return archives
+
+    async def archives(self, start_date=None, stop_date=None):
+        '''Yields the archive records between `start_date` and `stop_date`
+        as the pages are downloaded. The download is canceled when the
+        generator is closed.'''
+        if not self.RevB:
+            raise NotImplementedError('Do not support RevA data format')
+        await self.wake_up()
+        # 2001-01-01 01:01:01
+        start_date = start_date or datetime(2001, 1, 1, 1, 1, 1)
+        stop_date = stop_date or datetime.now()
+        # round start_date, with the archive period to the previous record
+        period = await self.archive_period()
+        start_date -= timedelta(minutes=start_date.minute % period)
+        await self.send("DMPAFT", self.ACK)
+        await self.link.write(pack_dmp_date_time(start_date))
+        # the timeout is 2 times the link timeout, like VantagePro2
+        ack = await self.link.read(len(self.ACK), timeout=2)
+        if ack != self.ACK:
+            raise BadAckException()
+        header = DmpHeaderParser(await self.link.read(6))
+        if header.crc_error:
+            await self.link.write(self.CANCEL)
+            raise BadCRCException()
+        await self.link.write(self.ACK)
+        LOGGER.info('Starting download %d dump pages' % header['Pages'])
+        # a page has 5 records, a bad offset is ignored
+        skip = header['Offset'] if 0 <= header['Offset'] < 5 else 0
+        previous = None
+        done = False
+        try:
+            for i in range(header['Pages']):
+                try:
+                    page = await self._read_dump_page()
+                except (BadCRCException, BadDataException) as e:
+                    LOGGER.error('Error: %s' % e)
+                    LOGGER.info('Canceling download : Finish')
+                    break
+                records, reason = parse_dump_page(page, 0, start_date,
+                                                  stop_date, skip, previous)
+                skip = 0
+                for record in records:
+                    yield record
+                if records:
+                    previous = records[-1]['Datetime']
+                if reason is not None:
+                    LOGGER.info('Canceling download : %s' % reason)
+                    break
+                await self.link.write(self.ACK)
+            else:
+                done = True
+        finally:
+            # cancel the download if all the pages are not read
+            if not done:
+                await self.link.write(self.ESC)
+        LOGGER.info('Pages Downloading process was finished')
+
+    @async_retry(tries=3, delay=1)
+    async def _read_dump_page(self):
+        '''Reads a DmpPage and check it.'''
+        page = await self.link.read(DMP_PAGE_SIZE)
+        if len(page) != DMP_PAGE_SIZE:
+            await self.link.write(self.NACK)
+            raise BadDataException()
+        if crc16(page, 0) != 0:
+            LOGGER.error("Check CRC : BAD")
+            await self.link.write(self.NACK)
+            raise BadCRCException()
+        self._replied()
+        LOGGER.info('Dump page no %d ' % page[0])
+        return page
+
+    @async_cached
+    async def archive_period(self):
+        '''Returns number of minutes in the archive period.'''
+        return struct.unpack(b'B', await self.read_from_eeprom("2D", 1))[0]
+
+    @async_cached
+    async def timezone(self):
+        '''Returns timezone offset as string.'''
+        data = await self.read_from_eeprom("14", 3)
+        offset, gmt = struct.unpack(b'<hB', data)
+        if gmt == 1:
+            return "GMT%+.2f" % (offset / 100)
+        return "Localtime"
+
+    @async_cached
+    async def firmware_date(self):
+        '''Return the firmware date code'''
+        await self.wake_up()
+        await self.send("VER", self.OK)
+        data = await self._read_line()
+        return datetime.strptime(data, '%b %d %Y').date()
+
+    @async_cached
+    async def firmware_version(self):
+        '''Returns the firmware version as string'''
+        await self.wake_up()
+        await self.send("NVER", self.OK)
+        return await self._read_line()
+
+    @async_cached
+    async def diagnostics(self):
+        '''Return the Console Diagnostics report. (RXCHECK command)'''
+        await self.wake_up()
+        await self.send("RXCHECK", self.OK)
+        data = [int(i) for i in (await self._read_line()).split()]
+        return dict(total_received=data[0], total_missed=data[1],
+                    resyn=data[2], max_received=data[3],
+                    crc_errors=data[4])
+
+    async def _check_revision(self):
+        '''Check firmware date and get data format revision.'''
+        # Rev "B" firmware dated on or after April 24, 2002
+        self.RevA = self.RevB = True
+        if await self.firmware_date() < datetime(2002, 4, 24).date():
+            self.RevB = False
+        else:
+            self.RevA = False
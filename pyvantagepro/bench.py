@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+'''
+    pyvantagepro.bench
+    ------------------
+
+    Parser micro-benchmarks on synthetic packets, run them with::
+
+        $ python -m pyvantagepro.bench
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import division, unicode_literals, print_function
+import argparse
+import os
+import shutil
+import socket
+import tempfile
+import time
+import timeit
+from datetime import datetime
+
+from .compat import StringIO
+from .corpus import PacketGenerator, RECORD_SIZE, RECORDS_BY_PAGE
+from pylink import TCPLink
+
+from .device import VantagePro2, DMP_PAGE_SIZE
+from .emulator import Console, ConsoleLink, ConsoleServer
+from .framing import FrameReader
+from .parser import (LoopDataParserRevB, LazyLoopDataParserRevB,
+                     Loop2DataParser, ArchiveDataParserRevB, DmpHeaderParser,
+                     DmpPageParser, VantageProCRC, unpack_dmp_pages,
+                     crc16, crc16_table, check_crc_blocks, Schema,
+                     PACKET_FORMATS)
+from .utils import (dict_to_csv, csv_to_dict, UniqueRecords, MetadataCache,
+                    CommandStats)
+
+
+#: Number of pages of the synthetic archive dump.
+DUMP_PAGES = 512
+
+
+def bench(func, number=10000, repeat=3):
+    '''Return the best time in seconds of one call to `func`.'''
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def bench_download(pages, baudrate, pipeline=False):
+    '''Return the time in seconds by page of an archive download from an
+    emulated station at `baudrate`.'''
+    console = Console(pages * RECORDS_BY_PAGE, start=datetime(2014, 1, 1),
+                      baudrate=baudrate)
+    device = VantagePro2(ConsoleLink(console))
+    begin = time.time()
+    for record in device._get_archives_generator(pipeline=pipeline):
+        pass
+    return (time.time() - begin) / pages
+
+
+def bench_socket_read(pages, buffered=False):
+    '''Return the time in seconds by page of reading `pages` DMP pages
+    sent at once on a local socket, with `TCPLink.read` or with a
+    `FrameReader`.'''
+    dump = b''.join(PacketGenerator(0).dmp_pages(datetime(2014, 1, 1),
+                                                 pages))
+    local, remote = socket.socketpair()
+    local.setblocking(0)
+    link = TCPLink('127.0.0.1', 0)
+    link._socket = local
+    reader = FrameReader(link)
+    try:
+        remote.sendall(dump)
+        begin = time.time()
+        for i in range(pages):
+            if buffered:
+                reader.read_exact(DMP_PAGE_SIZE)
+            else:
+                link.read(DMP_PAGE_SIZE)
+        return (time.time() - begin) / pages
+    finally:
+        link._socket = None
+        local.close()
+        remote.close()
+
+
+def bench_server_dump(records=2560):
+    '''Return the time in seconds by record of a full archive download
+    from a `ConsoleServer`, from the connection.'''
+    console = Console(records, baudrate=None)
+    with ConsoleServer(console) as server:
+        begin = time.time()
+        device = VantagePro2.from_url(server.url, 1)
+        assert len(device.get_archives()) == records
+        seconds = time.time() - begin
+        device.link.close()
+    return seconds / records
+
+
+def bench_startup(console, metadata=None):
+    '''Return the time in seconds from the connection to the first
+    real-time data of an emulated `console`, with the time settings of its
+    records.'''
+    begin = time.time()
+    device = VantagePro2(ConsoleLink(console), metadata=metadata)
+    device.archive_period, device.timezone
+    device.get_current_data()
+    return time.time() - begin
+
+
+def run(number=10000, seed=0, corruption=0):
+    '''Run the benchmarks on packets of a `PacketGenerator` and return a
+    list of (name, seconds by packet, bytes by packet).'''
+    generator = PacketGenerator(seed, corruption)
+    dtime = datetime(2014, 1, 1)
+    loop = generator.loop()
+    loop2 = generator.loop2()
+    record = generator.archive_record(dtime)
+    header = generator.dmp_header(DUMP_PAGES)
+    dump = b''.join(generator.dmp_pages(dtime, DUMP_PAGES))
+    page_size = DmpPageParser.get_schema(DmpPageParser.DMP_FORMAT).size
+    page = dump[:page_size]
+    # only the valid pages are parsed, the bad ones would be downloaded again
+    pages = b''.join(dump[i * page_size:(i + 1) * page_size]
+                     for i, valid in enumerate(check_crc_blocks(dump,
+                                                                page_size))
+                     if valid)
+    records = max(len(pages) // page_size * RECORDS_BY_PAGE, 1)
+    loop_keys = ('TempOut', 'TempIn', 'Barometer', 'WindSpeed', 'HumOut')
+
+    def read_lazy_loop():
+        data = LazyLoopDataParserRevB(loop, dtime)
+        return [data[key] for key in loop_keys]
+    results = [
+        ('VantageProCRC.check (LOOP)',
+         bench(lambda: VantageProCRC(loop).check(), number), len(loop)),
+        ('LoopDataParserRevB',
+         bench(lambda: LoopDataParserRevB(loop, dtime), number), len(loop)),
+        ('LazyLoopDataParserRevB (5 fields)',
+         bench(read_lazy_loop, number), len(loop)),
+        ('Loop2DataParser',
+         bench(lambda: Loop2DataParser(loop2, dtime), number), len(loop2)),
+        ('ArchiveDataParserRevB',
+         bench(lambda: ArchiveDataParserRevB(record), number), RECORD_SIZE),
+        ('DmpHeaderParser',
+         bench(lambda: DmpHeaderParser(header), number), len(header)),
+        ('crc16_table (page)',
+         bench(lambda: crc16_table(page), number), page_size),
+        ('crc16 (page)', bench(lambda: crc16(page, 0), number), page_size),
+        ('VantageProCRC.check (page)',
+         bench(lambda: VantageProCRC(page).check(), number), page_size),
+        ('check_crc_blocks (page)',
+         bench(lambda: check_crc_blocks(dump, page_size), 10) / DUMP_PAGES,
+         page_size),
+        ('DmpPageParser',
+         bench(lambda: DmpPageParser(page), number), page_size),
+    ]
+    offsets = [offset for i in range(0, len(pages), page_size)
+               for offset in range(i + 1, i + 1 + RECORD_SIZE *
+                                   RECORDS_BY_PAGE, RECORD_SIZE)]
+
+    def parse_pages():
+        for i in range(0, len(pages), page_size):
+            raw_records = DmpPageParser(pages[i:i + page_size])['Records']
+            for j in range(0, len(raw_records), RECORD_SIZE):
+                ArchiveDataParserRevB(raw_records[j:j + RECORD_SIZE])
+
+    def parse_pages_in_place():
+        buffer = memoryview(bytearray(pages))
+        for offset in offsets:
+            ArchiveDataParserRevB(buffer, offset)
+    # cost by record of a full dump
+    results.extend([
+        ('DmpPageParser (dump, by record)',
+         bench(parse_pages, 1) / records, RECORD_SIZE),
+        ('ArchiveDataParserRevB in place (dump)',
+         bench(parse_pages_in_place, 1) / records, RECORD_SIZE),
+    ])
+    try:
+        seconds = bench(lambda: unpack_dmp_pages(pages), 1) / records
+    except ImportError:
+        # NumPy is not installed
+        pass
+    else:
+        results.append(('unpack_dmp_pages (dump)', seconds, RECORD_SIZE))
+
+    # deduplication and csv serialization of the dump records
+    items = [ArchiveDataParserRevB(pages, offset) for offset in offsets]
+    results.append(('UniqueRecords (by record)',
+                    bench(lambda: list(UniqueRecords()(items)), 10) /
+                    records, RECORD_SIZE))
+    content = dict_to_csv(items, ',', True)
+    row_size = len(content.encode('utf-8')) / (records + 1)
+    results.extend([
+        ('dict_to_csv (by record)',
+         bench(lambda: dict_to_csv(items, ',', True), 1) / records,
+         row_size),
+        ('csv_to_dict (by record)',
+         bench(lambda: csv_to_dict(StringIO(content)), 1) / records,
+         row_size),
+        ('csv_to_dict compact (by record)',
+         bench(lambda: csv_to_dict(StringIO(content), compact=True), 1) /
+         records, row_size),
+    ])
+
+    # archive download from an emulated station
+    for pages, baudrate in ((8, 19200), (256, 1000000)):
+        for pipeline in (False, True):
+            results.append((
+                'DMP download %d bauds%s' % (baudrate, ' (pipelined)'
+                                             if pipeline else ''),
+                bench_download(pages, baudrate, pipeline), page_size))
+
+    # DMP pages received on a socket, one read by page or buffered
+    results.extend([
+        ('TCPLink.read (by DMP page)',
+         min(bench_socket_read(64) for i in range(3)), page_size),
+        ('FrameReader.read_exact (by DMP page)',
+         min(bench_socket_read(64, True) for i in range(3)), page_size),
+    ])
+
+    # instrumentation cost of a command try
+    stats = CommandStats()
+    results.append(('CommandStats.record (by command)',
+                    bench(lambda: stats.record('DMP page', 0.0123, 1, 267),
+                          number), 0))
+
+    # full archive download by TCP, from connection to the last record
+    results.append(('TCP console full dump (by record)',
+                    bench_server_dump(), RECORD_SIZE))
+
+    # connection to the first data, with or without the metadata cache,
+    # with 20 ms by reply
+    console = Console(latency=0.02)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        metadata = MetadataCache(os.path.join(cache_dir, 'metadata.json'))
+        bench_startup(console, metadata)
+        results.extend([
+            ('Startup to first LOOP (no cache)',
+             bench(lambda: bench_startup(console), 1), 0),
+            ('Startup to first LOOP (metadata cache)',
+             bench(lambda: bench_startup(console, metadata), 1), 0),
+        ])
+    finally:
+        shutil.rmtree(cache_dir)
+
+    def compile_schemas():
+        for parser, data_format in PACKET_FORMATS:
+            Schema(data_format, '=', parser.SCALES, parser.EXPANDS,
+                   parser.CORRECTIONS, parser.CONVERTERS, parser.DROPS)
+    # import time cost of the packet schemas
+    results.append(('Schema (all packet formats)',
+                    bench(compile_schemas, 10), 0))
+    return results
+
+
+def main():
+    '''Print the cost by packet of the benchmarks.'''
+    parser = argparse.ArgumentParser(prog='pyvantagepro.bench',
+                                     description='Parser micro-benchmarks.')
+    parser.add_argument('--number', type=int, default=10000,
+                        help='Number of calls of the packet benchmarks.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the synthetic packets.')
+    parser.add_argument('--corruption', type=float, default=0,
+                        help='Probability of a corrupted packet.')
+    args = parser.parse_args()
+    for name, seconds, size in run(args.number, args.seed, args.corruption):
+        print("%-38s %9.2f us %10.0f packets/s %8.2f MB/s"
+              % (name, seconds * 1e6, 1 / seconds, size / seconds / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -40,6 +40,9 @@ is_py33 = (is_py3 and _ver[1] == 3)
 #: Python 3.4.x
 is_py34 = (is_py3 and _ver[1] == 4)
 
+#: Python 3.6+ (asyncio with async generators)
+has_asyncio = (_ver >= (3, 6))
+
 #: Python 2.7.x
 is_py27 = (is_py2 and _ver[1] == 7)
 
@@ -64,6 +67,7 @@ if is_py2:
         from collections import OrderedDict
 
     from StringIO import StringIO
+    from Queue import Queue
 
     def to_char(string):
         if len(string) == 0:
@@ -80,6 +84,7 @@ elif is_py3:
     from logging import NullHandler
     from collections import OrderedDict
     from io import StringIO
+    from queue import Queue
 
     def to_char(string):
         if len(string) == 0:
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+'''
+    pyvantagepro.corpus
+    -------------------
+
+    Synthetic packets generator, for benchmarks and tests.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import division, unicode_literals
+import random
+import struct
+from datetime import timedelta
+
+from .parser import (LoopDataParserRevB, Loop2DataParser,
+                     ArchiveDataParserRevB, DmpHeaderParser, DmpPageParser,
+                     VantageProCRC)
+
+
+#: Raw value of the fields which are not set, by struct format character.
+DASHES = {'B': 0xFF, 'b': 0x7F, 'H': 0x7FFF, 'h': 0x7FFF}
+
+#: Raw bar trend values (falling rapidly ... rising rapidly).
+BAR_TRENDS = (196, 236, 0, 20, 60)
+
+#: Number of archive records by DMP page.
+RECORDS_BY_PAGE = 5
+
+#: Size of an archive record.
+RECORD_SIZE = ArchiveDataParserRevB.get_schema(
+    ArchiveDataParserRevB.ARCHIVE_FORMAT).size
+
+_STRUCTS = {}
+
+
+def pack_format(data_format, values):
+    '''Pack the raw `values` dict of the `data_format` fields. The missing
+    fields are dashed (unused values of the console), the CRC is computed if
+    the format has a `CRC` field.'''
+    packer = _STRUCTS.get(data_format)
+    if packer is None:
+        packer = _STRUCTS[data_format] = struct.Struct(
+            str('=' + ''.join(format_t for _, format_t in data_format)))
+    raw = []
+    for name, format_t in data_format:
+        count, code = int(format_t[:-1] or 1), format_t[-1]
+        value = values.get(name)
+        if code == 's':
+            raw.append(b'\xff' * count if value is None else value)
+        elif count > 1:
+            raw.extend([DASHES[code]] * count if value is None else value)
+        else:
+            raw.append(DASHES[code] if value is None else value)
+    data = packer.pack(*raw)
+    if data_format[-1][0] == 'CRC':
+        data = VantageProCRC(data[:-2]).data_with_checksum
+    return data
+
+
+class PacketGenerator(object):
+    '''Generates valid packets with random but plausible values, as sent by
+    the station.
+
+    :param seed: The seed of the random values, for reproducible packets.
+
+    :param corruption: The probability that a packet with CRC has one bit
+        flipped, which is always detected as a CRC error.
+    '''
+
+    def __init__(self, seed=None, corruption=0):
+        self.random = random.Random(seed)
+        self.corruption = corruption
+
+    def pack(self, data_format, values):
+        '''Pack `values` with `pack_format` and corrupt the packet with the
+        `corruption` probability.'''
+        data = pack_format(data_format, values)
+        if data_format[-1][0] == 'CRC' and \
+                self.random.random() < self.corruption:
+            data = self.corrupt(data)
+        return data
+
+    def corrupt(self, data):
+        '''Return `data` with one random bit flipped.'''
+        data = bytearray(data)
+        data[self.random.randrange(len(data))] ^= 1 << self.random.randrange(8)
+        return bytes(data)
+
+    def _time(self, start, stop):
+        '''Random "HHMM" packed time between the `start` and `stop` hours.'''
+        return (100 * self.random.randrange(start, stop) +
+                self.random.randrange(60))
+
+    def loop(self):
+        '''Return a LOOP packet (`LoopDataParserRevB`).'''
+        randint = self.random.randint
+        values = {
+            'LOO': b'LOO', 'BarTrend': self.random.choice(BAR_TRENDS),
+            'PacketType': 0, 'NextRec': randint(0, 2559),
+            'Barometer': randint(28500, 30800), 'TempIn': randint(600, 800),
+            'HumIn': randint(20, 70), 'TempOut': randint(200, 950),
+            'WindSpeed': randint(0, 40), 'WindSpeed10Min': randint(0, 30),
+            'WindDir': randint(1, 360), 'HumOut': randint(10, 100),
+            'RainRate': randint(0, 200), 'UV': randint(0, 120),
+            'SolarRad': randint(0, 1200), 'RainStorm': randint(0, 300),
+            'StormStartDate': 0xFFFF, 'RainDay': randint(0, 200),
+            'RainMonth': randint(0, 800), 'RainYear': randint(0, 4000),
+            'ETDay': randint(0, 300), 'ETMonth': randint(0, 800),
+            'ETYear': randint(0, 4000), 'AlarmIn': 0, 'AlarmRain': 0,
+            'AlarmOut': b'\x00' * 2, 'AlarmExTempHum': b'\x00' * 8,
+            'AlarmSoilLeaf': b'\x00' * 4, 'BatteryStatus': 0,
+            'BatteryVolts': randint(700, 900),
+            'ForecastIcon': self.random.choice((2, 3, 6, 8, 18, 19, 22, 23)),
+            'ForecastRuleNo': randint(0, 196), 'SunRise': self._time(5, 8),
+            'SunSet': self._time(17, 21), 'EOL': b'\n\r',
+        }
+        return self.pack(LoopDataParserRevB.LOOP_FORMAT, values)
+
+    def loop2(self):
+        '''Return a LOOP2 packet (`Loop2DataParser`).'''
+        randint = self.random.randint
+        barometer = randint(28500, 30800)
+        values = {
+            'LOO': b'LOO', 'BarTrend': self.random.choice(BAR_TRENDS),
+            'PacketType': 1, 'Barometer': barometer,
+            'TempIn': randint(600, 800), 'HumIn': randint(20, 70),
+            'TempOut': randint(200, 950), 'WindSpeed': randint(0, 40),
+            'WindDir': randint(1, 360), 'WindSpeed10Min': randint(0, 300),
+            'WindSpeed2Min': randint(0, 300), 'WindGust10Min': randint(0, 50),
+            'WindGustDir10Min': randint(1, 360), 'DewPoint': randint(10, 70),
+            'HumOut': randint(10, 100), 'HeatIndex': randint(20, 95),
+            'WindChill': randint(10, 95), 'THSW': randint(10, 110),
+            'RainRate': randint(0, 200), 'UV': randint(0, 120),
+            'SolarRad': randint(0, 1200), 'RainStorm': randint(0, 300),
+            'StormStartDate': 0xFFFF, 'RainDay': randint(0, 200),
+            'Rain15Min': randint(0, 20), 'RainHour': randint(0, 50),
+            'ETDay': randint(0, 300), 'Rain24Hours': randint(0, 300),
+            'BarReduction': randint(0, 2), 'BarOffset': randint(-100, 100),
+            'BarCalibration': randint(0, 100),
+            'BarRaw': barometer - randint(0, 1000),
+            'BarAbsolute': barometer - randint(0, 1000),
+            'Altimeter': barometer + randint(-50, 50), 'EOL': b'\n\r',
+        }
+        return self.pack(Loop2DataParser.LOOP2_FORMAT, values)
+
+    def archive_record(self, dtime):
+        '''Return an archive record (`ArchiveDataParserRevB`) stamped with
+        `dtime`.'''
+        randint = self.random.randint
+        temp = randint(200, 950)
+        solar = randint(0, 1200)
+        uv = randint(0, 120)
+        values = {
+            'DateStamp': dtime.day + dtime.month * 32 +
+            (dtime.year - 2000) * 512,
+            'TimeStamp': 100 * dtime.hour + dtime.minute,
+            'TempOut': temp, 'TempOutHi': temp + randint(0, 15),
+            'TempOutLow': temp - randint(0, 15), 'RainRate': randint(0, 200),
+            'RainRateHi': randint(200, 400),
+            'Barometer': randint(28500, 30800), 'SolarRad': solar,
+            'WindSamps': randint(100, 120), 'TempIn': randint(600, 800),
+            'HumIn': randint(20, 70), 'HumOut': randint(10, 100),
+            'WindAvg': randint(0, 30), 'WindHi': randint(30, 60),
+            'WindHiDir': randint(0, 15), 'WindAvgDir': randint(0, 15),
+            'UV': uv, 'ETHour': randint(0, 30),
+            'SolarRadHi': solar + randint(0, 100), 'UVHi': uv + randint(0, 5),
+            'ForecastRuleNo': randint(0, 196), 'RecType': 0,
+        }
+        return self.pack(ArchiveDataParserRevB.ARCHIVE_FORMAT, values)
+
+    def archive_records(self, start, count, period=5):
+        '''Return `count` archive records, every `period` minutes from the
+        `start` datetime.'''
+        return [self.archive_record(start + timedelta(minutes=i * period))
+                for i in range(count)]
+
+    def dmp_header(self, pages, offset=0):
+        '''Return a DMPAFT header (`DmpHeaderParser`).'''
+        return self.pack(DmpHeaderParser.DMP_FORMAT,
+                         {'Pages': pages, 'Offset': offset})
+
+    def dmp_page(self, index, records):
+        '''Return a DMP page (`DmpPageParser`) with up to 5 raw archive
+        `records`, the unused records are dashed.'''
+        records = list(records)
+        records.extend([b'\xff' * RECORD_SIZE] *
+                       (RECORDS_BY_PAGE - len(records)))
+        return self.pack(DmpPageParser.DMP_FORMAT,
+                         {'Index': index % 256, 'Records': b''.join(records),
+                          'unused': [0] * 4})
+
+    def dmp_pages(self, start, count, period=5):
+        '''Return `count` full DMP pages of archive records, every `period`
+        minutes from the `start` datetime.'''
+        records = self.archive_records(start, count * RECORDS_BY_PAGE, period)
+        return [self.dmp_page(i, records[i * RECORDS_BY_PAGE:
+                                         (i + 1) * RECORDS_BY_PAGE])
+                for i in range(count)]
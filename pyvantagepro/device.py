@@ -11,16 +11,26 @@
 '''
 from __future__ import division, unicode_literals
 import struct
+import threading
+import time
 from datetime import datetime, timedelta
 from pylink import link_from_url, SerialLink
 
 from .logger import LOGGER
-from .utils import (cached_property, retry, bytes_to_hex,
-                    ListDict, is_bytes)
-
-from .parser import (LoopDataParserRevB, DmpHeaderParser, DmpPageParser,
+from .compat import Queue
+from .framing import FrameReader
+from .utils import (cached_property, retry, bytes_to_hex, hex_to_bytes,
+                    ListDict, is_bytes, Checkpoint, UniqueRecords,
+                    CommandStats, AdaptiveTimeouts)
+
+from .parser import (LoopDataParserRevB, LazyLoopDataParserRevB,
+                     parse_loop_packet, DmpHeaderParser, DmpPageParser,
                      ArchiveDataParserRevB, VantageProCRC, pack_datetime,
-                     unpack_datetime, pack_dmp_date_time)
+                     unpack_datetime, pack_dmp_date_time, crc16)
+
+
+#: Size of a DMP page: index, 5 archive records, 4 unused bytes and CRC.
+DMP_PAGE_SIZE = DmpPageParser.get_schema(DmpPageParser.DMP_FORMAT).size
 
 
 class NoDeviceException(Exception):
@@ -46,65 +56,314 @@ class BadDataException(Exception):
         return self.__doc__
 
 
+def parse_dump_page(buffer, offset, start_date, stop_date, skip=0,
+                    previous=None):
+    '''Parses the archive records of the DMP page at `offset` of `buffer`.
+    Returns the records between `start_date` and `stop_date`, and the
+    reason to cancel the download if it must stop after this page, else
+    None.
+
+    :param skip: The number of records skipped without parsing them, the
+        'Offset' of the DMPAFT header for the first page.
+
+    :param previous: The datetime of the previous downloaded record of the
+        same download (DMPAFT command). The records are in ascending order,
+        so an older record is an old record of the archive memory, which has
+        wrapped around.
+    '''
+    records = []
+    # offsets = [offset + 1, offset + 53, ... , offset + 209]
+    for r_offset in range(offset + 1 + skip * 52, offset + 261, 52):
+        record = ArchiveDataParserRevB(buffer, r_offset)
+        # verify that record has valid data, and store
+        r_time = record['Datetime']
+        if r_time is None:
+            LOGGER.error('Invalid record detected')
+            return records, 'Finish'
+        if r_time > stop_date:
+            return records, 'Stop date reached'
+        if previous is not None and r_time <= previous:
+            return records, 'Archive memory wrapped around'
+        if start_date < r_time:
+            records.append(record)
+            previous = r_time
+        else:
+            LOGGER.info('The record is not in the datetime range')
+    return records, None
+
+
+class EepromCache(object):
+    '''Image of EEPROM blocks of the console. A block is read at once by
+    the first access to one of its addresses, the next accesses are served
+    from the image. The addresses outside the blocks are read directly.
+
+    :param read: The function which reads `size` bytes at a hex address
+        (`VantagePro2.read_from_eeprom`).
+
+    :param blocks: The (address, size) of the cached blocks.
+    '''
+
+    def __init__(self, read, blocks):
+        self.read_eeprom = read
+        self.blocks = tuple(blocks)
+        # the block images by address
+        self.images = {}
+        # the number of reads served from the images, by address
+        self.served = {}
+        self.block_reads = 0
+        self.direct_reads = 0
+
+    def read(self, address, size):
+        '''Returns the `size` bytes at `address`.'''
+        for start, length in self.blocks:
+            if start <= address and address + size <= start + length:
+                break
+        else:
+            self.direct_reads += 1
+            return self.read_eeprom('%.2X' % address, size)
+        image = self.images.get(start)
+        if image is None:
+            image = self.images[start] = self.read_eeprom('%.2X' % start,
+                                                          length)
+            self.block_reads += 1
+        else:
+            self.served[address] = self.served.get(address, 0) + 1
+        return image[address - start:address - start + size]
+
+    def unpack(self, address, data_format):
+        '''Returns the values of the struct `data_format` at `address`.'''
+        return struct.unpack(data_format, self.read(
+            address, struct.calcsize(data_format)))
+
+    def invalidate(self, address=None, size=1):
+        '''Forgets the images of the blocks with the `size` bytes at
+        `address`, or all of them if `address` is None.'''
+        for start, length in self.blocks:
+            if address is None or (address < start + length and
+                                   start < address + size):
+                self.images.pop(start, None)
+
+    def report(self):
+        '''Returns the number of block and direct reads, and the number of
+        reads served from the images by hex address.'''
+        return {'block_reads': self.block_reads,
+                'direct_reads': self.direct_reads,
+                'served': dict(('%.2X' % address, count)
+                               for address, count in self.served.items())}
+
+
+class _CommandTimer(object):
+    '''Records a try of a command in the `command_stats` of a
+    `VantagePro2`: its duration, the bytes sent and received, and its
+    exception. The round trip of a successful try is learned by the
+    `timeouts` of the device, and the context manager returns the deadline
+    of the try (None until its timeout is learned).'''
+    __slots__ = ('device', 'command', 'begin', 'sent', 'received')
+
+    def __init__(self, device, command):
+        self.device = device
+        self.command = command
+
+    def __enter__(self):
+        self.sent = self.device.bytes_out
+        self.received = self.device.reader.consumed
+        timeouts = self.device.timeouts
+        timeout = None if timeouts is None else timeouts.timeout(self.command)
+        self.begin = time.time()
+        if timeout is not None:
+            return self.begin + timeout
+
+    def __exit__(self, error, value, traceback):
+        device = self.device
+        seconds = time.time() - self.begin
+        device.command_stats.record(
+            self.command, seconds, device.bytes_out - self.sent,
+            device.reader.consumed - self.received, error)
+        timeouts = device.timeouts
+        if timeouts is None:
+            return
+        if error is None:
+            timeouts.observe(self.command, seconds)
+        elif not issubclass(error, BadCRCException):
+            # a missing or bad reply, the next try waits longer
+            timeouts.failed(self.command)
+
+
 class VantagePro2(object):
     '''Communicates with the station by sending commands, reads the binary
     data and parsing it into usable scalar values.
 
     :param link: A `PyLink` connection.
+
+    :param retry_policy: A `RetryPolicy` used by all the retried commands
+        instead of their default tries and delay.
+
+    :param metadata: A `MetadataCache` of the firmware and EEPROM
+        configuration, which are not queried while the entry of the link
+        URL is fresh.
+
+    The round trips of the commands are recorded in `command_stats` (see
+    `stats`), its `hook` is called after each of them.
+
+    The replies are awaited until the link timeout, or until the timeout
+    learned by `timeouts` from the round trips of the command, an
+    `AdaptiveTimeouts` (None to always use the link timeout). The learned
+    timeouts are at most the link timeout.
     '''
 
     # device reply commands
-    WAKE_STR = '\n'
-    WAKE_ACK = '\n\r'
-    ACK = '\x06'
-    NACK = '\x21'
-    DONE = 'DONE\n\r'
-    CANCEL = '\x18'
-    ESC = '\x1b'
-    OK = '\n\rOK\n\r'
-
-    def __init__(self, link):
+    WAKE_STR = b'\n'
+    WAKE_ACK = b'\n\r'
+    ACK = b'\x06'
+    NACK = b'\x21'
+    DONE = b'DONE\n\r'
+    CANCEL = b'\x18'
+    ESC = b'\x1b'
+    OK = b'\n\rOK\n\r'
+
+    # number of packets requested by a 'LOOP' command when streaming
+    LOOP_PACKETS = 200
+    # number of downloaded dump pages waiting to be parsed when pipelined
+    DMP_PIPELINE_PAGES = 8
+    # seconds after the last reply while the console is known to be awake
+    # (it sleeps after 2 minutes without activity)
+    AWAKE_WINDOW = 90
+    # (address, size) of the EEPROM blocks read at once, the configuration
+    # from the barometer calibration to the archive period
+    EEPROM_BLOCKS = ((0x00, 0x2E),)
+    # seconds without a byte after which the stopped LOOP packets are all
+    # received
+    LOOP_STOP_QUIET = 0.1
+    # seconds without a byte after which the dump page sent again after the
+    # last NACK of a failed download is discarded
+    DMP_RESEND_QUIET = 0.1
+    # minimum learned timeout of a command in seconds, at most the link
+    # timeout
+    TIMEOUT_FLOOR = 1
+
+    def __init__(self, link, retry_policy=None, metadata=None):
         self.link = link
+        self.retry_policy = retry_policy
+        self.metadata = metadata
+        # all the replies are read through the buffered reader
+        self.reader = FrameReader(link)
+        # the writes are counted for the command statistics
+        self.bytes_out = 0
+        self.command_stats = CommandStats(crc_errors=(BadCRCException,))
+        link_timeout = getattr(link, 'timeout', None)
+        self.timeouts = AdaptiveTimeouts(
+            floor=min(self.TIMEOUT_FLOOR, link_timeout or self.TIMEOUT_FLOOR),
+            ceiling=link_timeout)
+        # time of the last reply of the console
+        self._reply_time = None
+        self.eeprom = EepromCache(self.read_from_eeprom, self.EEPROM_BLOCKS)
         self.link.open()
-        self._check_revision()
+        if not self._load_metadata():
+            self._check_revision()
+            if self.metadata is not None:
+                self._save_metadata()
 
     @classmethod
-    def from_url(cls, url, timeout=10):
+    def from_url(cls, url, timeout=10, retry_policy=None, metadata=None):
         ''' Get device from url.
 
         :param url: A `PyLink` connection URL.
         :param timeout: Set a read timeout value.
+        :param retry_policy: A `RetryPolicy` for the retried commands.
+        :param metadata: A `MetadataCache` of the station metadata.
         '''
         link = link_from_url(url)
         link.settimeout(timeout)
-        return cls(link)
+        return cls(link, retry_policy, metadata)
 
     @classmethod
-    def from_serial(cls, tty, baud, timeout=10):
+    def from_serial(cls, tty, baud, timeout=10, retry_policy=None,
+                    metadata=None):
         ''' Get device from serial port.
 
         :param url: A `PyLink` connection URL.
         :param timeout: Set a read timeout value.
+        :param retry_policy: A `RetryPolicy` for the retried commands.
+        :param metadata: A `MetadataCache` of the station metadata.
         '''
         link = SerialLink(tty, baud)
         link.settimeout(timeout)
-        return cls(link)
+        return cls(link, retry_policy, metadata)
+
+    @property
+    def awake(self):
+        '''True if the console replied during the last `AWAKE_WINDOW`
+        seconds.'''
+        return (self._reply_time is not None and
+                time.time() - self._reply_time < self.AWAKE_WINDOW)
+
+    def _replied(self, ok=True):
+        '''Records a reply of the console, or forgets the awake state if
+        the reply is not the expected one.'''
+        self._reply_time = time.time() if ok else None
+
+    def _write(self, data):
+        '''Writes `data` to the link.'''
+        self.bytes_out += len(data)
+        self.link.write(data)
+
+    def _read_reply(self, size, deadline=None):
+        '''Returns the `size` bytes of a reply. A short reply forgets the
+        awake state and raises `BadDataException`.'''
+        data = self.reader.read_exact(size, deadline)
+        if len(data) != size:
+            self._replied(False)
+            raise BadDataException()
+        return data
+
+    def _read_line(self):
+        '''Returns a text reply, without its end of line. A short reply
+        forgets the awake state and raises `BadDataException`.'''
+        data = self.reader.read_until(b'\n\r')
+        if not data.endswith(b'\n\r'):
+            self._replied(False)
+            raise BadDataException()
+        return data[:-2].decode('ascii')
+
+    def _measure(self, command):
+        '''Returns a context manager which records a try of `command` in
+        the `command_stats`.'''
+        return _CommandTimer(self, command)
+
+    def stats(self):
+        '''Returns the statistics of the commands: the number of tries,
+        errors, CRC errors and retries, the bytes sent and received, and
+        the latency summary in seconds (count, min, mean, p50, p90, p99,
+        max), by command name: 'wake_up', 'EEBRD', 'LOOP', 'DMPAFT',
+        'DMP page', and 'send VER', 'send LOOP'... for the acknowledgement
+        of each sent command ('send data' for the binary data).'''
+        return self.command_stats.snapshot()
 
     @retry(tries=3, delay=1)
-    def wake_up(self):
-        '''Wakeup the station console.'''
+    def wake_up(self, force=False):
+        '''Wakeup the station console, unless it is known to be `awake`.
+
+        :param force: If True, wakes up the console even if it is `awake`.
+        '''
+        if self.awake and not force:
+            return True
         wait_ack = self.WAKE_ACK
         LOGGER.info("try wake up console")
-        self.link.write(self.WAKE_STR)
-        ack = self.link.read(len(wait_ack))
-        if wait_ack == ack:
-            LOGGER.info("Check ACK: OK (%s)" % (repr(ack)))
-            return True
-        #Sometimes we have a 1byte shift from Vantage Pro and that's why wake up doesn't work anymore
-        #We just shift another 1byte to be aligned in the serial buffer again.
-        self.link.read(1)
-        LOGGER.error("Check ACK: BAD (%s != %s)" % (repr(wait_ack), repr(ack)))
-        raise NoDeviceException()
+        with self._measure('wake_up') as deadline:
+            self._write(self.WAKE_STR)
+            ack = self.reader.read_exact(len(wait_ack), deadline)
+            if wait_ack == ack:
+                LOGGER.info("Check ACK: OK (%s)" % (repr(ack)))
+                self._replied()
+                return True
+            self._replied(False)
+            # Sometimes we have a 1byte shift from Vantage Pro and that's why
+            # wake up doesn't work anymore. We just shift another 1byte to be
+            # aligned in the serial buffer again.
+            self.reader.read_exact(1, deadline)
+            LOGGER.error("Check ACK: BAD (%s != %s)"
+                         % (repr(wait_ack), repr(ack)))
+            raise NoDeviceException()
 
     @retry(tries=3, delay=0.5)
     def send(self, data, wait_ack=None, timeout=None):
@@ -116,220 +375,546 @@ class VantagePro2(object):
          :param wait_ack: If `wait_ack` is not None, the function must check
             that acknowledgement is the one expected.
 
-         :param timeout: Define this timeout when reading ACK from link﻿.
+         :param timeout: Define this timeout when reading ACK from link﻿,
+            as a factor of the link timeout, instead of the learned timeout.
          '''
+        if self._reply_time is None and wait_ack is not None and \
+                not is_bytes(data):
+            # the last reply was bad, the console may have gone to sleep
+            self.wake_up()
         if is_bytes(data):
-            LOGGER.info("try send : %s" % bytes_to_hex(data))
-            self.link.write(data)
+            command = 'send data'
         else:
-            LOGGER.info("try send : %s" % data)
-            self.link.write("%s\n" % data)
-        if wait_ack is None:
-            return True
-        ack = self.link.read(len(wait_ack), timeout=timeout)
-        if wait_ack == ack:
-            LOGGER.info("Check ACK: OK (%s)" % (repr(ack)))
-            return True
-        LOGGER.error("Check ACK: BAD (%s != %s)" % (repr(wait_ack), repr(ack)))
-        raise BadAckException()
+            command = 'send %s' % data.split(' ', 1)[0]
+        with self._measure(command) as deadline:
+            if is_bytes(data):
+                LOGGER.info("try send : %s" % bytes_to_hex(data))
+                self._write(data)
+            else:
+                LOGGER.info("try send : %s" % data)
+                self._write("%s\n" % data)
+            if wait_ack is None:
+                return True
+            if not is_bytes(wait_ack):
+                wait_ack = wait_ack.encode('ascii')
+            if timeout is not None or deadline is None:
+                deadline = self.reader.deadline(timeout)
+            ack = self.reader.read_exact(len(wait_ack), deadline)
+            self._replied(wait_ack == ack)
+            if wait_ack == ack:
+                LOGGER.info("Check ACK: OK (%s)" % (repr(ack)))
+                return True
+            LOGGER.error("Check ACK: BAD (%s != %s)"
+                         % (repr(wait_ack), repr(ack)))
+            raise BadAckException()
 
     @retry(tries=3, delay=1)
     def read_from_eeprom(self, hex_address, size):
         '''Reads from EEPROM the `size` number of bytes starting at the
         `hex_address`. Results are given as hex strings.'''
-        self.link.write("EEBRD %s %.2d\n" % (hex_address, size))
-        ack = self.link.read(len(self.ACK))
-        if self.ACK == ack:
-            LOGGER.info("Check ACK: OK (%s)" % (repr(ack)))
-            data = self.link.read(size + 2)  # 2 bytes for CRC
-            if VantageProCRC(data).check():
-                return data[:-2]
+        self.wake_up()
+        with self._measure('EEBRD') as deadline:
+            self._write("EEBRD %s %.2X\n" % (hex_address, size))
+            ack = self.reader.read_exact(len(self.ACK), deadline)
+            self._replied(self.ACK == ack)
+            if self.ACK == ack:
+                LOGGER.info("Check ACK: OK (%s)" % (repr(ack)))
+                # 2 bytes for CRC
+                data = self._read_reply(size + 2, deadline)
+                if VantageProCRC(data).check():
+                    return data[:-2]
+                else:
+                    raise BadCRCException()
             else:
-                raise BadCRCException()
-        else:
-            msg = "Check ACK: BAD (%s != %s)" % (repr(self.ACK), repr(ack))
-            LOGGER.error(msg)
-            raise BadAckException()
+                msg = "Check ACK: BAD (%s != %s)" % (repr(self.ACK),
+                                                     repr(ack))
+                LOGGER.error(msg)
+                raise BadAckException()
+
+    def write_to_eeprom(self, hex_address, data):
+        '''Writes the `data` bytes to EEPROM at the `hex_address`, the cached
+        EEPROM blocks are read again on their next access.'''
+        self.wake_up()
+        try:
+            self.send("EEBWR %s %.2X" % (hex_address, len(data)), self.ACK)
+            self.send(VantageProCRC(data).data_with_checksum, self.ACK)
+        finally:
+            self.eeprom.invalidate(int(hex_address, 16), len(data))
+            self._forget_metadata()
 
     def gettime(self):
         '''Returns the current datetime of the console.'''
         self.wake_up()
         self.send("GETTIME", self.ACK)
-        data = self.link.read(8)
+        data = self._read_reply(8)
         return unpack_datetime(data)
 
     def settime(self, dtime):
         '''Set the given `dtime` on the station.'''
         self.wake_up()
         self.send("SETTIME", self.ACK)
-        self.send(pack_datetime(dtime), self.ACK)
-
-    def get_current_data(self):
-        '''Returns the real-time data as a `Dict`.'''
+        try:
+            self.send(pack_datetime(dtime), self.ACK)
+        finally:
+            # the console may update its time settings
+            self.eeprom.invalidate()
+            self._forget_metadata()
+
+    def get_current_data(self, lazy=False):
+        '''Returns the real-time data as a `Dict`.
+
+        :param lazy: If True, returns a `LazyLoopDataParserRevB` which only
+            decodes the fields which are read.
+        '''
         self.wake_up()
-        self.send("LOOP 1", self.ACK)
-        current_data = self.link.read(99)
+        with self._measure('LOOP') as deadline:
+            self.send("LOOP 1", self.ACK)
+            current_data = self._read_reply(99, deadline)
         if self.RevB:
+            if lazy:
+                return LazyLoopDataParserRevB(current_data, datetime.now())
             return LoopDataParserRevB(current_data, datetime.now())
         else:
             raise NotImplementedError('Do not support RevB data format')
 
-    def get_archives(self, start_date=None, stop_date=None):
+    def get_loop_packets(self, count=1, loop_types=3):
+        '''Yields `count` real-time packets of the types selected by the
+        `loop_types` bitmask (1: LOOP, 2: LOOP2) with the 'LPS' command.
+        The console sends the selected types in turn. Packets are
+        `LoopDataParserRevB` or `Loop2DataParser` dicts, in the order sent
+        by the console.
+
+        :param count: The number of packets, of all the types.
+
+        :param loop_types: The bitmask of the LOOP packet types.
+        '''
+        if not self.RevB:
+            raise NotImplementedError('Do not support RevB data format')
+        size = LoopDataParserRevB.get_schema(
+            LoopDataParserRevB.LOOP_FORMAT).size
+        self.wake_up()
+        self.send("LPS %d %d" % (loop_types, count), self.ACK)
+        received = 0
+        try:
+            while received < count:
+                data = self._read_reply(size)
+                self._replied()
+                received += 1
+                yield parse_loop_packet(data, datetime.now())
+        finally:
+            if received < count:
+                self._stop_loop()
+
+    def stream_current_data(self, count=None, interval=None, lazy=False):
+        '''Yields the real-time data as the console sends it, every 2
+        seconds. A single 'LOOP' command requests `LOOP_PACKETS` packets and
+        is sent again when they are all received, without wake-up.
+
+        :param count: The number of packets to yield, None to stream until
+            the generator is closed.
+
+        :param interval: The minimum number of seconds between the yielded
+            packets, the packets received in between are skipped.
+
+        :param lazy: If True, yields `LazyLoopDataParserRevB` packets.
+        '''
+        if not self.RevB:
+            raise NotImplementedError('Do not support RevB data format')
+        parser = LazyLoopDataParserRevB if lazy else LoopDataParserRevB
+        size = LoopDataParserRevB.get_schema(
+            LoopDataParserRevB.LOOP_FORMAT).size
+        yielded = pending = 0
+        last = None
+        self.wake_up()
+        try:
+            while count is None or yielded < count:
+                if not pending:
+                    pending = self.LOOP_PACKETS
+                    if count is not None and not interval:
+                        pending = min(pending, count - yielded)
+                    self.send("LOOP %d" % pending, self.ACK)
+                data = self._read_reply(size)
+                self._replied()
+                pending -= 1
+                now = time.time()
+                if interval and last is not None and now - last < interval:
+                    continue
+                last = now
+                yielded += 1
+                yield parser(data, datetime.now())
+        finally:
+            if pending:
+                self._stop_loop()
+
+    def _stop_loop(self):
+        '''Stops the LOOP packets of the console and discards the packets
+        already sent, up to the reply to the wake-up and until the link is
+        quiet for `LOOP_STOP_QUIET` seconds.'''
+        LOGGER.info("stop LOOP packets")
+        self._write(self.WAKE_STR)
+        self.reader.read_until(self.WAKE_ACK)
+        self.reader.drain(quiet=self.LOOP_STOP_QUIET)
+
+    def get_archives(self, start_date=None, stop_date=None, compact=False,
+                     pipeline=False, resumes=0, checkpoint=None,
+                     duplicates='first'):
         '''Get archive records until `start_date` and `stop_date` as
         ListDict.
 
         :param start_date: The beginning datetime record.
 
         :param stop_date: The stopping datetime record.
+
+        :param compact: If True, records are returned as compact `Record`
+            instead of `ArchiveDataParserRevB` dicts.
+
+        :param pipeline: If True, the next page is downloaded while the
+            records of the previous one are parsed.
+
+        :param resumes: The number of times a download interrupted by a bad
+            page is resumed after the last good record, instead of
+            returning the records downloaded so far.
+
+        :param checkpoint: The path of a state file where the last
+            downloaded record is saved after each page. The next download
+            with the same state file starts after this record.
+
+        :param duplicates: The record kept among the records with the same
+            datetime, see `UniqueRecords`.
+        '''
+        generator = self._get_archives_generator(start_date, stop_date,
+                                                 pipeline, resumes,
+                                                 checkpoint)
+        unique = UniqueRecords(duplicates)
+        archives = ListDict(item.to_record() if compact else item
+                            for item in unique(generator))
+        # the downloaded records are already sorted
+        if unique.reordered:
+            return archives.sorted_by('Datetime')
+        return archives
+
+    def _get_archives_generator(self, start_date=None, stop_date=None,
+                                pipeline=False, resumes=0, checkpoint=None):
+        '''Get archive records generator until `start_date` and `stop_date`.
+        The checkpoint of a page is saved when the generator is resumed after
+        its last record, once the caller has handled it.
+
+        :param pipeline: If True, the pages are downloaded in a thread while
+            the records are parsed (see `_read_dump_pages_pipelined`).
+
+        :param resumes: The number of times an interrupted download is
+            resumed with a new 'DMPAFT' command.
+
+        :param checkpoint: The path of the `Checkpoint` state file.
         '''
-        generator = self._get_archives_generator(start_date, stop_date)
-        archives = ListDict()
-        dates = []
-        for item in generator:
-            if item['Datetime'] not in dates:
-                archives.append(item)
-                dates.append(item['Datetime'])
-        return archives.sorted_by('Datetime')
-
-    def _get_archives_generator(self, start_date=None, stop_date=None):
-        '''Get archive records generator until `start_date` and `stop_date`.'''
-        self.wake_up()
         # 2001-01-01 01:01:01
         start_date = start_date or datetime(2001, 1, 1, 1, 1, 1)
         stop_date = stop_date or datetime.now()
+        if checkpoint is not None:
+            checkpoint = Checkpoint(checkpoint)
+            if checkpoint.datetime is not None:
+                start_date = max(start_date, checkpoint.datetime)
+        r_index = 0
+        while True:
+            skip, pages = self._start_dump(start_date, pipeline)
+            # the wrap-around of the archive memory is detected within one
+            # download, a resumed download may send the last record again
+            previous = None
+            try:
+                for buffer, offset in pages:
+                    if not self.RevB:
+                        raise NotImplementedError('Do not support RevA data '
+                                                  'format')
+                    records, reason = parse_dump_page(buffer, offset,
+                                                      start_date, stop_date,
+                                                      skip, previous)
+                    # only the first page has stale records
+                    skip = 0
+                    for record in records:
+                        LOGGER.info("Record-%.4d - Datetime : %s"
+                                    % (r_index, record['Datetime']))
+                        r_index += 1
+                        yield record
+                    if records:
+                        # a resumed download starts after this record
+                        start_date = previous = records[-1]['Datetime']
+                        if checkpoint is not None:
+                            checkpoint.save(start_date)
+                    if reason is not None:
+                        LOGGER.info('Canceling download : %s' % reason)
+                        break
+                break
+            except (BadCRCException, BadDataException) as e:
+                LOGGER.error('Error: %s' % e)
+                # discard the page sent again after the last NACK, if any
+                self.reader.drain(quiet=self.DMP_RESEND_QUIET)
+                if resumes <= 0:
+                    LOGGER.info('Canceling download : Finish')
+                    break
+                resumes -= 1
+                LOGGER.info('Resuming download after %s' % start_date)
+            finally:
+                # cancel the download if all the pages are not read
+                pages.close()
+        LOGGER.info('Pages Downloading process was finished')
+
+    def _start_dump(self, start_date, pipeline=False):
+        '''Sends the 'DMPAFT' command of the records after `start_date`,
+        rounded to the archive period. Returns the number of stale records
+        of the first page (the 'Offset' of the header) and the pages
+        generator.'''
+        self.wake_up()
         # round start_date, with the archive period to the previous record
         period = self.archive_period
         minutes = (start_date.minute % period)
         start_date = start_date - timedelta(minutes=minutes)
-        self.send("DMPAFT", self.ACK)
-        # I think that date_time_crc is incorrect...
-        self.link.write(pack_dmp_date_time(start_date))
-        # timeout must be at least 2 seconds
-        ack = self.link.read(len(self.ACK), timeout=2)
-        if ack != self.ACK:
-            raise BadAckException()
-        # Read dump header and get number of pages
-        header = DmpHeaderParser(self.link.read(6))
-        # Write ACK if crc is good. Else, send cancel.
-        if header.crc_error:
-            self.link.write(self.CANCEL)
-            raise BadCRCException()
-        else:
-            self.link.write(self.ACK)
+        with self._measure('DMPAFT') as deadline:
+            self.send("DMPAFT", self.ACK)
+            # I think that date_time_crc is incorrect...
+            self._write(pack_dmp_date_time(start_date))
+            # until learned, the timeout is 2 times the link timeout
+            ack = self.reader.read_exact(
+                len(self.ACK), deadline or self.reader.deadline(2))
+            if ack != self.ACK:
+                raise BadAckException()
+            # Read dump header and get number of pages
+            header = DmpHeaderParser(self.reader.read_exact(6, deadline))
+            # Write ACK if crc is good. Else, send cancel.
+            if header.crc_error:
+                self._write(self.CANCEL)
+                raise BadCRCException()
+            else:
+                self._write(self.ACK)
         LOGGER.info('Starting download %d dump pages' % header['Pages'])
-        finish = False
-        r_index = 0
-        for i in range(header['Pages']):
+        if pipeline:
+            pages = self._read_dump_pages_pipelined(header['Pages'])
+        else:
+            pages = self._read_dump_pages(header['Pages'])
+        # a page has 5 records, a bad offset is ignored
+        skip = header['Offset'] if 0 <= header['Offset'] < 5 else 0
+        return skip, pages
+
+    def _read_dump_pages(self, pages):
+        '''Yields the (buffer, offset) of the `pages` downloaded dump pages.
+        The next page is requested when the generator is resumed, the download
+        is canceled when it is closed. A bad page cancels the download and
+        its error is raised.'''
+        # One buffer for the whole download, pages and records are parsed in
+        # place without intermediate copies.
+        buffer = memoryview(bytearray(pages * DMP_PAGE_SIZE))
+        for i in range(pages):
             # Read one dump page
+            offset = i * DMP_PAGE_SIZE
             try:
-                dump = self._read_dump_page()
+                self._read_dump_page(buffer, offset, i)
+            except (BadCRCException, BadDataException):
+                self._write(self.ESC)
+                raise
+            try:
+                yield buffer, offset
+            except GeneratorExit:
+                self._write(self.ESC)
+                raise
+            if pages - 1 == i:
+                LOGGER.info('Start downloading next page')
+            self._write(self.ACK)
+
+    def _read_dump_pages_pipelined(self, pages):
+        '''Yields the (buffer, offset) of the `pages` downloaded dump pages
+        as `_read_dump_pages`, but the pages are downloaded by a thread which
+        requests the next page as soon as the CRC of a page is valid. At most
+        `DMP_PIPELINE_PAGES` pages wait to be parsed.'''
+        queue = Queue(self.DMP_PIPELINE_PAGES)
+        stop = threading.Event()
+        errors = []
+
+        def download():
+            try:
+                for i in range(pages):
+                    buffer = memoryview(bytearray(DMP_PAGE_SIZE))
+                    self._read_dump_page(buffer, 0, i)
+                    if stop.is_set():
+                        self._write(self.ESC)
+                        break
+                    self._write(self.ACK)
+                    queue.put(buffer)
             except (BadCRCException, BadDataException) as e:
-                LOGGER.error('Error: %s' % e)
-                finish = True
-                break
-            LOGGER.info('Dump page no %d ' % dump['Index'])
-            # Get the 5 raw records
-            raw_records = dump["Records"]
-            # loop through archive records
-            offsets = zip(range(0, 260, 52), range(52, 261, 52))
-            # offsets = [(0, 52), (52, 104), ... , (156, 208), (208, 260)]
-            for offset in offsets:
-                raw_record = raw_records[offset[0]:offset[1]]
-                if self.RevB:
-                    record = ArchiveDataParserRevB(raw_record)
-                else:
-                    msg = 'Do not support RevA data format'
-                    raise NotImplementedError(msg)
-                # verify that record has valid data, and store
-                r_time = record['Datetime']
-                if r_time is None:
-                    LOGGER.error('Invalid record detected')
-                    finish = True
-                    break
-                elif r_time <= stop_date:
-                    if start_date < r_time:
-                        not_in_range = False
-                        msg = "Record-%.4d - Datetime : %s" % (r_index, r_time)
-                        LOGGER.info(msg)
-                        yield record
-                    else:
-                        not_in_range = True
-                        LOGGER.info('The record is not in the datetime range')
-                else:
-                    LOGGER.error('Invalid record detected')
-                    finish = True
+                self._write(self.ESC)
+                errors.append(e)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                queue.put(None)
+
+        thread = threading.Thread(target=download)
+        thread.daemon = True
+        thread.start()
+        buffer = None
+        try:
+            while True:
+                buffer = queue.get()
+                if buffer is None:
                     break
-                r_index += 1
-            if finish:
-                LOGGER.info('Canceling download : Finish')
-                self.link.write(self.ESC)
-                break
-            elif not_in_range:
-                msg = 'Page is not in the datetime range'
-                LOGGER.info('Canceling download : %s' % msg)
-                self.link.write(self.ESC)
-                break
-            else:
-                if header['Pages'] - 1 == i:
-                    LOGGER.info('Start downloading next page')
-                self.link.write(self.ACK)
-        LOGGER.info('Pages Downloading process was finished')
-
-    @cached_property
+                yield buffer, 0
+        finally:
+            stop.set()
+            # unblock and wait for the download thread
+            while buffer is not None:
+                buffer = queue.get()
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    @property
     def archive_period(self):
         '''Returns number of minutes in the archive period.'''
-        return struct.unpack(b'B', self.read_from_eeprom("2D", 1))[0]
+        return self.eeprom.unpack(0x2D, b'B')[0]
 
-    @cached_property
+    @property
     def timezone(self):
         '''Returns timezone offset as string.'''
-        data = self.read_from_eeprom("14", 3)
-        offset, gmt = struct.unpack(b'HB', data)
+        offset, gmt = self.eeprom.unpack(0x14, b'<hB')
         if gmt == 1:
-            return "GMT+%.2f" % (offset / 100)
+            return "GMT%+.2f" % (offset / 100)
         else:
             return "Localtime"
 
+    @property
+    def latitude(self):
+        '''Returns the latitude of the station in degrees (north is
+        positive).'''
+        return self.eeprom.unpack(0x0B, b'<h')[0] / 10
+
+    @property
+    def longitude(self):
+        '''Returns the longitude of the station in degrees (east is
+        positive).'''
+        return self.eeprom.unpack(0x0D, b'<h')[0] / 10
+
+    @property
+    def elevation(self):
+        '''Returns the elevation of the station in feet.'''
+        return self.eeprom.unpack(0x0F, b'<h')[0]
+
     @cached_property
     def firmware_date(self):
         '''Return the firmware date code'''
         self.wake_up()
         self.send("VER", self.OK)
-        data = self.link.read(13)
-        return datetime.strptime(data.strip('\n\r'), '%b %d %Y').date()
+        data = self._read_line()
+        return datetime.strptime(data, '%b %d %Y').date()
 
     @cached_property
     def firmware_version(self):
         '''Returns the firmware version as string'''
         self.wake_up()
         self.send("NVER", self.OK)
-        data = self.link.read(6)
-        return data.strip('\n\r')
+        return self._read_line()
 
     @cached_property
     def diagnostics(self):
         '''Return the Console Diagnostics report. (RXCHECK command)'''
         self.wake_up()
         self.send("RXCHECK", self.OK)
-        data = self.link.read().strip('\n\r').split(' ')
-        data = [int(i) for i in data]
+        data = [int(i) for i in self._read_line().split()]
         return dict(total_received=data[0], total_missed=data[1],
                     resyn=data[2], max_received=data[3],
                     crc_errors=data[4])
 
     @retry(tries=3, delay=1)
-    def _read_dump_page(self):
-        '''Read, parse and check a DmpPage.'''
-        raw_dump = self.link.read(267)
-        if len(raw_dump) != 267:
-            self.link.write(self.NACK)
-            raise BadDataException()
-        else:
-            dump = DmpPageParser(raw_dump)
-            if dump.crc_error:
-                self.link.write(self.NACK)
-                raise BadCRCException()
-            return dump
+    def _read_dump_page(self, buffer, offset, sequence=0):
+        '''Read a DmpPage into `buffer` at `offset` and check it. The page
+        number `sequence` of the download (from 0) is used to skip a copy of
+        the previous page, late after a timeout and sent again.'''
+        # the page is read in place, in its slot of the buffer
+        page = buffer[offset:offset + DMP_PAGE_SIZE]
+        with self._measure('DMP page') as deadline:
+            begin = time.time()
+            size = self.reader.read_into(page, deadline)
+            while (sequence and size == DMP_PAGE_SIZE and
+                   struct.unpack_from(b'B', page)[0] == (sequence - 1) % 256
+                   and crc16(page, 0) == 0):
+                LOGGER.info('Skip late dump page no %d' % (sequence - 1))
+                if deadline is not None:
+                    deadline = time.time() + deadline - begin
+                size = self.reader.read_into(page, deadline)
+            if size != DMP_PAGE_SIZE:
+                self._replied(False)
+                if deadline is not None:
+                    # the page may be late, its rest is discarded before
+                    # the page is sent again
+                    self.reader.drain(time.time() + deadline - begin)
+                self._write(self.NACK)
+                raise BadDataException()
+            else:
+                if crc16(page, 0) != 0:
+                    LOGGER.error("Check CRC : BAD")
+                    self._write(self.NACK)
+                    raise BadCRCException()
+                self._replied()
+                index = struct.unpack_from(b'B', page)[0]
+                LOGGER.info('Dump page no %d ' % index)
+                # retry needs a true value, the first page index is 0
+                return True
+
+    def _load_metadata(self):
+        '''Uses the cached metadata of the link URL, and returns True if
+        there is a fresh (and valid) entry.'''
+        if self.metadata is None:
+            return False
+        metadata = self.metadata.get(self.link.url)
+        if metadata is None:
+            return False
+        try:
+            firmware_date = datetime.strptime(metadata['firmware_date'],
+                                              '%Y-%m-%d').date()
+            images = dict((int(address, 16), hex_to_bytes(data))
+                          for address, data in metadata['eeprom'].items())
+        except (TypeError, ValueError, AttributeError):
+            LOGGER.info('Metadata cache: bad entry of %s' % self.link.url)
+            self.metadata.remove(self.link.url)
+            return False
+        if self.metadata.validate:
+            # one probe, NVER or VER for the consoles without NVER
+            if metadata['firmware_version'] is None:
+                valid = self.firmware_date == firmware_date
+            else:
+                valid = self.firmware_version == metadata['firmware_version']
+            if not valid:
+                LOGGER.info('Metadata cache: the firmware has changed')
+                return False
+        self.__dict__['firmware_date'] = firmware_date
+        self.__dict__['firmware_version'] = metadata['firmware_version']
+        for address, image in images.items():
+            if (address, len(image)) in self.eeprom.blocks:
+                self.eeprom.images[address] = image
+        self._check_revision()
+        LOGGER.info('Metadata cache: loaded %s' % self.link.url)
+        return True
+
+    def _save_metadata(self):
+        '''Reads the firmware version and the EEPROM blocks, and saves them
+        in the metadata cache.'''
+        for address, size in self.eeprom.blocks:
+            self.eeprom.read(address, size)
+        try:
+            version = self.firmware_version
+        except Exception as e:
+            # the old firmwares have no NVER command
+            LOGGER.error('Error: %s' % e)
+            version = None
+        self.metadata.set(self.link.url, {
+            'firmware_date': self.firmware_date.strftime('%Y-%m-%d'),
+            'firmware_version': version,
+            'eeprom': dict(('%.2X' % address, bytes_to_hex(image))
+                           for address, image in self.eeprom.images.items()),
+        })
+
+    def _forget_metadata(self):
+        '''Removes the cached metadata of the link URL, after a change of
+        the console settings.'''
+        if self.metadata is not None:
+            self.metadata.remove(self.link.url)
 
     def _check_revision(self):
         '''Check firmware date and get data format revision.'''
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+'''
+    pyvantagepro.emulator
+    ---------------------
+
+    Emulated Vantage Pro2 console, to test and benchmark the communication
+    without a station. It is used in-process with a `ConsoleLink`, or by
+    TCP with a `ConsoleServer`::
+
+        >>> with ConsoleServer(Console(records=2560)) as server:
+        ...     device = VantagePro2.from_url(server.url)
+        ...     records = device.get_archives()
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import division, unicode_literals
+import random
+import select
+import socket
+import struct
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .corpus import PacketGenerator, RECORDS_BY_PAGE, RECORD_SIZE
+from .parser import (VantageProCRC, pack_datetime, unpack_datetime,
+                     unpack_dmp_date_time)
+from .utils import is_bytes
+
+
+#: Number of DMP pages of the archive memory.
+ARCHIVE_PAGES = 512
+
+ACK = b'\x06'
+NACK = b'\x21'
+CANCEL = b'\x18'
+ESC = b'\x1b'
+OK = b'\n\rOK\n\r'
+
+
+class Console(object):
+    '''Emulated console: its firmware, EEPROM, clock and archive memory.
+    The archive memory is a ring of `ARCHIVE_PAGES` DMP pages, the new
+    records overwrite the oldest ones. The replies are sent after their
+    transfer time and with the configured faults. The dump pages sent while
+    the `bad_pages` list starts with True are corrupted, one item by page.
+
+    :param records: The number of archive records, every `period` minutes
+        from `start`.
+
+    :param period: The archive period in minutes.
+
+    :param start: The datetime of the first record, by default the last
+        record is the one of the current period.
+
+    :param seed: The seed of the synthetic packets and of the faults.
+
+    :param baudrate: The transfer rate of the replies, None for no transfer
+        time.
+
+    :param latency: The number of seconds before each reply.
+
+    :param drop: The probability that a byte of a reply is lost.
+
+    :param corruption: The probability that a packet with CRC has one bit
+        flipped.
+
+    :param loop_interval: The number of seconds between two LOOP packets
+        (2 seconds on a real console).
+    '''
+    FIRMWARE_DATE = b'Apr 10 2012'
+    FIRMWARE_VERSION = b'1.90'
+    # total received, missed, resynchronizations, in a row, CRC errors
+    RXCHECK = b' 21629 15 0 3204 128'
+
+    def __init__(self, records=0, period=5, start=None, seed=0,
+                 baudrate=19200, latency=0, drop=0, corruption=0,
+                 loop_interval=0):
+        self.period = period
+        if start is None:
+            now = datetime.now().replace(second=0, microsecond=0)
+            last = now - timedelta(minutes=now.minute % period)
+            start = last - timedelta(minutes=(records - 1) * period)
+        self.start = start
+        self.generator = PacketGenerator(seed)
+        self.random = random.Random(seed)
+        self.byte_time = 10 / baudrate if baudrate else 0
+        self.latency = latency
+        self.drop = drop
+        self.corruption = corruption
+        self.loop_interval = loop_interval
+        self.bad_pages = []
+        # the console time is the current time with this offset
+        self.clock_offset = timedelta(0)
+        # latitude 45.2, longitude 5.7, elevation 700 feet, GMT+1
+        self.eeprom = bytearray(4096)
+        struct.pack_into(b'<hhh', self.eeprom, 0x0B, 452, 57, 700)
+        struct.pack_into(b'<hB', self.eeprom, 0x14, 100, 1)
+        self.eeprom[0x2D] = period
+        self.records = []
+        self.add_records(records)
+
+    @property
+    def ring_size(self):
+        '''The number of records of the archive memory.'''
+        return ARCHIVE_PAGES * RECORDS_BY_PAGE
+
+    def record_date(self, index):
+        '''Returns the datetime of the record `index`.'''
+        return self.start + timedelta(minutes=index * self.period)
+
+    def add_records(self, count=1):
+        '''Archives `count` new records.'''
+        size = len(self.records)
+        self.records.extend(self.generator.archive_record(
+            self.record_date(size + i)) for i in range(count))
+
+    def now(self):
+        '''Returns the datetime of the console clock.'''
+        return datetime.now() + self.clock_offset
+
+    def page(self, index, sequence):
+        '''Returns the DMP page `index` of the archive memory, with the
+        `sequence` number of a download.'''
+        records = []
+        for slot in range(index * RECORDS_BY_PAGE,
+                          (index + 1) * RECORDS_BY_PAGE):
+            if slot < len(self.records):
+                # the last record stored in this slot
+                last = slot + ((len(self.records) - 1 - slot) //
+                               self.ring_size) * self.ring_size
+                records.append(self.records[last])
+            else:
+                records.append(b'\xff' * RECORD_SIZE)
+        return self.generator.dmp_page(sequence, records)
+
+    def dump_after(self, since):
+        '''Returns the indexes of the pages with the records after `since`,
+        and the number of older records of the first page.'''
+        oldest = max(0, len(self.records) - self.ring_size)
+        first = oldest
+        if since is not None:
+            while first < len(self.records) and \
+                    self.record_date(first) <= since:
+                first += 1
+        count = len(self.records) - first
+        if count == 0:
+            return [], 0
+        page, offset = divmod(first % self.ring_size, RECORDS_BY_PAGE)
+        pages = -(-(offset + count) // RECORDS_BY_PAGE)
+        return [(page + i) % ARCHIVE_PAGES for i in range(pages)], offset
+
+    def session(self):
+        '''Returns a new `Session`, the state of a connection.'''
+        return Session(self)
+
+
+class Session(object):
+    '''Protocol state of a connection to a `Console`: the received bytes
+    which are not handled yet, the command waiting for binary data, the
+    download in progress and the scheduled replies.
+
+    :param console: The `Console`.
+    '''
+
+    def __init__(self, console):
+        self.console = console
+        self.input = bytearray()
+        # (size, handler) of the binary data of the current command
+        self.expected = None
+        # the pages of the download in progress and the last sent page
+        self.pages = None
+        self.sent_page = None
+        self.sequence = 0
+        # the scheduled replies: [ready time, data, stopped by a command]
+        self.output = []
+        # the replies which are ready but not read yet
+        self.available = bytearray()
+        self.ready = 0
+
+    def reply(self, data, packet=False, delay=0, loop=False, now=None):
+        '''Schedules `data` after the previous replies, `delay` seconds after
+        `now` at the earliest. A `packet` may be corrupted, the LOOP
+        packets are canceled by the next command.'''
+        console = self.console
+        if packet and console.random.random() < console.corruption:
+            data = console.generator.corrupt(data)
+        if console.drop:
+            data = bytes(bytearray(byte for byte in bytearray(data)
+                                   if console.random.random() >= console.drop))
+        now = time.time() if now is None else now
+        begin = max(self.ready, now + console.latency + delay)
+        self.ready = begin + len(data) * console.byte_time
+        self.output.append([self.ready, data, loop])
+
+    def receive(self, data, now=None):
+        '''Handles the received `data`.'''
+        now = time.time() if now is None else now
+        if not is_bytes(data):
+            data = data.encode('utf-8')
+        # a new request stops the LOOP packets
+        self.output = [chunk for chunk in self.output
+                       if not chunk[2] or chunk[0] <= now]
+        self.ready = max([chunk[0] for chunk in self.output] + [0])
+        self.input.extend(data)
+        while self.input:
+            if self.expected is not None:
+                size, handler = self.expected
+                if len(self.input) < size:
+                    break
+                self.expected = None
+                handler(bytes(self.input[:size]), now)
+                del self.input[:size]
+            elif self.pages is not None:
+                answer = bytes(self.input[:1])
+                del self.input[:1]
+                self.dump_answer(answer, now)
+            else:
+                index = self.input.find(b'\n')
+                if index < 0:
+                    break
+                line = bytes(self.input[:index]).strip()
+                del self.input[:index + 1]
+                self.command(line.decode('ascii', 'replace'), now)
+
+    def command(self, line, now):
+        '''Replies to the text command `line`.'''
+        console = self.console
+        args = line.split()
+        name = args[0] if args else ''
+        if name == '':
+            self.reply(b'\n\r', now=now)
+        elif name == 'TEST':
+            self.reply(b'\n\rTEST\n\r', now=now)
+        elif name == 'VER':
+            self.reply(OK + console.FIRMWARE_DATE + b'\n\r', now=now)
+        elif name == 'NVER':
+            self.reply(OK + console.FIRMWARE_VERSION + b'\n\r', now=now)
+        elif name == 'RXCHECK':
+            self.reply(OK + console.RXCHECK + b'\n\r', now=now)
+        elif name == 'GETTIME':
+            self.reply(ACK + pack_datetime(console.now()), True, now=now)
+        elif name == 'SETTIME':
+            self.reply(ACK, now=now)
+            self.expected = (8, self.settime)
+        elif name == 'EEBRD':
+            address, size = int(args[1], 16), int(args[2], 16)
+            data = bytes(console.eeprom[address:address + size])
+            self.reply(ACK + VantageProCRC(data).data_with_checksum, True,
+                       now=now)
+        elif name == 'EEBWR':
+            address, size = int(args[1], 16), int(args[2], 16)
+            self.reply(ACK, now=now)
+            self.expected = (size + 2, lambda data, now:
+                             self.eebwr(address, data, now))
+        elif name in ('LOOP', 'LPS'):
+            loop_types, count = (1, int(args[1])) if name == 'LOOP' else \
+                (int(args[1]), int(args[2]))
+            self.reply(ACK, now=now)
+            # `count` packets in all, of the selected types in turn
+            packets = [packet for packet_type, packet in
+                       enumerate([console.generator.loop,
+                                  console.generator.loop2])
+                       if loop_types & (1 << packet_type)]
+            for i in range(count):
+                packet = packets[i % len(packets)]
+                self.reply(packet(), True, i * console.loop_interval, True,
+                           now)
+        elif name == 'DMPAFT':
+            self.reply(ACK, now=now)
+            self.expected = (6, self.dmpaft)
+
+    def settime(self, data, now):
+        if VantageProCRC(data).check():
+            self.console.clock_offset = unpack_datetime(data) - datetime.now()
+            self.reply(ACK, now=now)
+        else:
+            self.reply(NACK, now=now)
+
+    def eebwr(self, address, data, now):
+        if VantageProCRC(data).check():
+            self.console.eeprom[address:address + len(data) - 2] = data[:-2]
+            self.reply(ACK, now=now)
+        else:
+            self.reply(NACK, now=now)
+
+    def dmpaft(self, data, now):
+        '''Starts the download of the records after the received date.'''
+        if not VantageProCRC(data).check():
+            self.reply(NACK, now=now)
+            return
+        since = unpack_dmp_date_time(*struct.unpack(b'<HH', data[:4]))
+        pages, offset = self.console.dump_after(since)
+        self.reply(ACK + self.console.generator.dmp_header(len(pages),
+                                                           offset),
+                   True, now=now)
+        self.pages = pages
+        self.sent_page = None
+        self.sequence = 0
+
+    def dump_answer(self, answer, now):
+        '''Sends the next page, sends the last page again or cancels the
+        download.'''
+        if answer == ACK and self.pages:
+            self.sent_page = self.console.page(self.pages.pop(0),
+                                               self.sequence)
+            self.sequence += 1
+            self.send_page(now)
+        elif answer == NACK and self.sent_page is not None:
+            self.send_page(now)
+        elif answer in (ACK, ESC, CANCEL):
+            # the last page is acknowledged, or the download is canceled
+            self.pages = self.sent_page = None
+
+    def send_page(self, now):
+        '''Sends the last page, corrupted if the next of the `bad_pages` is
+        True.'''
+        console = self.console
+        page = self.sent_page
+        if console.bad_pages and console.bad_pages.pop(0):
+            page = console.generator.corrupt(page)
+        self.reply(page, True, now=now)
+
+    def read(self, size=None, now=None):
+        '''Returns up to `size` bytes of the replies which are ready.'''
+        now = time.time() if now is None else now
+        while self.output and self.output[0][0] <= now:
+            self.available.extend(self.output.pop(0)[1])
+        size = len(self.available) if size is None else size
+        data = bytes(self.available[:size])
+        del self.available[:size]
+        return data
+
+    def next_ready(self):
+        '''Returns the time when the next reply is ready, None if there is
+        no reply.'''
+        if self.available:
+            return 0
+        if self.output:
+            return self.output[0][0]
+        return None
+
+
+class ConsoleLink(object):
+    '''In-process link to a `Console`, with the API of the `PyLink` links.
+
+    :param console: The `Console`.
+
+    :param timeout: The read timeout in seconds.
+    '''
+
+    def __init__(self, console, timeout=1):
+        self.console = console
+        self.timeout = timeout
+        self.session = None
+
+    @property
+    def url(self):
+        return 'emulator:%x' % id(self.console)
+
+    def open(self):
+        if self.session is None:
+            self.session = self.console.session()
+
+    def close(self):
+        self.session = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def write(self, data):
+        self.open()
+        self.session.receive(data)
+
+    def read(self, size=None, timeout=None):
+        '''Reads `size` bytes, or the bytes received before the timeout (a
+        factor of the link timeout). If `size` is None, reads until the
+        timeout.'''
+        self.open()
+        deadline = time.time() + (timeout or 1) * (self.timeout or 1)
+        data = bytearray()
+        while size is None or len(data) < size:
+            now = time.time()
+            data.extend(self.session.read(
+                None if size is None else size - len(data), now))
+            if size is not None and len(data) == size:
+                break
+            ready = self.session.next_ready()
+            if now >= deadline:
+                break
+            time.sleep(max(0, min(deadline if ready is None else ready,
+                                  deadline) - now))
+        data = bytes(data)
+        # the text replies are returned as str, like the pylink links
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            return data
+
+
+class ConsoleServer(object):
+    '''TCP server of a `Console`, run by a thread. Each connection has its
+    own `Session` and thread.
+
+    :param console: The `Console`.
+
+    :param host: The listening address.
+
+    :param port: The listening port, by default a free port.
+    '''
+
+    def __init__(self, console, host='127.0.0.1', port=0):
+        self.console = console
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen(5)
+        self.address = self.socket.getsockname()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def url(self):
+        '''The `PyLink` URL of the server.'''
+        return 'tcp:%s:%d' % self.address
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        '''Starts serving the connections.'''
+        self._start_thread(self._serve)
+
+    def stop(self):
+        '''Closes the server and its connections.'''
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self.socket.close()
+
+    def _start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self._threads.append(thread)
+
+    def _serve(self):
+        while not self._stop.is_set():
+            if select.select([self.socket], [], [], 0.05)[0]:
+                connection, _ = self.socket.accept()
+                self._start_thread(self._handle, connection)
+
+    def _handle(self, connection):
+        session = self.console.session()
+        try:
+            while not self._stop.is_set():
+                ready = session.next_ready()
+                timeout = 0.05 if ready is None else \
+                    min(0.05, max(0, ready - time.time()))
+                if select.select([connection], [], [], timeout)[0]:
+                    data = connection.recv(4096)
+                    if not data:
+                        break
+                    session.receive(data)
+                data = session.read()
+                if data:
+                    connection.sendall(data)
+        except socket.error:
+            pass
+        finally:
+            connection.close()
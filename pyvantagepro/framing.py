@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+'''
+    pyvantagepro.framing
+    --------------------
+
+    Buffered reader of the console replies on top of a `PyLink` link.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import division, unicode_literals
+import select
+import socket
+import time
+
+from .utils import is_bytes
+
+
+class FrameReader(object):
+    '''Reads the replies of the console as frames of bytes: a number of
+    bytes, the bytes up to a marker, or the next bytes without consuming
+    them. The data available on the link is received at once and buffered,
+    a DMP page or a LOOP packet does not need its own read.
+
+    The sockets of the TCP and UDP links and the serial port of the serial
+    links are read directly, until a deadline. The other links are read
+    with their `read` method, which waits for its own timeout. The bytes of
+    the TCP sockets can also be received in place, into a given buffer.
+
+    :param link: A `PyLink` connection.
+    '''
+    #: maximum number of bytes received at once
+    CHUNK_SIZE = 4096
+
+    def __init__(self, link):
+        self.link = link
+        self._buffer = bytearray()
+        # index of the first unread byte of the buffer
+        self._start = 0
+        # the sockets and serial ports are read until a deadline
+        self._streams = (hasattr(link, 'recv_from_socket') or
+                         hasattr(link, 'serial'))
+        # number of reads of the link, and of bytes read from the buffer
+        self.reads = 0
+        self.consumed = 0
+
+    def __len__(self):
+        return len(self._buffer) - self._start
+
+    def deadline(self, timeout=None):
+        '''Returns the deadline of a read, `timeout` is a factor of the link
+        timeout as for the `PyLink` links.'''
+        link_timeout = getattr(self.link, 'timeout', None) or 1
+        return time.time() + (timeout or 1) * link_timeout
+
+    def _receive(self, size, deadline):
+        '''Reads at least one byte before the `deadline`, and up to the
+        `size` bytes or the bytes already available, returns them (empty at
+        the deadline).'''
+        link = self.link
+        timeout = max(0, deadline - time.time())
+        self.reads += 1
+        if hasattr(link, 'recv_from_socket'):
+            if not select.select([link.socket], [], [], timeout)[0]:
+                return b''
+            # an empty reply if the connection is closed
+            data = link.recv_from_socket(max(size, self.CHUNK_SIZE)) or b''
+        elif hasattr(link, 'serial'):
+            serial = link.serial
+            serial.timeout = timeout
+            try:
+                data = serial.read(max(size, serial.in_waiting))
+            finally:
+                serial.timeout = link.timeout
+        else:
+            link_timeout = getattr(link, 'timeout', None) or 1
+            data = link.read(size, timeout / link_timeout)
+        if not is_bytes(data):
+            # the PyLink links decode the utf8 replies
+            data = data.encode('utf-8')
+        return data
+
+    def _receive_into(self, view, deadline):
+        '''Reads at least one byte before the `deadline` into the `view`,
+        and up to its size, returns the number of bytes (0 at the
+        deadline).'''
+        link = self.link
+        if hasattr(link, 'recv_from_socket'):
+            sock = link.socket
+            if sock.type == socket.SOCK_STREAM:
+                timeout = max(0, deadline - time.time())
+                self.reads += 1
+                if not select.select([sock], [], [], timeout)[0]:
+                    return 0
+                return sock.recv_into(view)
+        data = self._receive(len(view), deadline)
+        size = min(len(data), len(view))
+        view[:size] = data[:size]
+        # a serial port may return more than the requested bytes
+        self._buffer.extend(data[size:])
+        return size
+
+    def _fill(self, size, deadline):
+        '''Reads until `size` bytes are buffered or the `deadline`.'''
+        while len(self) < size:
+            missing = size - len(self)
+            data = self._receive(missing, deadline)
+            self._buffer.extend(data)
+            # a short reply of a link read is its timeout
+            if not data or (not self._streams and len(data) < missing):
+                break
+
+    def _take(self, size):
+        '''Returns and consumes the first `size` buffered bytes.'''
+        data = bytes(self._buffer[self._start:self._start + size])
+        self._skip(len(data))
+        return data
+
+    def _skip(self, size):
+        '''Consumes the first `size` buffered bytes.'''
+        self._start += size
+        self.consumed += size
+        if self._start == len(self._buffer):
+            del self._buffer[:]
+            self._start = 0
+        elif self._start >= self.CHUNK_SIZE:
+            del self._buffer[:self._start]
+            self._start = 0
+
+    def read_exact(self, size, deadline=None):
+        '''Returns the next `size` bytes, or the bytes received before the
+        `deadline` (a `time.time()` value, by default the link timeout).'''
+        if len(self) < size:
+            self._fill(size, deadline or self.deadline())
+        return self._take(size)
+
+    def read_into(self, view, deadline=None):
+        '''Reads the next bytes into the writable `view` (a `memoryview`),
+        until it is full or the `deadline`, and returns their number. The
+        bytes received from a TCP socket are not copied.'''
+        size = len(view)
+        count = min(len(self), size)
+        if count:
+            view[:count] = self._buffer[self._start:self._start + count]
+            self._skip(count)
+        deadline = deadline or self.deadline()
+        while count < size:
+            received = self._receive_into(view[count:], deadline)
+            count += received
+            self.consumed += received
+            # a short reply of a link read is its timeout
+            if not received or (not self._streams and count < size):
+                break
+        return count
+
+    def read_until(self, marker, deadline=None):
+        '''Returns the next bytes up to the `marker` included, or the bytes
+        received before the `deadline`.'''
+        deadline = deadline or self.deadline()
+        searched = self._start
+        while True:
+            index = self._buffer.find(marker, searched)
+            if index >= 0:
+                return self._take(index + len(marker) - self._start)
+            searched = max(self._start, len(self._buffer) - len(marker) + 1)
+            size = len(self)
+            self._fill(size + 1, deadline)
+            if len(self) == size:
+                return self._take(size)
+
+    def peek(self, size=1, deadline=None):
+        '''Returns the next `size` bytes without consuming them.'''
+        if len(self) < size:
+            self._fill(size, deadline or self.deadline())
+        return bytes(self._buffer[self._start:self._start + size])
+
+    def clear(self):
+        '''Discards the buffered bytes.'''
+        del self._buffer[:]
+        self._start = 0
+
+    def drain(self, deadline=None, quiet=None):
+        '''Discards the buffered bytes and the bytes received before the
+        `deadline`, or until no byte is received during `quiet` seconds.'''
+        deadline = deadline or self.deadline()
+        self.clear()
+        while True:
+            until = deadline
+            if quiet is not None:
+                until = min(deadline, time.time() + quiet)
+            data = self._receive(self.CHUNK_SIZE, until)
+            if not data or not self._streams:
+                break
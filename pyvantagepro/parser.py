@@ -18,12 +18,21 @@ from array import array
 from .compat import bytes
 from .logger import LOGGER
 from .utils import (cached_property, bytes_to_hex, Dict, bytes_to_binary,
-                    binary_to_int)
+                    record_type)
 
 
 class VantageProCRC(object):
     '''Implements CRC algorithm, necessary for encoding and verifying data from
-    the Davis Vantage Pro unit.'''
+    the Davis Vantage Pro unit.
+
+    The CRC can be computed incrementally with `update`, as bytes arrive
+    from the link::
+
+        crc = VantageProCRC()
+        for chunk in chunks:
+            crc.update(chunk)
+        crc.check()
+    '''
     CRC_TABLE = (
         0x0,    0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7, 0x8108,
         0x9129, 0xa14a, 0xb16b, 0xc18c, 0xd1ad, 0xe1ce, 0xf1ef, 0x1231, 0x210,
@@ -56,22 +65,30 @@ class VantageProCRC(object):
         0x2e93, 0x3eb2, 0xed1,  0x1ef0,
     )
 
-    def __init__(self, data):
+    def __init__(self, data=b''):
         self.data = data
+        self._checksum = None
 
-    @cached_property
+    @property
     def checksum(self):
         '''Return CRC calc value from raw serial data.'''
-        crc = 0
-        for byte in array(str('B'), bytes(self.data)):
-            crc = (self.CRC_TABLE[((crc >> 8) ^ byte)] ^ ((crc & 0xFF) << 8))
-        return crc
-
-    @cached_property
+        if self._checksum is None:
+            self._checksum = crc16(self.data, 0)
+        return self._checksum
+
+    def update(self, chunk):
+        '''Add `chunk` to the data and update the CRC value.'''
+        self._checksum = crc16(chunk, self.checksum)
+        if not isinstance(self.data, bytearray):
+            self.data = bytearray(self.data)
+        self.data.extend(chunk)
+        return self
+
+    @property
     def data_with_checksum(self):
         '''Return packed raw CRC from raw data.'''
         checksum = struct.pack(b'>H', self.checksum)
-        return b''.join([self.data, checksum])
+        return b''.join([bytes(self.data), checksum])
 
     def check(self):
         '''Perform CRC check on raw serial data, return true if valid.
@@ -84,29 +101,395 @@ class VantageProCRC(object):
             return False
 
 
+def crc16_table(data, crc=0):
+    '''Pure Python CRC of `data` with `VantageProCRC.CRC_TABLE`, starting
+    from the `crc` value.'''
+    table = VantageProCRC.CRC_TABLE
+    for byte in array(str('B'), bytes(data)):
+        crc = (table[((crc >> 8) ^ byte)] ^ ((crc & 0xFF) << 8))
+    return crc
+
+
+def _select_crc16():
+    '''Return `binascii.crc_hqx` (same CCITT polynomial, in C) if it gives the
+    same results as `crc16_table`, else `crc16_table`.'''
+    try:
+        from binascii import crc_hqx
+    except ImportError:
+        return crc16_table
+    sample = bytes(bytearray(range(256)))
+    if (crc_hqx(sample, 0) != crc16_table(sample) or
+            crc_hqx(sample, 0x1021) != crc16_table(sample, 0x1021)):
+        return crc16_table
+    return crc_hqx
+
+
+#: CRC function `crc16(data, crc)` with the fastest available backend.
+crc16 = _select_crc16()
+
+
+def check_crc_blocks(data, size):
+    '''Verify the CRC of each block of `size` bytes (e.g. the 267 bytes DMP
+    pages) of the contiguous `data` buffer and return the list of results.'''
+    view = memoryview(data)
+    results = [crc16(view[i:i + size], 0) == 0
+               for i in range(0, len(data) - size + 1, size)]
+    LOGGER.info("Check CRC : %d/%d blocks OK" % (sum(results), len(results)))
+    return results
+
+
+def unpack_dmp_date_time(date, time):
+    '''Unpack `date` and `time` to datetime'''
+    if date != 0xffff and time != 0xffff:
+        day = date & 0x1f                     # 5 bits
+        month = (date >> 5) & 0x0f            # 4 bits
+        year = ((date >> 9) & 0x7f) + 2000    # 7 bits
+        hour, min_ = divmod(time, 100)
+        return datetime(year, month, day, hour, min_)
+
+
+def unpack_time(time):
+    '''Given a packed time field, unpack and return "HH:MM" string.'''
+    # format: HHMM, and space padded on the left.ex: "601" is 6:01 AM
+    return "%02d:%02d" % divmod(time, 100)  # covert to "06:01"
+
+
+def unpack_storm_date(value):
+    '''Given a packed storm date field, unpack and return date.'''
+    # The packed bits are read from the raw bytes, most significant first.
+    date = ((value & 0xff) << 8) | (value >> 8)
+    year = (date & 0x7f) + 2000             # 7 bits
+    day = (date >> 7) & 0x1f                # 5 bits
+    month = (date >> 12) & 0x0f             # 4 bits
+    return "%s-%s-%s" % (year, month, day)
+
+
+def unpack_battery_volts(value):
+    '''Convert the raw battery voltage to volts.'''
+    return value * 300 / 512 / 100
+
+
+#: Binary string representation of each byte value.
+BYTE_BINARY = tuple(bytes_to_binary(bytes(bytearray((i,))))
+                    for i in range(256))
+
+
+def unpack_raw_datestamp(date, time):
+    '''Return the binary string of the DateStamp and TimeStamp bytes.'''
+    return ''.join((BYTE_BINARY[date & 0xff], BYTE_BINARY[date >> 8],
+                    BYTE_BINARY[time & 0xff], BYTE_BINARY[time >> 8]))
+
+
+def _loop_alarms():
+    '''Build the (name, byte, mask) table of the LOOP alarm flags. `byte` is
+    the index in the 16 alarm bytes and `mask` the bit mask of the flag.'''
+    alarms = [
+        ('AlarmInFallBarTrend', 0, 0x80), ('AlarmInRisBarTrend', 0, 0x40),
+        ('AlarmInLowTemp', 0, 0x20), ('AlarmInHighTemp', 0, 0x10),
+        ('AlarmInLowHum', 0, 0x08), ('AlarmInHighHum', 0, 0x04),
+        ('AlarmInTime', 0, 0x02),
+        ('AlarmRainHighRate', 1, 0x80), ('AlarmRain15min', 1, 0x40),
+        ('AlarmRain24hour', 1, 0x20), ('AlarmRainStormTotal', 1, 0x10),
+        ('AlarmRainETDaily', 1, 0x08),
+        ('AlarmOutLowTemp', 2, 0x80), ('AlarmOutHighTemp', 2, 0x40),
+        ('AlarmOutWindSpeed', 2, 0x20), ('AlarmOut10minAvgSpeed', 2, 0x10),
+        ('AlarmOutLowDewpoint', 2, 0x08), ('AlarmOutHighDewPoint', 2, 0x04),
+        ('AlarmOutHighHeat', 2, 0x02), ('AlarmOutLowWindChill', 2, 0x01),
+        ('AlarmOutHighTHSW', 3, 0x80), ('AlarmOutHighSolarRad', 3, 0x40),
+        ('AlarmOutHighUV', 3, 0x20), ('AlarmOutUVDose', 3, 0x10),
+        ('AlarmOutUVDoseEnabled', 3, 0x08),
+    ]
+    # AlarmExTempHum bits extraction, only 3 bits are used, but 7 bytes
+    for i in range(1, 8):
+        for mask, name in ((0x80, 'LowTemp'), (0x40, 'HighTemp'),
+                           (0x20, 'LowHum'), (0x10, 'HighHum')):
+            alarms.append(('AlarmEx%.2d%s' % (i, name), 4 + i, mask))
+    # AlarmSoilLeaf 8bits, 4 bytes
+    for i in range(1, 5):
+        for name in ('LowLeafWet', 'HighLeafWet', 'LowSoilMois',
+                     'HighSoilMois', 'LowLeafTemp', 'HighLeafTemp',
+                     'LowSoilTemp', 'HighSoilTemp'):
+            alarms.append(('Alarm%.2d%s' % (i, name), 11 + i, 0x80))
+    return tuple(alarms)
+
+
+LOOP_ALARMS = _loop_alarms()
+
+
+def _alarm_lookups():
+    '''Precompute, for each alarm byte, the tuple of its flags for the 256
+    possible byte values.'''
+    lookups = []
+    for byte in sorted(set(byte for _, byte, _ in LOOP_ALARMS)):
+        masks = [mask for _, b, mask in LOOP_ALARMS if b == byte]
+        table = tuple(tuple(1 if value & mask else 0 for mask in masks)
+                      for value in range(256))
+        lookups.append((byte, table))
+    return tuple(lookups)
+
+
+_ALARM_LOOKUPS = _alarm_lookups()
+
+
+def unpack_alarms(alarm_in, alarm_rain, alarm_out, alarm_ex, alarm_soil):
+    '''Unpack the LOOP alarm fields to the list of `LOOP_ALARMS` flags.'''
+    data = bytearray(alarm_out + alarm_ex + alarm_soil)
+    data[0:0] = bytearray((alarm_in, alarm_rain))
+    flags = []
+    for byte, table in _ALARM_LOOKUPS:
+        flags.extend(table[data[byte]])
+    return flags
+
+
+class Schema(object):
+    '''Compiled form of a binary data format.
+
+    The field names, the `struct.Struct` and the post-processing plan
+    (scaling, tuple expansions, offset corrections and conversions) are
+    computed once, and the plan is generated as a straight-line `decode`
+    function (see `source`), so that decoding a packet is a single
+    `unpack_from` followed by one list display.
+
+    :param data_format: Sequence of (name, struct format) pairs.
+
+    :param order: The struct byte order character.
+
+    :param scales: Sequence of (name, divisor) pairs.
+
+    :param expands: Names of the byte string fields to expand into
+        `<name>01` ... `<name>NN` integer keys, at the end of the result.
+
+    :param corrections: Sequence of (name, offset) pairs, the offset is
+        added to each expanded value of the field.
+
+    :param converters: Sequence of (keys, function, fields) triples. The
+        function is called with the values of `fields` and returns the value
+        of `keys` (or a sequence of values if `keys` is a tuple). Keys which
+        are not fields of the format are added after the regular ones.
+
+    :param drops: Names of the fields which are not kept in the result.
+    '''
+
+    def __init__(self, data_format, order='=', scales=(), expands=(),
+                 corrections=(), converters=(), drops=()):
+        self.data_format = tuple(data_format)
+        self.fields = tuple(name for name, _ in self.data_format)
+        self.has_crc = "CRC" in self.fields
+        self.order = order
+        self._rules = (dict(scales), tuple(expands), dict(corrections),
+                       converters)
+        # value spans and byte offsets of fields
+        formats, spans, self.offsets = [], {}, {}
+        self._formats, self._spans = {}, spans
+        index = 0
+        for name, format_t in self.data_format:
+            self.offsets[name] = struct.calcsize(str(order + ''.join(formats)))
+            count, code = int(format_t[:-1] or 1), format_t[-1]
+            if name in expands:
+                format_t, code = '%dB' % count, 'B'
+            width = 1 if code == 's' else count
+            spans[name] = (index, index + width)
+            index += width
+            formats.append(format_t)
+            self._formats[name] = format_t
+        self.struct = struct.Struct(str(order + ''.join(formats)))
+        self.size = self.struct.size
+        # output keys
+        converters = [((keys,) if not isinstance(keys, tuple) else keys,
+                       func, sources)
+                      for keys, func, sources in converters]
+        keys = ['Datetime']
+        keys.extend(name for name in self.fields
+                    if name not in drops and name not in expands)
+        for names, _, _ in converters:
+            keys.extend(name for name in names if name not in keys)
+        for name in expands:
+            start, stop = spans[name]
+            keys.extend("%s%.2d" % (name, i + 1) for i in range(stop - start))
+        self.keys = tuple(keys)
+        self.record_type = record_type(self.keys)
+        # post-processing plan, one expression of the raw values `vN` by key
+        exprs = ['None'] * len(keys)
+        for position, name in enumerate(keys):
+            if name in spans:
+                exprs[position] = _values(*spans[name])
+        for name, divisor in scales:
+            exprs[keys.index(name)] = 'v%d / %r' % (spans[name][0], divisor)
+        for name in expands:
+            start, stop = spans[name]
+            correction = dict(corrections).get(name)
+            for i in range(stop - start):
+                expr = 'v%d' % (start + i)
+                if correction is not None:
+                    expr = '%s + %r' % (expr, correction)
+                exprs[keys.index("%s%.2d" % (name, i + 1))] = expr
+        namespace = {'unpack_from': self.struct.unpack_from}
+        slices = []
+        for i, (names, func, sources) in enumerate(converters):
+            namespace['c%d' % i] = func
+            call = 'c%d(%s)' % (i, ', '.join(_values(*spans[source])
+                                             for source in sources))
+            start = keys.index(names[0])
+            if len(names) == 1:
+                exprs[start] = call
+            else:
+                slices.append('    row[%d:%d] = %s\n'
+                              % (start, start + len(names), call))
+        self.source = ('def decode(data, offset=0):\n'
+                       '    %s, = unpack_from(data, offset)\n'
+                       '    row = [%s]\n'
+                       '%s'
+                       '    return row\n'
+                       % (', '.join('v%d' % i for i in range(index)),
+                          ', '.join(exprs), ''.join(slices)))
+        code = compile(self.source, '<schema %s>' % self.keys[1], 'exec')
+        exec(code, namespace)
+        self.decode = namespace['decode']
+
+    def unpack_from(self, data, offset=0):
+        '''Unpack the raw values of the fields from `data`.'''
+        return self.struct.unpack_from(data, offset)
+
+    def record(self, data, offset=0):
+        '''Unpack `data` to a compact `Record`.'''
+        return self.record_type(self.decode(data, offset))
+
+    @cached_property
+    def units(self):
+        '''Map each key to the (keys, function) unit decoding it on its own,
+        with the field offsets: `function(data)` returns the values of
+        `keys`. Used to decode the fields on first access.'''
+        scales, expands, corrections, converters = self._rules
+        fields = dict((name, _field_decoder(self.order, self._formats[name],
+                                            self.offsets[name],
+                                            self._spans[name]))
+                      for name in self.fields)
+        units = dict((key, ((key,), _unit(fields[key])))
+                     for key in self.keys if key in fields)
+        units['Datetime'] = (('Datetime',), lambda data: (None,))
+        for name, divisor in scales.items():
+            units[name] = ((name,), _unit(fields[name], divisor=divisor))
+        for name in expands:
+            start, stop = self._spans[name]
+            keys = tuple("%s%.2d" % (name, i + 1) for i in range(stop - start))
+            unit = (keys, _unit(fields[name], correction=corrections.get(name),
+                                expanded=True))
+            units.update((key, unit) for key in keys)
+        for keys, func, sources in converters:
+            multi = isinstance(keys, tuple)
+            keys = keys if multi else (keys,)
+            unit = (keys, _unit(*[fields[source] for source in sources],
+                                converter=func, expanded=multi))
+            units.update((key, unit) for key in keys)
+        return units
+
+
+def _values(start, stop):
+    '''Return the expression of the raw values `start` to `stop` in a
+    generated `Schema.decode` function.'''
+    if stop - start == 1:
+        return 'v%d' % start
+    return '(%s,)' % ', '.join('v%d' % i for i in range(start, stop))
+
+
+def _field_decoder(order, format_t, offset, span):
+    '''Return a function unpacking one field at `offset` of raw data.'''
+    unpack_from = struct.Struct(str(order + format_t)).unpack_from
+    if span[1] - span[0] == 1:
+        return lambda data: unpack_from(data, offset)[0]
+    return lambda data: unpack_from(data, offset)
+
+
+def _unit(*fields, **rules):
+    '''Return a function decoding the values of one `Schema.units` unit from
+    the `fields` decoders and the `divisor`, `correction`, `converter` and
+    `expanded` rules.'''
+    divisor = rules.get('divisor')
+    correction = rules.get('correction')
+    converter = rules.get('converter')
+    expanded = rules.get('expanded', False)
+
+    def decode(data):
+        if converter is not None:
+            value = converter(*[field(data) for field in fields])
+        else:
+            value = fields[0](data)
+        if divisor is not None:
+            value = value / divisor
+        if not expanded:
+            return (value,)
+        if correction is not None:
+            return [v + correction for v in value]
+        return value
+    return decode
+
+
+#: Registry of the compiled schemas, by parser class, format and byte order.
+SCHEMAS = {}
+
+
 class DataParser(Dict):
     '''Implements a reusable class for working with a binary data structure.
-    It provides a named fields interface, similiar to C structures.'''
+    It provides a named fields interface, similiar to C structures.
 
-    def __init__(self, data, data_format, order='='):
+    The post-processing rules of the subclasses (see `Schema`) are compiled
+    once per class and data format.'''
+    SCALES = ()
+    EXPANDS = ()
+    CORRECTIONS = ()
+    CONVERTERS = ()
+    DROPS = ()
+
+    def __init__(self, data, data_format, order='=', offset=0):
         super(DataParser, self).__init__()
-        self.fields, format_t = zip(*data_format)
+        self.schema = self.get_schema(data_format, order)
+        # keep the raw data in place, `raw_bytes` is only sliced on access
+        self._data, self._offset = data, offset
         self.crc_error = False
-        if "CRC" in self.fields:
-            self.crc_error = not VantageProCRC(data).check()
-        format_t = str("%s%s" % (order, ''.join(format_t)))
-        self.struct = struct.Struct(format=format_t)
-        # save raw_bytes
-        self.raw_bytes = data
-        # Unpacks data from `raw_bytes` and returns a dication of named fields
-        data = self.struct.unpack_from(self.raw_bytes, 0)
-        self['Datetime'] = None
-        self.update(Dict(zip(self.fields, data)))
+        if self.schema.has_crc:
+            self.crc_error = not VantageProCRC(self.raw_bytes).check()
+        # Unpacks data from `raw_bytes` and fills the dict of named fields
+        self.update(zip(self.schema.keys, self.schema.decode(data, offset)))
+
+    @classmethod
+    def get_schema(cls, data_format, order='='):
+        '''Return the compiled `Schema` of `data_format` for this class.'''
+        key = (cls, data_format, order)
+        schema = SCHEMAS.get(key)
+        if schema is None:
+            schema = SCHEMAS[key] = Schema(data_format, order, cls.SCALES,
+                                           cls.EXPANDS, cls.CORRECTIONS,
+                                           cls.CONVERTERS, cls.DROPS)
+        return schema
+
+    @property
+    def fields(self):
+        return self.schema.fields
+
+    @property
+    def struct(self):
+        return self.schema.struct
+
+    @property
+    def raw_bytes(self):
+        '''The raw data of the packet. When the packet was parsed in place
+        from a larger buffer, this is a `memoryview` slice of it.'''
+        data, offset = self._data, self._offset
+        if offset == 0 and isinstance(data, bytes):
+            return data
+        return memoryview(data)[offset:offset + self.schema.size]
 
     @cached_property
     def raw(self):
         return bytes_to_hex(self.raw_bytes)
 
+    def to_record(self):
+        '''Return the parsed fields as a compact `Record`.'''
+        keys = tuple(self.keys())
+        if keys == self.schema.keys:
+            return self.schema.record_type(self.values())
+        return record_type(keys)(self.values())
+
     def tuple_to_dict(self, key):
         '''Convert {key<->tuple} to {key1<->value2, key2<->value2 ... }.'''
         for i, value in enumerate(self[key]):
@@ -144,121 +527,203 @@ class LoopDataParserRevB(DataParser):
         ('ForecastIcon', 'B'), ('ForecastRuleNo', 'B'), ('SunRise', 'H'),
         ('SunSet', 'H'), ('EOL', '2s'), ('CRC', 'H'),
     )
-
-    def __init__(self, data, dtime):
-        super(LoopDataParserRevB, self).__init__(data, self.LOOP_FORMAT)
-        self['Datetime'] = dtime
-        self['Barometer'] = self['Barometer'] / 1000
-        self['TempIn'] = self['TempIn'] / 10
-        self['TempOut'] = self['TempOut'] / 10
-        self['RainRate'] = self['RainRate'] / 100
-        self['RainStorm'] = self['RainStorm'] / 100
-        # Given a packed storm date field, unpack and return date
-        self['StormStartDate'] = self.unpack_storm_date()
+    SCALES = (
+        ('Barometer', 1000), ('TempIn', 10), ('TempOut', 10),
+        ('RainRate', 100), ('RainStorm', 100),
         # rain totals
-        self['RainDay'] = self['RainDay'] / 100
-        self['RainMonth'] = self['RainMonth'] / 100
-        self['RainYear'] = self['RainYear'] / 100
+        ('RainDay', 100), ('RainMonth', 100), ('RainYear', 100),
         # evapotranspiration totals
-        self['ETDay'] = self['ETDay'] / 1000
-        self['ETMonth'] = self['ETMonth'] / 100
-        self['ETYear'] = self['ETYear'] / 100
+        ('ETDay', 1000), ('ETMonth', 100), ('ETYear', 100),
+    )
+    EXPANDS = ('ExtraTemps', 'LeafTemps', 'SoilTemps', 'HumExtra',
+               'LeafWetness', 'SoilMoist')
+    CONVERTERS = (
+        ('StormStartDate', unpack_storm_date, ('StormStartDate',)),
         # battery statistics
-        self['BatteryVolts'] = self['BatteryVolts'] * 300 / 512 / 100
+        ('BatteryVolts', unpack_battery_volts, ('BatteryVolts',)),
         # sunrise / sunset
-        self['SunRise'] = self.unpack_time(self['SunRise'])
-        self['SunSet'] = self.unpack_time(self['SunSet'])
-        # convert to int
-        self['HumExtra'] = struct.unpack(b'7B', self['HumExtra'])
-        self['ExtraTemps'] = struct.unpack(b'7B', self['ExtraTemps'])
-        self['SoilMoist'] = struct.unpack(b'4B', self['SoilMoist'])
-        self['SoilTemps'] = struct.unpack(b'4B', self['SoilTemps'])
-        self['LeafWetness'] = struct.unpack(b'4B', self['LeafWetness'])
-        self['LeafTemps'] = struct.unpack(b'4B', self['LeafTemps'])
-
-        # Inside Alarms bits extraction, only 7 bits are used
-        self['AlarmIn'] = bytes_to_binary(self.raw_bytes[70])
-        self['AlarmInFallBarTrend'] = int(self['AlarmIn'][0])
-        self['AlarmInRisBarTrend'] = int(self['AlarmIn'][1])
-        self['AlarmInLowTemp'] = int(self['AlarmIn'][2])
-        self['AlarmInHighTemp'] = int(self['AlarmIn'][3])
-        self['AlarmInLowHum'] = int(self['AlarmIn'][4])
-        self['AlarmInHighHum'] = int(self['AlarmIn'][5])
-        self['AlarmInTime'] = int(self['AlarmIn'][6])
-        del self['AlarmIn']
-        # Rain Alarms bits extraction, only 5 bits are used
-        self['AlarmRain'] = bytes_to_binary(self.raw_bytes[71])
-        self['AlarmRainHighRate'] = int(self['AlarmRain'][0])
-        self['AlarmRain15min'] = int(self['AlarmRain'][1])
-        self['AlarmRain24hour'] = int(self['AlarmRain'][2])
-        self['AlarmRainStormTotal'] = int(self['AlarmRain'][3])
-        self['AlarmRainETDaily'] = int(self['AlarmRain'][4])
-        del self['AlarmRain']
-        # Oustide Alarms bits extraction, only 13 bits are used
-        self['AlarmOut'] = bytes_to_binary(self.raw_bytes[72])
-        self['AlarmOutLowTemp'] = int(self['AlarmOut'][0])
-        self['AlarmOutHighTemp'] = int(self['AlarmOut'][1])
-        self['AlarmOutWindSpeed'] = int(self['AlarmOut'][2])
-        self['AlarmOut10minAvgSpeed'] = int(self['AlarmOut'][3])
-        self['AlarmOutLowDewpoint'] = int(self['AlarmOut'][4])
-        self['AlarmOutHighDewPoint'] = int(self['AlarmOut'][5])
-        self['AlarmOutHighHeat'] = int(self['AlarmOut'][6])
-        self['AlarmOutLowWindChill'] = int(self['AlarmOut'][7])
-        self['AlarmOut'] = bytes_to_binary(self.raw_bytes[73])
-        self['AlarmOutHighTHSW'] = int(self['AlarmOut'][0])
-        self['AlarmOutHighSolarRad'] = int(self['AlarmOut'][1])
-        self['AlarmOutHighUV'] = int(self['AlarmOut'][2])
-        self['AlarmOutUVDose'] = int(self['AlarmOut'][3])
-        self['AlarmOutUVDoseEnabled'] = int(self['AlarmOut'][4])
-        del self['AlarmOut']
-        # AlarmExTempHum bits extraction, only 3 bits are used, but 7 bytes
-        for i in range(1, 8):
-            data = self.raw_bytes[74 + i]
-            self['AlarmExTempHum'] = bytes_to_binary(data)
-            self['AlarmEx%.2dLowTemp' % i] = int(self['AlarmExTempHum'][0])
-            self['AlarmEx%.2dHighTemp' % i] = int(self['AlarmExTempHum'][1])
-            self['AlarmEx%.2dLowHum' % i] = int(self['AlarmExTempHum'][2])
-            self['AlarmEx%.2dHighHum' % i] = int(self['AlarmExTempHum'][3])
-        del self['AlarmExTempHum']
-        # AlarmSoilLeaf 8bits, 4 bytes
-        for i in range(1, 5):
-            data = self.raw_bytes[81 + i]
-            self['AlarmSoilLeaf'] = bytes_to_binary(data)
-            self['Alarm%.2dLowLeafWet' % i] = int(self['AlarmSoilLeaf'][0])
-            self['Alarm%.2dHighLeafWet' % i] = int(self['AlarmSoilLeaf'][0])
-            self['Alarm%.2dLowSoilMois' % i] = int(self['AlarmSoilLeaf'][0])
-            self['Alarm%.2dHighSoilMois' % i] = int(self['AlarmSoilLeaf'][0])
-            self['Alarm%.2dLowLeafTemp' % i] = int(self['AlarmSoilLeaf'][0])
-            self['Alarm%.2dHighLeafTemp' % i] = int(self['AlarmSoilLeaf'][0])
-            self['Alarm%.2dLowSoilTemp' % i] = int(self['AlarmSoilLeaf'][0])
-            self['Alarm%.2dHighSoilTemp' % i] = int(self['AlarmSoilLeaf'][0])
-        del self['AlarmSoilLeaf']
-        # delete unused values
-        del self['LOO']
-        del self['NextRec']
-        del self['PacketType']
-        del self['EOL']
-        del self['CRC']
-        # Tuple to dict
-        self.tuple_to_dict("ExtraTemps")
-        self.tuple_to_dict("LeafTemps")
-        self.tuple_to_dict("SoilTemps")
-        self.tuple_to_dict("HumExtra")
-        self.tuple_to_dict("LeafWetness")
-        self.tuple_to_dict("SoilMoist")
+        ('SunRise', unpack_time, ('SunRise',)),
+        ('SunSet', unpack_time, ('SunSet',)),
+        (tuple(name for name, _, _ in LOOP_ALARMS), unpack_alarms,
+         ('AlarmIn', 'AlarmRain', 'AlarmOut', 'AlarmExTempHum',
+          'AlarmSoilLeaf')),
+    )
+    DROPS = ('LOO', 'NextRec', 'PacketType', 'EOL', 'CRC', 'AlarmIn',
+             'AlarmRain', 'AlarmOut', 'AlarmExTempHum', 'AlarmSoilLeaf')
+
+    def __init__(self, data, dtime):
+        super(LoopDataParserRevB, self).__init__(data, self.LOOP_FORMAT)
+        self['Datetime'] = dtime
 
     def unpack_storm_date(self):
         '''Given a packed storm date field, unpack and return date.'''
-        date = bytes_to_binary(self.raw_bytes[48:50])
-        year = binary_to_int(date, 0, 7) + 2000
-        day = binary_to_int(date, 7, 12)
-        month = binary_to_int(date, 12, 16)
-        return "%s-%s-%s" % (year, month, day)
+        offset = self.schema.offsets['StormStartDate']
+        return unpack_storm_date(struct.unpack_from(b'=H', self.raw_bytes,
+                                                    offset)[0])
 
     def unpack_time(self, time):
         '''Given a packed time field, unpack and return "HH:MM" string.'''
-        # format: HHMM, and space padded on the left.ex: "601" is 6:01 AM
-        return "%02d:%02d" % divmod(time, 100)  # covert to "06:01"
+        return unpack_time(time)
+
+
+class LazyDataParser(object):
+    '''Read-only mapping over a raw packet: each field is decoded, scaled and
+    expanded with the `Schema` units the first time it is read. `to_dict`
+    (and so `to_csv`) materializes all the fields.
+
+    :param data: The raw packet.
+
+    :param schema: The compiled `Schema` of the packet.
+
+    :param values: Dict of the values which are not read from the packet.
+    '''
+
+    def __init__(self, data, schema, values=None):
+        self.raw_bytes = data
+        self.schema = schema
+        self._values = dict(values or {})
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            keys, decode = self.schema.units[key]
+            self._values.update(zip(keys, decode(self.raw_bytes)))
+            return self._values[key]
+
+    def __contains__(self, key):
+        return key in self.schema.units
+
+    def __iter__(self):
+        return iter(self.schema.keys)
+
+    def __len__(self):
+        return len(self.schema.keys)
+
+    def get(self, key, default=None):
+        '''Return the value of `key` if it exists, else `default`.'''
+        if key in self.schema.units:
+            return self[key]
+        return default
+
+    def keys(self):
+        return list(self.schema.keys)
+
+    def values(self):
+        return list(self.to_dict().values())
+
+    def items(self):
+        return list(self.to_dict().items())
+
+    @property
+    def fields(self):
+        return self.schema.fields
+
+    @cached_property
+    def crc_error(self):
+        if self.schema.has_crc:
+            return not VantageProCRC(self.raw_bytes).check()
+        return False
+
+    @cached_property
+    def raw(self):
+        return bytes_to_hex(self.raw_bytes)
+
+    def to_dict(self):
+        '''Decode all the fields and return them as a `Dict`.'''
+        data = Dict(zip(self.schema.keys, self.schema.decode(self.raw_bytes)))
+        data.update(self._values)
+        return data
+
+    def filter(self, keys):
+        '''Create a `Dict` with only the following `keys`, only these
+        fields are decoded.'''
+        return Dict((key, self[key]) for key in keys if key in self)
+
+    def to_csv(self, delimiter=',', header=True):
+        '''Serialize the materialized fields to csv.'''
+        return self.to_dict().to_csv(delimiter, header)
+
+    def __unicode__(self):
+        name = self.__class__.__name__
+        return "<%s %s>" % (name, self.raw)
+
+    def __str__(self):
+        return str(self.__unicode__())
+
+    def __repr__(self):
+        return str(self.__unicode__())
+
+
+class LazyLoopDataParserRevB(LazyDataParser):
+    '''Lazy version of `LoopDataParserRevB`, the fields of the 'LOOP'
+    packet are decoded on first access.'''
+
+    def __init__(self, data, dtime):
+        parser = LoopDataParserRevB
+        super(LazyLoopDataParserRevB, self).__init__(
+            data, parser.get_schema(parser.LOOP_FORMAT), {'Datetime': dtime})
+
+
+class Loop2DataParser(DataParser):
+    '''Parse data returned by the 'LPS' command with the LOOP2 packet type
+    (`PacketType` 1). It contains the wind averages, dew point, heat index,
+    wind chill and THSW values computed by the console.'''
+    LOOP2_FORMAT = (
+        ('LOO', '3s'), ('BarTrend', 'B'), ('PacketType', 'B'),
+        ('Unused1', 'H'), ('Barometer', 'H'), ('TempIn', 'H'),
+        ('HumIn', 'B'), ('TempOut', 'H'), ('WindSpeed', 'B'),
+        ('Unused2', 'B'), ('WindDir', 'H'), ('WindSpeed10Min', 'H'),
+        ('WindSpeed2Min', 'H'), ('WindGust10Min', 'H'),
+        ('WindGustDir10Min', 'H'), ('Unused3', '4s'), ('DewPoint', 'h'),
+        ('Unused4', 'B'), ('HumOut', 'B'), ('Unused5', 'B'),
+        ('HeatIndex', 'h'), ('WindChill', 'h'), ('THSW', 'h'),
+        ('RainRate', 'H'), ('UV', 'B'), ('SolarRad', 'H'),
+        ('RainStorm', 'H'), ('StormStartDate', 'H'), ('RainDay', 'H'),
+        ('Rain15Min', 'H'), ('RainHour', 'H'), ('ETDay', 'H'),
+        ('Rain24Hours', 'H'), ('BarReduction', 'B'), ('BarOffset', 'h'),
+        ('BarCalibration', 'h'), ('BarRaw', 'H'), ('BarAbsolute', 'H'),
+        ('Altimeter', 'H'), ('Unused6', '2s'), ('GraphPointers', '10s'),
+        ('Unused7', '12s'), ('EOL', '2s'), ('CRC', 'H'),
+    )
+    SCALES = (
+        ('Barometer', 1000), ('TempIn', 10), ('TempOut', 10),
+        # wind averages (0.1 mph)
+        ('WindSpeed10Min', 10), ('WindSpeed2Min', 10),
+        ('RainRate', 100), ('RainStorm', 100),
+        # rain totals
+        ('RainDay', 100), ('Rain15Min', 100), ('RainHour', 100),
+        ('Rain24Hours', 100), ('ETDay', 1000),
+        # barometer calibration and readings
+        ('BarOffset', 1000), ('BarCalibration', 1000), ('BarRaw', 1000),
+        ('BarAbsolute', 1000), ('Altimeter', 1000),
+    )
+    CONVERTERS = (
+        ('StormStartDate', unpack_storm_date, ('StormStartDate',)),
+    )
+    DROPS = ('LOO', 'PacketType', 'Unused1', 'Unused2', 'Unused3',
+             'Unused4', 'Unused5', 'Unused6', 'GraphPointers', 'Unused7',
+             'EOL', 'CRC')
+
+    def __init__(self, data, dtime):
+        super(Loop2DataParser, self).__init__(data, self.LOOP2_FORMAT)
+        self['Datetime'] = dtime
+
+
+#: LOOP packet parsers by `PacketType` byte.
+LOOP_PARSERS = {0: LoopDataParserRevB, 1: Loop2DataParser}
+
+
+def parse_loop_packet(data, dtime):
+    '''Parse a LOOP or LOOP2 packet with the parser of its `PacketType`.'''
+    offset = LoopDataParserRevB.get_schema(
+        LoopDataParserRevB.LOOP_FORMAT).offsets['PacketType']
+    packet_type = struct.unpack_from(b'B', data, offset)[0]
+    try:
+        parser = LOOP_PARSERS[packet_type]
+    except KeyError:
+        raise ValueError("Unknown LOOP packet type %d" % packet_type)
+    return parser(data, dtime)
 
 
 class ArchiveDataParserRevB(DataParser):
@@ -277,41 +742,23 @@ class ArchiveDataParserRevB(DataParser):
         ('SoilTemps',     '4s'), ('RecType',     'B'), ('ExtraHum',    '2s'),
         ('ExtraTemps',    '3s'), ('SoilMoist',  '4s'),
     )
+    SCALES = (
+        ('TempOut', 10), ('TempOutHi', 10), ('TempOutLow', 10),
+        ('Barometer', 1000), ('TempIn', 10), ('UV', 10), ('ETHour', 1000),
+    )
+    EXPANDS = ('SoilTemps', 'LeafTemps', 'ExtraTemps', 'SoilMoist',
+               'LeafWetness', 'ExtraHum')
+    CORRECTIONS = (('SoilTemps', -90), ('LeafTemps', -90),
+                   ('ExtraTemps', -90))
+    CONVERTERS = (
+        ('Datetime', unpack_dmp_date_time, ('DateStamp', 'TimeStamp')),
+        ('raw_datestamp', unpack_raw_datestamp, ('DateStamp', 'TimeStamp')),
+    )
+    DROPS = ('DateStamp', 'TimeStamp')
 
-    def __init__(self, data):
-        super(ArchiveDataParserRevB, self).__init__(data, self.ARCHIVE_FORMAT)
-        self['raw_datestamp'] = bytes_to_binary(self.raw_bytes[0:4])
-        self['Datetime'] = unpack_dmp_date_time(self['DateStamp'],
-                                                self['TimeStamp'])
-        del self['DateStamp']
-        del self['TimeStamp']
-        self['TempOut'] = self['TempOut'] / 10
-        self['TempOutHi'] = self['TempOutHi'] / 10
-        self['TempOutLow'] = self['TempOutLow'] / 10
-        self['Barometer'] = self['Barometer'] / 1000
-        self['TempIn'] = self['TempIn'] / 10
-        self['UV'] = self['UV'] / 10
-        self['ETHour'] = self['ETHour'] / 1000
-        '''
-        self['WindHiDir'] = int(self['WindHiDir'] * 22.5)
-        self['WindAvgDir'] = int(self['WindAvgDir'] * 22.5)
-        '''
-        SoilTempsValues = struct.unpack(b'4B', self['SoilTemps'])
-        self['SoilTemps'] = tuple((t - 90) for t in SoilTempsValues)
-
-        self['ExtraHum'] = struct.unpack(b'2B', self['ExtraHum'])
-        self['SoilMoist'] = struct.unpack(b'4B', self['SoilMoist'])
-        LeafTempsValues = struct.unpack(b'2B', self['LeafTemps'])
-        self['LeafTemps'] = tuple((t - 90) for t in LeafTempsValues)
-        self['LeafWetness'] = struct.unpack(b'2B', self['LeafWetness'])
-        ExtraTempsValues = struct.unpack(b'3B', self['ExtraTemps'])
-        self['ExtraTemps'] = tuple((t - 90) for t in ExtraTempsValues)
-        self.tuple_to_dict("SoilTemps")
-        self.tuple_to_dict("LeafTemps")
-        self.tuple_to_dict("ExtraTemps")
-        self.tuple_to_dict("SoilMoist")
-        self.tuple_to_dict("LeafWetness")
-        self.tuple_to_dict("ExtraHum")
+    def __init__(self, data, offset=0):
+        super(ArchiveDataParserRevB, self).__init__(data, self.ARCHIVE_FORMAT,
+                                                    offset=offset)
 
 
 class DmpHeaderParser(DataParser):
@@ -329,8 +776,28 @@ class DmpPageParser(DataParser):
         ('CRC',   'H'),
     )
 
-    def __init__(self, data):
-        super(DmpPageParser, self).__init__(data, self.DMP_FORMAT)
+    def __init__(self, data, offset=0):
+        super(DmpPageParser, self).__init__(data, self.DMP_FORMAT,
+                                            offset=offset)
+
+
+#: The parsers and data formats of the packets, compiled at import time.
+PACKET_FORMATS = (
+    (LoopDataParserRevB, LoopDataParserRevB.LOOP_FORMAT),
+    (Loop2DataParser, Loop2DataParser.LOOP2_FORMAT),
+    (ArchiveDataParserRevB, ArchiveDataParserRevB.ARCHIVE_FORMAT),
+    (DmpHeaderParser, DmpHeaderParser.DMP_FORMAT),
+    (DmpPageParser, DmpPageParser.DMP_FORMAT),
+)
+
+
+def compile_schemas(formats=PACKET_FORMATS):
+    '''Compile the schemas of the (parser, data format) `formats` and return
+    them.'''
+    return [parser.get_schema(data_format) for parser, data_format in formats]
+
+
+compile_schemas()
 
 
 def pack_dmp_date_time(d):
@@ -341,16 +808,6 @@ def pack_dmp_date_time(d):
     return VantageProCRC(data).data_with_checksum
 
 
-def unpack_dmp_date_time(date, time):
-    '''Unpack `date` and `time` to datetime'''
-    if date != 0xffff and time != 0xffff:
-        day = date & 0x1f                     # 5 bits
-        month = (date >> 5) & 0x0f            # 4 bits
-        year = ((date >> 9) & 0x7f) + 2000    # 7 bits
-        hour, min_ = divmod(time, 100)
-        return datetime(year, month, day, hour, min_)
-
-
 def pack_datetime(dtime):
     '''Returns packed `dtime` with CRC.'''
     data = struct.pack(b'>BBBBBB', dtime.second, dtime.minute,
@@ -363,3 +820,97 @@ def unpack_datetime(data):
     VantageProCRC(data).check()
     s, m, h, day, month, year = struct.unpack(b'>BBBBBB', data[:6])
     return datetime(year + 1900, month, day, h, m, s)
+
+
+#: NumPy types of the struct format characters (little-endian, as sent by
+#: the station).
+NUMPY_TYPES = {
+    'B': '<u1', 'b': '<i1', 'H': '<u2', 'h': '<i2', 'I': '<u4', 'i': '<i4',
+    's': '<u1', 'x': '<V1',
+}
+
+
+def numpy_dtype(data_format):
+    '''Return the NumPy structured dtype equivalent to `data_format`. String
+    fields become arrays of unsigned bytes. NumPy is required.'''
+    import numpy
+    fields = []
+    for name, format_t in data_format:
+        count, code = int(format_t[:-1] or 1), format_t[-1]
+        if count > 1:
+            fields.append((str(name), NUMPY_TYPES[code], (count,)))
+        else:
+            fields.append((str(name), NUMPY_TYPES[code]))
+    return numpy.dtype(fields)
+
+
+def unpack_dmp_pages(data, check_crc=True):
+    '''Decode a contiguous buffer of DMP pages (267 bytes each) into a NumPy
+    structured array of archive records (RevB), in one call.
+
+    The columns are the same as `ArchiveDataParserRevB` keys (except
+    `raw_datestamp`), with the scaling and offset corrections applied
+    column-wise and `Datetime` as `datetime64[m]`. Empty and invalid records
+    are skipped.
+
+    :param data: The raw DMP pages.
+
+    :param check_crc: If True, the pages with a bad CRC are skipped.
+    '''
+    import numpy
+    parser = ArchiveDataParserRevB
+    page_size = DmpPageParser.get_schema(DmpPageParser.DMP_FORMAT).size
+    if len(data) % page_size:
+        raise ValueError("data length must be a multiple of %d" % page_size)
+    record_dtype = numpy_dtype(parser.ARCHIVE_FORMAT)
+    page_dtype = numpy.dtype([(str('Index'), '<u1'),
+                              (str('Records'), record_dtype, (5,)),
+                              (str('unused'), '<u1', (4,)),
+                              (str('CRC'), '>u2')])
+    pages = numpy.frombuffer(data, dtype=page_dtype)
+    if check_crc:
+        valid = check_crc_blocks(data, page_size)
+        pages = pages[numpy.array(valid, dtype=bool)]
+    records = pages['Records'].reshape(-1)
+    # DateStamp and TimeStamp to datetime64
+    date = records['DateStamp'].astype('i8')
+    time = records['TimeStamp'].astype('i8')
+    day, month, year = date & 0x1f, (date >> 5) & 0x0f, (date >> 9) & 0x7f
+    hour, minute = time // 100, time % 100
+    valid = ((records['DateStamp'] != 0xffff) &
+             (records['TimeStamp'] != 0xffff) &
+             (month >= 1) & (month <= 12) & (day >= 1) &
+             (hour < 24) & (minute < 60))
+    records = records[valid]
+    months = (year[valid] + 30) * 12 + month[valid] - 1
+    datetimes = (months.astype('datetime64[M]').astype('datetime64[m]') +
+                 ((day[valid] - 1) * 1440 + hour[valid] * 60 +
+                  minute[valid]).astype('timedelta64[m]'))
+    # output columns, in the parser keys order
+    schema = parser.get_schema(parser.ARCHIVE_FORMAT)
+    scales = dict(parser.SCALES)
+    corrections = dict(parser.CORRECTIONS)
+    columns = [(str('Datetime'), 'datetime64[m]')]
+    for name in schema.keys[1:]:
+        if name in scales:
+            columns.append((str(name), 'f8'))
+        elif name in record_dtype.names:
+            columns.append((str(name), record_dtype[name].str))
+    for name in parser.EXPANDS:
+        base = record_dtype[name].base.str
+        dtype = 'i2' if name in corrections else base
+        for i in range(record_dtype[name].shape[0]):
+            columns.append((str("%s%.2d" % (name, i + 1)), dtype))
+    array = numpy.empty(len(records), dtype=numpy.dtype(columns))
+    array['Datetime'] = datetimes
+    for name in array.dtype.names[1:]:
+        if name in scales:
+            array[name] = records[name] / scales[name]
+        elif name in record_dtype.names:
+            array[name] = records[name]
+    for name in parser.EXPANDS:
+        values = records[name].astype(array.dtype["%s01" % name])
+        values += corrections.get(name, 0)
+        for i in range(values.shape[1]):
+            array["%s%.2d" % (name, i + 1)] = values[:, i]
+    return array
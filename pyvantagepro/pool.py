@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+'''
+    pyvantagepro.pool
+    -----------------
+
+    Concurrent polling of many stations with persistent connections.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import division, unicode_literals
+import threading
+import time
+from collections import namedtuple
+from pylink import link_from_url
+
+from .logger import LOGGER
+from .compat import Queue, OrderedDict
+from .device import VantagePro2
+
+
+#: Result of a command on a station: the station id, and the returned value
+#: or the raised exception.
+PollResult = namedtuple('PollResult', ('station', 'value', 'error'))
+
+
+class Station(object):
+    '''A station of a `StationPool`, with its persistent connection which is
+    opened on the first command and opened again after a failure.
+
+    :param id: The station id of the results.
+
+    :param url: A `PyLink` connection URL.
+
+    :param interval: The minimum number of seconds between the beginnings of
+        two commands (rate limit).
+
+    :param timeout: The read timeout of the link.
+
+    :param retry_policy: A `RetryPolicy` for the retried commands.
+    '''
+
+    def __init__(self, id, url, interval=0, timeout=10, retry_policy=None):
+        self.id = id
+        self.url = url
+        self.interval = interval
+        self.timeout = timeout
+        self.retry_policy = retry_policy
+        self.device = None
+        # datetime of the last downloaded archive record
+        self.last_archive = None
+        self._last_call = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Station %s %s>' % (self.id, self.url)
+
+    def connect(self):
+        '''Opens the connection, unless it is already opened.'''
+        if self.device is None:
+            link = link_from_url(self.url)
+            link.settimeout(self.timeout)
+            try:
+                self.device = VantagePro2(link, self.retry_policy)
+            except Exception:
+                link.close()
+                raise
+        return self.device
+
+    def disconnect(self):
+        '''Closes the connection.'''
+        if self.device is not None:
+            try:
+                self.device.link.close()
+            except Exception as e:
+                LOGGER.error('Error: %s' % e)
+            self.device = None
+
+    def wait_time(self):
+        '''Returns the number of seconds to wait before the next command.'''
+        if self._last_call is None:
+            return 0
+        return max(0, self._last_call + self.interval - time.time())
+
+    def call(self, command, *args, **kwargs):
+        '''Runs `command` with `args` and `kwargs` once the rate limit
+        allows it, and returns its value. `command` is the name of a
+        `VantagePro2` method, or a function called with the station. The
+        connection is closed if the command fails.'''
+        with self._lock:
+            delay = self.wait_time()
+            if delay > 0:
+                time.sleep(delay)
+            self._last_call = time.time()
+            try:
+                device = self.connect()
+                if callable(command):
+                    return command(self, *args, **kwargs)
+                return getattr(device, command)(*args, **kwargs)
+            except Exception:
+                LOGGER.error('%r: command failed, disconnecting' % self)
+                self.disconnect()
+                raise
+
+    def new_archives(self):
+        '''Returns the archive records since the last downloaded one.'''
+        records = self.device.get_archives(self.last_archive)
+        if records:
+            self.last_archive = records[-1]['Datetime']
+        return records
+
+
+class StationPool(object):
+    '''Runs the commands on many stations concurrently, one thread by
+    station, and keeps their connections opened between the commands.
+
+    :param urls: A dict of `PyLink` URLs by station id, or a list of URLs
+        which are also the station ids.
+
+    :param interval: The minimum number of seconds between two commands on
+        a station.
+
+    :param timeout: The read timeout of the links.
+
+    :param retry_policy: A `RetryPolicy` for the retried commands.
+
+    :param workers: The maximum number of stations which run a command at
+        the same time, None for no limit.
+    '''
+
+    def __init__(self, urls, interval=0, timeout=10, retry_policy=None,
+                 workers=None):
+        if not isinstance(urls, dict):
+            urls = OrderedDict((url, url) for url in urls)
+        self.stations = OrderedDict(
+            (id, Station(id, url, interval, timeout, retry_policy))
+            for id, url in urls.items())
+        self._workers = (threading.BoundedSemaphore(workers)
+                         if workers else None)
+
+    def poll(self, command, *args, **kwargs):
+        '''Yields the `PollResult` of `command` on every station as they are
+        completed. `command` is run `rounds` times by station (None to poll
+        until the generator is closed), the stations are not waiting for
+        each other.
+
+        :param command: The name of a `VantagePro2` method, or a function
+            called with the `Station`, with `args` and `kwargs`.
+
+        :param rounds: The number of runs by station, a keyword argument
+            only (default 1).
+        '''
+        rounds = kwargs.pop('rounds', 1)
+        queue = Queue()
+        stop = threading.Event()
+
+        def worker(station):
+            done = 0
+            while (rounds is None or done < rounds) and \
+                    not stop.wait(station.wait_time()):
+                if self._workers is not None:
+                    self._workers.acquire()
+                try:
+                    value = station.call(command, *args, **kwargs)
+                except Exception as e:
+                    LOGGER.error('%r: %s' % (station, e))
+                    result = PollResult(station.id, None, e)
+                else:
+                    result = PollResult(station.id, value, None)
+                finally:
+                    if self._workers is not None:
+                        self._workers.release()
+                queue.put(result)
+                done += 1
+            queue.put(None)
+
+        threads = [threading.Thread(target=worker, args=(station,))
+                   for station in self.stations.values()]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        running = len(threads)
+        try:
+            while running:
+                result = queue.get()
+                if result is None:
+                    running -= 1
+                else:
+                    yield result
+        finally:
+            stop.set()
+
+    def current_data(self, rounds=1):
+        '''Yields the real-time data of the stations (`poll` of
+        `get_current_data`).'''
+        return self.poll('get_current_data', rounds=rounds)
+
+    def archives(self, rounds=1):
+        '''Yields the new archive records of the stations since the last
+        call, as `ListDict` (`poll` of `Station.new_archives`).'''
+        return self.poll(Station.new_archives, rounds=rounds)
+
+    def close(self):
+        '''Closes the connections, once their current command is done.'''
+        for station in self.stations.values():
+            with station._lock:
+                station.disconnect()
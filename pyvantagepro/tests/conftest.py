@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+'''
+    pyvantagepro.tests.conftest
+    ---------------------------
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+import pytest
+
+from ..compat import has_asyncio
+from ..emulator import Session
+
+# the asyncio tests are not valid syntax before Python 3.6
+collect_ignore = [] if has_asyncio else ['test_aio.py']
+
+
+@pytest.fixture
+def console_requests(monkeypatch):
+    '''The list of the requests received by the emulated consoles, as
+    bytes: the text commands without their line feed ('' for a wake-up) and
+    the answers to the dump pages.'''
+    requests = []
+    command = Session.command
+    dump_answer = Session.dump_answer
+
+    def record_command(session, line, now):
+        requests.append(line.encode('ascii', 'replace'))
+        command(session, line, now)
+
+    def record_answer(session, answer, now):
+        requests.append(answer)
+        dump_answer(session, answer, now)
+    monkeypatch.setattr(Session, 'command', record_command)
+    monkeypatch.setattr(Session, 'dump_answer', record_answer)
+    return requests
@@ -0,0 +1,153 @@
+# coding: utf8
+'''
+    pyvantagepro.tests.test_aio
+    ---------------------------
+
+    The pyvantagepro test suite.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+import asyncio
+import struct
+import time
+from datetime import datetime, timedelta
+
+from ..aio import AsyncVantagePro2, link_from_url
+from ..device import VantagePro2
+from ..emulator import Console, ConsoleServer, ESC, NACK
+from ..utils import RetryPolicy
+
+START = datetime(2013, 1, 1)
+
+
+def run(console, *coroutines):
+    '''Runs the `coroutines` with the url of a server of the `console`.'''
+    async def main(url):
+        return await asyncio.gather(*[coroutine(url)
+                                      for coroutine in coroutines])
+    with ConsoleServer(console) as server:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(main(server.url))
+        finally:
+            loop.close()
+
+
+def test_commands(console_requests):
+    '''Test the commands of the asynchronous device.'''
+    async def commands(url):
+        async with await AsyncVantagePro2.from_url(url, 1) as device:
+            assert device.RevB is True
+            assert await device.archive_period() == 5
+            data = await device.get_current_data()
+            assert data.crc_error is False
+            assert 28.5 <= data['Barometer'] <= 30.8
+            return await device.gettime(), device.link.url
+    console = Console(start=START, baudrate=None)
+    console.clock_offset = datetime(2013, 1, 2) - datetime.now()
+    [(dtime, url)] = run(console, commands)
+    assert abs(dtime - datetime(2013, 1, 2)) < timedelta(seconds=2)
+    assert url.startswith('tcp:127.0.0.1:')
+    # the console is awake after the first command
+    assert console_requests.count(b'') == 1
+
+
+def test_link():
+    '''Test the reads of a link, up to a marker and with a timeout factor
+    of the link timeout.'''
+    async def reads(url):
+        link = link_from_url(url)
+        link.settimeout(0.05)
+        await link.open()
+        await link.write(b'TEST\n')
+        replies = [await link.read_until(b'\n\r'), await link.read(6)]
+        begin = time.time()
+        replies.append(await link.read(1, timeout=2))
+        await link.close()
+        return replies, time.time() - begin
+    [(replies, seconds)] = run(Console(start=START, baudrate=None), reads)
+    assert replies == [b'\n\r', b'TEST\n\r', b'']
+    assert seconds >= 0.09
+
+
+def test_emulated_settings():
+    '''Test the settings and text replies of an emulated console, with a
+    negative timezone offset and a longer firmware version, are the ones of
+    the synchronous device.'''
+    console = Console(start=START, baudrate=None)
+    console.FIRMWARE_VERSION = b'1.100'
+    struct.pack_into(b'<hB', console.eeprom, 0x14, -500, 1)
+
+    async def settings(url):
+        async with await AsyncVantagePro2.from_url(url, 1) as device:
+            return (await device.timezone(), await device.archive_period(),
+                    await device.firmware_date(),
+                    await device.firmware_version(),
+                    await device.diagnostics(), await device.gettime())
+    [result] = run(console, settings)
+    with ConsoleServer(console) as server:
+        device = VantagePro2.from_url(server.url, timeout=1)
+        assert result[:5] == (device.timezone, device.archive_period,
+                              device.firmware_date, device.firmware_version,
+                              device.diagnostics)
+        device.link.close()
+    assert result[:2] == ('GMT-5.00', 5)
+    assert result[3] == '1.100'
+    assert result[4]['total_received'] == 21629
+    # nothing is left on the link by the text replies
+    assert isinstance(result[5], datetime)
+
+
+def test_archives():
+    '''Test the asynchronous archive download of several stations.'''
+    async def archives(url):
+        device = await AsyncVantagePro2.from_url(url, 1)
+        records = await device.get_archives(stop_date=datetime(2014, 1, 1))
+        await device.close()
+        return records
+
+    async def range_archives(url):
+        device = await AsyncVantagePro2.from_url(url, 1)
+        records = await device.get_archives(START + timedelta(minutes=50),
+                                            START + timedelta(minutes=70))
+        await device.close()
+        return records
+    results = run(Console(23, start=START, baudrate=None),
+                  *[archives] * 5 + [range_archives])
+    for records in results[:5]:
+        assert [r['Datetime'] for r in records] == [
+            START + timedelta(minutes=5 * i) for i in range(23)]
+    assert [r['Datetime'] for r in results[5]] == [
+        START + timedelta(minutes=minutes) for minutes in (55, 60, 65, 70)]
+
+
+def test_archives_cancel_and_retry(console_requests):
+    '''Test the download is canceled when the generator is closed, and a bad
+    page is downloaded again.'''
+    async def cancel(url):
+        device = await AsyncVantagePro2.from_url(url, 1)
+        records = device.archives(stop_date=datetime(2014, 1, 1))
+        async for record in records:
+            break
+        await records.aclose()
+        # the console handles the cancel before the next command
+        await device.gettime()
+        await device.close()
+        return record['Datetime']
+    console = Console(23, start=START, baudrate=None)
+    assert run(console, cancel) == [START]
+    assert console_requests[-2:] == [ESC, b'GETTIME']
+
+    async def retry(url):
+        device = await AsyncVantagePro2.from_url(url, 1,
+                                                 RetryPolicy(3, delay=0))
+        records = await device.get_archives(stop_date=datetime(2014, 1, 1))
+        await device.close()
+        return len(records), device.retry_policy.stats()
+    console.bad_pages = [False, False, True]
+    [(count, stats)] = run(console, retry)
+    assert count == 23
+    assert stats['_read_dump_page']['retries'] == 1
+    assert NACK in console_requests
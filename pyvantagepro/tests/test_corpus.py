@@ -0,0 +1,69 @@
+# coding: utf8
+'''
+    pyvantagepro.tests.test_corpus
+    ------------------------------
+
+    The pyvantagepro test suite.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import unicode_literals
+from datetime import datetime, timedelta
+
+from ..corpus import PacketGenerator, RECORD_SIZE
+from ..parser import (LoopDataParserRevB, Loop2DataParser,
+                      ArchiveDataParserRevB, DmpHeaderParser, DmpPageParser,
+                      parse_loop_packet, check_crc_blocks)
+
+
+def test_loop_packets():
+    '''Test the generated LOOP packets are valid and plausible.'''
+    generator = PacketGenerator(seed=1)
+    for _ in range(100):
+        item = parse_loop_packet(generator.loop(), datetime.now())
+        assert type(item) is LoopDataParserRevB
+        assert item.crc_error is False
+        assert 28.5 <= item['Barometer'] <= 30.8
+        assert 20 <= item['TempOut'] <= 95
+        assert 0 <= item['WindDir'] <= 360
+        item = parse_loop_packet(generator.loop2(), datetime.now())
+        assert type(item) is Loop2DataParser
+        assert item.crc_error is False
+        assert 0 <= item['WindSpeed10Min'] <= 30
+
+
+def test_archive_records():
+    '''Test the generated archive records and DMP pages.'''
+    generator = PacketGenerator(seed=2)
+    start = datetime(2014, 12, 31, 23, 50)
+    pages = generator.dmp_pages(start, 3, period=10)
+    for i, page in enumerate(pages):
+        item = DmpPageParser(page)
+        assert item.crc_error is False
+        assert item['Index'] == i
+        for j in range(5):
+            record = ArchiveDataParserRevB(page, 1 + j * RECORD_SIZE)
+            assert record['Datetime'] == start + timedelta(minutes=(i * 5 +
+                                                                    j) * 10)
+            assert record['TempOutLow'] <= record['TempOut'] <= \
+                record['TempOutHi']
+    # unused records are dashed
+    page = generator.dmp_page(0, generator.archive_records(start, 2))
+    assert page[1 + 2 * RECORD_SIZE:-6] == b'\xff' * 3 * RECORD_SIZE
+    header = DmpHeaderParser(generator.dmp_header(12, 3))
+    assert (header['Pages'], header['Offset']) == (12, 3)
+    assert header.crc_error is False
+
+
+def test_seed_and_corruption():
+    '''Test the packets are reproducible and corrupted packets are bad.'''
+    assert PacketGenerator(seed=3).loop() == PacketGenerator(seed=3).loop()
+    generator = PacketGenerator(seed=3, corruption=1)
+    pages = b''.join(generator.dmp_pages(datetime(2014, 1, 1), 20))
+    assert not any(check_crc_blocks(pages, len(pages) // 20))
+    assert LoopDataParserRevB(generator.loop(), None).crc_error
+    generator = PacketGenerator(seed=3, corruption=0.5)
+    pages = b''.join(generator.dmp_pages(datetime(2014, 1, 1), 100))
+    assert 20 < sum(check_crc_blocks(pages, len(pages) // 100)) < 80
@@ -0,0 +1,206 @@
+# coding: utf8
+'''
+    pyvantagepro.tests.test_device
+    ------------------------------
+
+    The pyvantagepro test suite.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import unicode_literals
+import json
+from datetime import datetime, timedelta
+
+from .. import device
+from ..device import VantagePro2
+from ..emulator import Console, ConsoleLink, ARCHIVE_PAGES
+from ..corpus import RECORDS_BY_PAGE
+from ..utils import RetryPolicy, MetadataCache
+
+START = datetime(2013, 1, 1)
+STOP = datetime(2014, 1, 1)
+
+
+def record_dates(first, last):
+    '''Datetimes of the emulated records from `first` to `last`.'''
+    return [START + timedelta(minutes=5 * i) for i in range(first, last + 1)]
+
+
+def console_link(records=7):
+    '''Returns the link of an emulated console with `records` archive
+    records every 5 minutes from `START`.'''
+    return ConsoleLink(Console(records, start=START, baudrate=None),
+                       timeout=0.05)
+
+
+def test_resumed_archives(console_requests):
+    '''Test a download interrupted by a bad page is resumed.'''
+    link = console_link(17)
+    device = VantagePro2(link, RetryPolicy(3, delay=0))
+    # the second page is bad 3 times, the download is canceled
+    link.console.bad_pages = [False, True, True, True]
+    records = device.get_archives(stop_date=STOP)
+    assert [r['Datetime'] for r in records] == record_dates(0, 4)
+    for pipeline in (False, True):
+        link.console.bad_pages = [False, True, True, True]
+        del console_requests[:]
+        records = device.get_archives(stop_date=STOP, pipeline=pipeline,
+                                      resumes=1)
+        assert [r['Datetime'] for r in records] == record_dates(0, 16)
+        assert console_requests.count(b'DMPAFT') == 2
+
+
+def test_checkpoint(tmpdir):
+    '''Test the download restarts after the record of the checkpoint.'''
+    device = VantagePro2(console_link(17))
+    path = str(tmpdir.join('archives.json'))
+    generator = device._get_archives_generator(stop_date=STOP,
+                                               checkpoint=path)
+    dates = [record['Datetime'] for _, record in zip(range(7), generator)]
+    generator.close()
+    assert dates == record_dates(0, 6)
+    # only the first page was handled
+    with open(path) as state_file:
+        assert json.load(state_file) == {'datetime': '2013-01-01 00:20:00'}
+    records = device.get_archives(stop_date=STOP, checkpoint=path)
+    assert [r['Datetime'] for r in records] == record_dates(5, 16)
+    with open(path) as state_file:
+        assert json.load(state_file) == {'datetime': '2013-01-01 01:20:00'}
+    assert device.get_archives(stop_date=STOP, checkpoint=path) == []
+
+
+def test_resumed_mid_page(tmpdir):
+    '''Test a download resumed after a record which is not the last one of
+    its page, and sent again by the new download, is not taken for the
+    wrap-around of the archive memory.'''
+    link = console_link(17)
+    # the records of the 5 minutes period are downloaded with a 10 minutes
+    # archive period, the date of a DMPAFT is rounded before its record
+    link.console.eeprom[0x2D] = 10
+    device = VantagePro2(link, RetryPolicy(3, delay=0))
+    # the third page is bad 3 times, resumed after the record 9
+    link.console.bad_pages = [False, False, True, True, True]
+    [since] = record_dates(2, 2)
+    records = device.get_archives(since, STOP, resumes=1)
+    assert [r['Datetime'] for r in records] == record_dates(3, 16)
+    # and from a checkpoint
+    path = str(tmpdir.join('archives.json'))
+    generator = device._get_archives_generator(since, STOP, checkpoint=path)
+    assert [record['Datetime'] for _, record in zip(range(8), generator)] \
+        == record_dates(3, 10)
+    generator.close()
+    # after the last record of the second page, in the middle of a page of
+    # the 10 minutes period
+    records = device.get_archives(since, STOP, checkpoint=path)
+    assert [r['Datetime'] for r in records] == record_dates(10, 16)
+
+
+def test_dump_offset(monkeypatch):
+    '''Test the stale records of the first page are not parsed, and the
+    download stops at the old records of the archive memory.'''
+    parsed = []
+
+    class ArchiveDataParser(device.ArchiveDataParserRevB):
+        def __init__(self, data, offset=0):
+            parsed.append(offset)
+            super(ArchiveDataParser, self).__init__(data, offset)
+    monkeypatch.setattr(device, 'ArchiveDataParserRevB', ArchiveDataParser)
+    # the archive memory has wrapped around, the newest record is the second
+    # one of the fourth page, followed by old records
+    ring = ARCHIVE_PAGES * RECORDS_BY_PAGE
+    newest = ring + 16
+    vantagepro2 = VantagePro2(console_link(newest + 1))
+    records = vantagepro2.get_archives(stop_date=STOP)
+    assert [r['Datetime'] for r in records] == record_dates(17, newest)
+    # the first record of the first page is stale
+    del parsed[:]
+    [since] = record_dates(newest - 1, newest - 1)
+    records = vantagepro2.get_archives(since, STOP)
+    assert [r['Datetime'] for r in records] == record_dates(newest, newest)
+    # and the next record is an old one
+    assert parsed == [1 + 52, 1 + 2 * 52]
+    # incremental update without new record
+    del parsed[:]
+    [since] = record_dates(newest, newest)
+    assert vantagepro2.get_archives(since, STOP) == []
+    assert parsed == []
+
+
+def test_eeprom_cache(console_requests):
+    '''Test the EEPROM settings are read at once and cached.'''
+    vantagepro2 = VantagePro2(console_link())
+    assert vantagepro2.archive_period == 5
+    assert vantagepro2.timezone == 'GMT+1.00'
+    assert (vantagepro2.latitude, vantagepro2.longitude,
+            vantagepro2.elevation) == (45.2, 5.7, 700)
+    assert vantagepro2.archive_period == 5
+    assert [request for request in console_requests
+            if request.startswith(b'EEBRD')] == [b'EEBRD 00 2E']
+    assert vantagepro2.eeprom.report() == {
+        'block_reads': 1, 'direct_reads': 0,
+        'served': {'14': 1, '0B': 1, '0D': 1, '0F': 1, '2D': 1}}
+    # the EEPROM is read again after a write or a new time
+    vantagepro2.write_to_eeprom('2D', b'\x0a')
+    assert vantagepro2.archive_period == 10
+    vantagepro2.settime(datetime(2013, 1, 1))
+    assert vantagepro2.archive_period == 10
+    assert vantagepro2.eeprom.block_reads == 3
+    # outside the cached blocks
+    assert vantagepro2.eeprom.read(0x30, 2) == b'\x00\x00'
+    assert vantagepro2.eeprom.direct_reads == 1
+
+
+def test_metadata_cache(tmpdir, console_requests):
+    '''Test the metadata are not queried while they are cached.'''
+    metadata = MetadataCache(str(tmpdir.join('metadata.json')))
+    link = console_link()
+    vantagepro2 = VantagePro2(link, metadata=metadata)
+    assert console_requests == [b'', b'VER', b'EEBRD 00 2E', b'NVER']
+    # warm start, without any command
+    del console_requests[:]
+    vantagepro2 = VantagePro2(link, metadata=metadata)
+    assert (vantagepro2.RevB, vantagepro2.firmware_version,
+            vantagepro2.archive_period, vantagepro2.timezone) == \
+        (True, '1.90', 5, 'GMT+1.00')
+    assert console_requests == []
+    # validated by one probe
+    metadata.validate = True
+    VantagePro2(link, metadata=metadata)
+    assert console_requests == [b'', b'NVER']
+    link.console.FIRMWARE_VERSION = b'1.91'
+    VantagePro2(link, metadata=metadata)
+    assert b'VER' in console_requests
+    assert metadata.get(link.url)['firmware_version'] == '1.91'
+    # expired entries and changed settings
+    metadata.ttl = 0
+    assert metadata.get(link.url) is None
+    metadata.ttl = None
+    vantagepro2 = VantagePro2(link, metadata=metadata)
+    vantagepro2.write_to_eeprom('2D', b'\x0a')
+    assert metadata.get(link.url) is None
+
+
+def test_metadata_cache_malformed(tmpdir, console_requests):
+    '''Test a truncated or corrupted cache entry is a miss, and removed.'''
+    path = str(tmpdir.join('metadata.json'))
+    metadata = MetadataCache(path)
+    link = console_link()
+    VantagePro2(link, metadata=metadata)
+    with open(path) as cache_file:
+        entries = json.load(cache_file)
+    good = entries[link.url]['metadata']
+    truncated = dict(good)
+    del truncated['firmware_version']
+    for bad in (truncated, dict(good, firmware_date='2013-13-01'),
+                dict(good, eeprom={'01': 'ABC'}), None):
+        entries[link.url]['metadata'] = bad
+        with open(path, 'w') as cache_file:
+            json.dump(entries, cache_file)
+        del console_requests[:]
+        vantagepro2 = VantagePro2(link, metadata=metadata)
+        assert b'VER' in console_requests
+        assert vantagepro2.archive_period == 5
+        # queried again and saved
+        assert metadata.get(link.url) == good
@@ -0,0 +1,261 @@
+# coding: utf8
+'''
+    pyvantagepro.tests.test_emulator
+    --------------------------------
+
+    The pyvantagepro test suite.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import unicode_literals
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+
+from ..device import VantagePro2, BadAckException, BadDataException
+from ..emulator import Console, ConsoleLink, ConsoleServer
+from ..parser import LoopDataParserRevB, Loop2DataParser
+from ..utils import RetryPolicy, AdaptiveTimeouts, is_bytes
+
+START = datetime(2013, 1, 1)
+STOP = datetime(2014, 1, 1)
+
+
+def record_writes(link):
+    '''Records the data written to `link` in its `writes` list.'''
+    link.writes = []
+    write = link.write
+
+    def record(data):
+        link.writes.append(data if is_bytes(data) else data.encode('ascii'))
+        write(data)
+    link.write = record
+    return link
+
+
+def test_commands():
+    '''Test the commands on an emulated console.'''
+    console = Console(records=10, start=START, baudrate=None)
+    vantagepro2 = VantagePro2(ConsoleLink(console, timeout=0.1))
+    assert vantagepro2.firmware_version == '1.90'
+    assert vantagepro2.RevB is True
+    assert vantagepro2.diagnostics['total_received'] == 21629
+    assert (vantagepro2.archive_period, vantagepro2.timezone,
+            vantagepro2.latitude) == (5, 'GMT+1.00', 45.2)
+    vantagepro2.write_to_eeprom('2D', b'\x0a')
+    assert vantagepro2.archive_period == console.eeprom[0x2D] == 10
+    vantagepro2.settime(datetime(2013, 1, 2))
+    assert abs(vantagepro2.gettime() - datetime(2013, 1, 2)) < \
+        timedelta(seconds=2)
+    assert vantagepro2.get_current_data().crc_error is False
+    packets = vantagepro2.stream_current_data(3)
+    assert len([packet['Barometer'] for packet in packets]) == 3
+    assert [type(packet) for packet in vantagepro2.get_loop_packets(4)] == \
+        [LoopDataParserRevB, Loop2DataParser] * 2
+    assert [type(packet) for packet in
+            vantagepro2.get_loop_packets(3, loop_types=2)] == \
+        [Loop2DataParser] * 3
+    # all the sent packets are read, the next command is answered
+    assert vantagepro2.get_current_data().crc_error is False
+
+
+def test_wake_up():
+    '''Test the wake-up is skipped while the console is awake, and sent
+    again after a bad reply or an idle period.'''
+    console = Console(start=START, baudrate=None)
+    link = record_writes(ConsoleLink(console, timeout=0.05))
+    vantagepro2 = VantagePro2(link, RetryPolicy(1))
+    assert link.writes.count(VantagePro2.WAKE_STR) == 1
+    vantagepro2.gettime()
+    vantagepro2.get_current_data()
+    assert vantagepro2.diagnostics['total_received'] == 21629
+    assert link.writes.count(VantagePro2.WAKE_STR) == 1
+    # a missing reply
+    console.drop = 1
+    with pytest.raises(BadAckException):
+        vantagepro2.gettime()
+    console.drop = 0
+    del link.writes[:]
+    vantagepro2.gettime()
+    assert link.writes == [b'\n', b'GETTIME\n']
+    vantagepro2.gettime()
+    assert link.writes.count(VantagePro2.WAKE_STR) == 1
+    # short replies
+    read = link.read
+    link.read = lambda *args, **kwargs: read(*args, **kwargs)[:3]
+    for command in (vantagepro2.gettime, vantagepro2.get_current_data):
+        with pytest.raises(BadDataException):
+            command()
+        assert not vantagepro2.awake
+    link.read = read
+    del link.writes[:]
+    vantagepro2.gettime()
+    assert link.writes == [b'\n', b'GETTIME\n']
+    # an idle console sleeps
+    vantagepro2.AWAKE_WINDOW = 0.05
+    time.sleep(0.1)
+    vantagepro2.gettime()
+    assert link.writes.count(VantagePro2.WAKE_STR) == 2
+
+
+def test_stream_current_data():
+    '''Test the LOOP command is sent again when its packets are received,
+    and the packets of a stream closed early are discarded at once.'''
+    console = Console(start=START, baudrate=None, loop_interval=0.01)
+    link = record_writes(ConsoleLink(console, timeout=2))
+    vantagepro2 = VantagePro2(link)
+    vantagepro2.LOOP_PACKETS = 3
+    del link.writes[:]
+    packets = list(vantagepro2.stream_current_data(7))
+    assert [packet.crc_error for packet in packets] == [False] * 7
+    assert link.writes == [b'LOOP 3\n', b'LOOP 3\n', b'LOOP 1\n']
+    with ConsoleServer(console) as server:
+        for vantagepro2 in (vantagepro2,
+                            VantagePro2.from_url(server.url, timeout=2)):
+            vantagepro2.LOOP_PACKETS = 200
+            for packets in (vantagepro2.stream_current_data(),
+                            vantagepro2.get_loop_packets(100)):
+                next(packets)
+                next(packets)
+                begin = time.time()
+                packets.close()
+                assert time.time() - begin < 1
+                assert vantagepro2.get_current_data().crc_error is False
+        vantagepro2.link.close()
+
+
+def test_archive_ring():
+    '''Test the download of an archive memory which has wrapped around, and
+    of the new records.'''
+    console = Console(records=2600, start=START, baudrate=None)
+    vantagepro2 = VantagePro2(ConsoleLink(console))
+    records = vantagepro2.get_archives(stop_date=STOP)
+    # the oldest records are overwritten
+    assert [r['Datetime'] for r in records] == [
+        console.record_date(i) for i in range(40, 2600)]
+    console.add_records(7)
+    records = vantagepro2.get_archives(records[-1]['Datetime'], STOP)
+    assert [r['Datetime'] for r in records] == [
+        console.record_date(i) for i in range(2600, 2607)]
+
+
+def test_pipelined_archives():
+    '''Test the pipelined download, with corrupted pages, and closed before
+    its end.'''
+    console = Console(records=300, start=START, baudrate=None, seed=3)
+    vantagepro2 = VantagePro2(ConsoleLink(console, timeout=0.2),
+                              RetryPolicy(10, delay=0))
+    records = vantagepro2.get_archives(stop_date=STOP)
+    assert len(records) == 300
+    assert vantagepro2.get_archives(stop_date=STOP, pipeline=True) == records
+    console.corruption = 0.2
+    vantagepro2.command_stats.reset()
+    assert vantagepro2.get_archives(stop_date=STOP, pipeline=True) == records
+    assert vantagepro2.stats()['DMP page']['crc_errors'] > 0
+    console.corruption = 0
+    threads = threading.active_count()
+    generator = vantagepro2._get_archives_generator(stop_date=STOP,
+                                                    pipeline=True)
+    assert [record['Datetime'] for _, record in zip(range(60), generator)] \
+        == [console.record_date(i) for i in range(60)]
+    assert threading.active_count() == threads + 1
+    generator.close()
+    # the download thread is ended and the download canceled
+    assert threading.active_count() == threads
+    assert vantagepro2.get_current_data().crc_error is False
+
+
+def test_faults():
+    '''Test a download with corrupted pages and lost bytes.'''
+    console = Console(records=100, start=START, baudrate=None, seed=3,
+                      corruption=0.1)
+    vantagepro2 = VantagePro2(ConsoleLink(console, timeout=0.05),
+                              RetryPolicy(5, delay=0))
+    records = vantagepro2.get_archives(stop_date=STOP, resumes=5)
+    assert len(records) == 100
+    console.corruption = 0
+    console.drop = 0.001
+    records = vantagepro2.get_archives(stop_date=STOP, resumes=20)
+    assert len(records) == 100
+
+
+def test_lost_page():
+    '''Test a download which loses its pages stops after the timeouts of
+    the page tries, without waiting for the page sent again.'''
+    console = Console(records=100, start=START, baudrate=None)
+    vantagepro2 = VantagePro2(ConsoleLink(console, timeout=0.5),
+                              RetryPolicy(1, delay=0))
+    vantagepro2.timeouts = None
+    generator = vantagepro2._get_archives_generator(stop_date=STOP)
+    next(generator)
+    console.drop = 1
+    begin = time.time()
+    assert len(list(generator)) == 4
+    # the link timeout of the lost page, and a short quiet period
+    assert 0.5 <= time.time() - begin < 0.9
+
+
+def test_command_stats():
+    '''Test the statistics of the commands of a download.'''
+    console = Console(records=100, start=START, baudrate=None, seed=3,
+                      corruption=0.1)
+    vantagepro2 = VantagePro2(ConsoleLink(console, timeout=0.05),
+                              RetryPolicy(5, delay=0))
+    commands = []
+    vantagepro2.command_stats.hook = lambda *args: commands.append(args[0])
+    vantagepro2.get_archives(stop_date=STOP, resumes=5)
+    stats = vantagepro2.stats()
+    pages = stats['DMP page']
+    assert pages['calls'] == commands.count('DMP page') >= 20
+    assert pages['crc_errors'] == pages['retries'] > 0
+    assert pages['bytes_in'] == pages['calls'] * 267
+    assert pages['latency']['count'] == pages['calls']
+    assert stats['EEBRD']['bytes_out'] == len(b'EEBRD 00 2E\n')
+    assert stats['DMPAFT']['calls'] >= 1
+    # the acknowledgements of the sent commands, by command
+    assert stats['send DMPAFT']['bytes_out'] == \
+        stats['send DMPAFT']['calls'] * len(b'DMPAFT\n')
+    assert stats['send VER']['calls'] == 1
+    assert 'send' not in stats
+
+
+def test_adaptive_timeouts():
+    '''Test the timeouts learned from the round trips detect the lost bytes
+    before the link timeout, and follow a slower link.'''
+    console = Console(records=200, start=START, baudrate=None, seed=0,
+                      latency=0.005)
+    vantagepro2 = VantagePro2(ConsoleLink(console, timeout=1),
+                              RetryPolicy(5, delay=0))
+    assert vantagepro2.timeouts.ceiling == 1
+    vantagepro2.timeouts = AdaptiveTimeouts(floor=0.01, ceiling=1, samples=5)
+    assert len(vantagepro2.get_archives(stop_date=STOP)) == 200
+    assert vantagepro2.timeouts.timeout('DMP page') < 0.5
+    console.drop = 0.001
+    begin = time.time()
+    assert len(vantagepro2.get_archives(stop_date=STOP, resumes=20)) == 200
+    # each lost byte would wait for the link timeout
+    errors = vantagepro2.stats()['DMP page']['errors']
+    assert time.time() - begin < errors * 1
+    # the late pages are not taken for the next ones
+    console.drop = 0
+    console.latency = 0.03
+    assert len(vantagepro2.get_archives(stop_date=STOP, resumes=5)) == 200
+    assert vantagepro2.timeouts.timeout('DMP page') > 0.03
+    # the failed tries never wait longer than the link timeout
+    for i in range(10):
+        vantagepro2.timeouts.failed('DMP page')
+    assert vantagepro2.timeouts.timeout('DMP page') == 1
+
+
+def test_server():
+    '''Test a station emulated by a TCP server.'''
+    console = Console(records=50, start=START, baudrate=None)
+    with ConsoleServer(console) as server:
+        vantagepro2 = VantagePro2.from_url(server.url, timeout=0.5)
+        records = vantagepro2.get_archives(stop_date=STOP)
+        assert len(records) == 50
+        assert vantagepro2.get_current_data().crc_error is False
+        vantagepro2.link.close()
@@ -0,0 +1,118 @@
+# coding: utf8
+'''
+    pyvantagepro.tests.test_framing
+    -------------------------------
+
+    The pyvantagepro test suite.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import unicode_literals
+import socket
+import threading
+import time
+from datetime import datetime
+import pytest
+from pylink import TCPLink
+
+from ..emulator import Console, ConsoleLink
+from ..framing import FrameReader
+
+
+def console_link():
+    '''Returns the link of an emulated console.'''
+    return ConsoleLink(Console(start=datetime(2013, 1, 1), baudrate=None),
+                       timeout=0.05)
+
+
+def socket_link():
+    '''Returns a `TCPLink` on a local socket, and the other end.'''
+    local, remote = socket.socketpair()
+    local.setblocking(0)
+    link = TCPLink('127.0.0.1', 0)
+    link._socket = local
+    return link, remote
+
+
+def test_socket_frames():
+    '''Test the frames of the bytes received on a socket.'''
+    link, remote = socket_link()
+    reader = FrameReader(link)
+    remote.sendall(b'\n\rOK\n\rApr 24 2002\n\r' + b'\x06' * 100)
+    assert reader.read_until(b'OK\n\r') == b'\n\rOK\n\r'
+    assert reader.peek(3) == b'Apr'
+    assert reader.read_until(b'\n\r') == b'Apr 24 2002\n\r'
+    assert [reader.read_exact(10) for i in range(10)] == [b'\x06' * 10] * 10
+    assert reader.reads == 1
+
+    # a frame received in several parts
+    def send():
+        for i in range(3):
+            time.sleep(0.02)
+            remote.sendall(b'%d' % i * 100)
+    thread = threading.Thread(target=send)
+    thread.start()
+    assert reader.read_exact(300) == b'0' * 100 + b'1' * 100 + b'2' * 100
+    thread.join()
+    # the bytes received before the deadline
+    remote.sendall(b'\x06')
+    begin = time.time()
+    assert reader.read_exact(2, time.time() + 0.05) == b'\x06'
+    assert time.time() - begin < 0.5
+    assert len(reader) == 0
+    link._socket = None
+    remote.close()
+
+
+def test_link_frames():
+    '''Test the frames of a link without socket, its text replies are
+    bytes.'''
+    link = console_link()
+    reader = FrameReader(link)
+    link.write(b'VER\n')
+    assert reader.read_exact(6) == b'\n\rOK\n\r'
+    assert reader.read_until(b'\n\r') == b'Apr 10 2012\n\r'
+    assert reader.read_exact(1) == b''
+    link.write(b'\n')
+    link.write(b'\n')
+    reader.drain()
+    assert link.session.read() == b'' and len(reader) == 0
+
+
+def test_read_into():
+    '''Test the bytes received from a socket are read into a buffer without
+    copies, and the bytes of a link read are copied into it.'''
+    tracemalloc = pytest.importorskip('tracemalloc')
+    link, remote = socket_link()
+    reader = FrameReader(link)
+    data = bytes(bytearray(i % 256 for i in range(267 * 100)))
+    buffer = memoryview(bytearray(len(data)))
+
+    def measure(read):
+        remote.sendall(data)
+        tracemalloc.start()
+        try:
+            read()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return peak
+    copied = measure(lambda: reader.read_exact(len(data)))
+    in_place = measure(lambda: reader.read_into(buffer))
+    assert bytes(buffer) == data
+    assert in_place * 10 < len(data) < copied
+    assert reader.consumed == 2 * len(data)
+    link._socket = None
+    remote.close()
+
+    link = console_link()
+    reader = FrameReader(link)
+    link.write(b'VER\n')
+    buffer = memoryview(bytearray(8))
+    assert reader.read_into(buffer[:2]) == 2
+    assert reader.read_into(buffer[2:]) == 6
+    assert reader.read_into(buffer) == 8
+    assert bytes(buffer) == b'r 10 201'
+    assert reader.read_into(buffer) == 3
@@ -12,12 +12,19 @@
 from __future__ import unicode_literals
 from datetime import datetime
 import struct
+import random
+import pytest
 
 
+from .. import parser
 from ..logger import active_logger
-from ..parser import (LoopDataParserRevB, VantageProCRC, pack_datetime,
-                      unpack_datetime, pack_dmp_date_time,
-                      unpack_dmp_date_time)
+from ..parser import (LoopDataParserRevB, LazyLoopDataParserRevB,
+                      Loop2DataParser, parse_loop_packet,
+                      ArchiveDataParserRevB, DmpPageParser, VantageProCRC,
+                      pack_datetime, unpack_datetime, pack_dmp_date_time,
+                      unpack_dmp_date_time, unpack_dmp_pages, crc16,
+                      crc16_table, check_crc_blocks, DataParser, Schema,
+                      SCHEMAS, PACKET_FORMATS, compile_schemas)
 from ..utils import hex_to_bytes
 
 
@@ -94,6 +101,265 @@ class TestLoopDataParser:
         assert item['WindSpeed'] == 255
         assert item['WindSpeed10Min'] == 255
 
+    def test_unpack_alarms(self):
+        '''Test unpack loop alarm bits and storm date.'''
+        data = bytearray(self.bytes)
+        data[48:50] = b'\x3A\x91'
+        data[70:74] = b'\x82\x08\x01\x80'
+        data[76] = 0x10
+        data[82] = 0x80
+        item = LoopDataParserRevB(bytes(data), datetime.now())
+        assert item['StormStartDate'] == '2017-3-21'
+        assert item['AlarmInFallBarTrend'] == 1
+        assert item['AlarmInRisBarTrend'] == 0
+        assert item['AlarmInTime'] == 1
+        assert item['AlarmRainETDaily'] == 1
+        assert item['AlarmOutLowWindChill'] == 1
+        assert item['AlarmOutHighTHSW'] == 1
+        assert item['AlarmEx02HighHum'] == 1
+        assert item['AlarmEx01HighHum'] == 0
+        assert item['Alarm01HighSoilTemp'] == 1
+        assert item['Alarm02HighSoilTemp'] == 0
+
+    def test_lazy(self):
+        '''Test lazy loop packet decoding.'''
+        dtime = datetime.now()
+        item = LoopDataParserRevB(self.bytes, dtime)
+        lazy = LazyLoopDataParserRevB(self.bytes, dtime)
+        assert lazy['TempOut'] == 3276.7
+        assert sorted(lazy._values) == ['Datetime', 'TempOut']
+        assert lazy['LeafWetness04'] == 0
+        assert lazy['Datetime'] == dtime
+        assert lazy.filter(['SunRise', 'TempIn']) == {'SunRise': '03:53',
+                                                      'TempIn': 85.0}
+        assert lazy.keys() == list(item.keys())
+        assert [lazy[key] for key in item] == list(item.values())
+        assert lazy.to_csv() == item.to_csv()
+        assert lazy.crc_error is False
+        assert lazy.raw == item.raw
+
+    def test_schema(self):
+        '''Test the schema is compiled once per class and format.'''
+        item1 = LoopDataParserRevB(self.bytes, datetime.now())
+        item2 = LoopDataParserRevB(self.bytes, datetime.now())
+        assert item1.schema is item2.schema
+        assert item1.fields == tuple(n for n, _ in item1.LOOP_FORMAT)
+        assert list(item1.keys()) == list(item1.schema.keys)
+        assert item1.schema is SCHEMAS[(LoopDataParserRevB,
+                                        item1.LOOP_FORMAT, '=')]
+        assert item1.schema.source.startswith('def decode(data, offset=0):')
+
+
+def test_schema_decode():
+    '''Test a packet type declared with the schema rules.'''
+    class Parser(DataParser):
+        FORMAT = (('Temp', 'H'), ('Extra', '3s'), ('Date', 'H'),
+                  ('Unused', 'B'), ('Hum', '2B'))
+        SCALES = (('Temp', 10),)
+        EXPANDS = ('Extra',)
+        CORRECTIONS = (('Extra', -90),)
+        CONVERTERS = ((('Day', 'Month'), lambda d: (d & 0x1F, d >> 5),
+                       ('Date',)),)
+        DROPS = ('Date', 'Unused')
+
+        def __init__(self, data):
+            super(Parser, self).__init__(data, self.FORMAT, '<')
+
+    item = Parser(struct.pack(b'<H3BHB2B', 725, 100, 90, 255, 3 * 32 + 21,
+                              0, 45, 50))
+    assert list(item.items()) == [
+        ('Datetime', None), ('Temp', 72.5), ('Hum', (45, 50)),
+        ('Day', 21), ('Month', 3), ('Extra01', 10), ('Extra02', 0),
+        ('Extra03', 165)]
+
+
+def test_schema_cache(monkeypatch):
+    '''Test the schemas are compiled once, and then shared.'''
+    compiled = []
+
+    class CountedSchema(Schema):
+        def __init__(self, data_format, *args):
+            compiled.append(data_format)
+            super(CountedSchema, self).__init__(data_format, *args)
+
+    monkeypatch.setattr(parser, 'Schema', CountedSchema)
+    monkeypatch.setattr(parser, 'SCHEMAS', {})
+    schemas = compile_schemas()
+    assert compiled == [data_format for _, data_format in PACKET_FORMATS]
+    assert all(schema is cached
+               for schema, cached in zip(compile_schemas(), schemas))
+    assert len(compiled) == len(PACKET_FORMATS)
+
+
+class TestLoop2DataParser:
+    ''' Test LOOP2 parser.'''
+    def setup_class(self):
+        '''Setup common data.'''
+        data = (b'LOO' + struct.pack(b'<BBHHHBHBBHHHHH4shBBBhhhHBHHHHHHHH'
+                                     b'BhhHHH', 20, 1, 0x7FFF, 29921, 725,
+                                     45, 563, 7, 0xFF, 270, 52, 61, 15,
+                                     292, b'\xff' * 4, 41, 0xFF, 48, 0xFF,
+                                     56, 54, 58, 12, 3, 420, 25, 0xFFFF,
+                                     18, 2, 5, 112, 40, 1, -15, 1200,
+                                     29804, 28712, 29910) +
+                b'\xff' * 24 + b'\n\r')
+        self.bytes = VantageProCRC(data).data_with_checksum
+        self.loop = hex_to_bytes(
+            "4C4F4FC4006802547B52031EFF7FFFFFFF7FFFFFFFFFFFFF"
+            "FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF7F0000"
+            "FFFF000000003C03000000000000FFFFFFFFFFFFFF000000"
+            "0000000000000000000000000000008C00060C610183070A"
+            "0D2A3C")
+
+    def test_unpack(self):
+        '''Test unpack loop2 packet.'''
+        dtime = datetime.now()
+        item = Loop2DataParser(self.bytes, dtime)
+        assert len(self.bytes) == 99
+        assert item.crc_error is False
+        assert item['Datetime'] == dtime
+        assert item['BarTrend'] == 20
+        assert item['Barometer'] == 29.921
+        assert item['TempIn'] == 72.5
+        assert item['HumIn'] == 45
+        assert item['TempOut'] == 56.3
+        assert item['WindSpeed'] == 7
+        assert item['WindDir'] == 270
+        assert item['WindSpeed10Min'] == 5.2
+        assert item['WindSpeed2Min'] == 6.1
+        assert item['WindGust10Min'] == 15
+        assert item['WindGustDir10Min'] == 292
+        assert item['DewPoint'] == 41
+        assert item['HumOut'] == 48
+        assert item['HeatIndex'] == 56
+        assert item['WindChill'] == 54
+        assert item['THSW'] == 58
+        assert item['RainRate'] == 0.12
+        assert item['UV'] == 3
+        assert item['SolarRad'] == 420
+        assert item['RainStorm'] == 0.25
+        assert item['StormStartDate'] == '2127-15-31'
+        assert item['RainDay'] == 0.18
+        assert item['Rain15Min'] == 0.02
+        assert item['RainHour'] == 0.05
+        assert item['ETDay'] == 0.112
+        assert item['Rain24Hours'] == 0.4
+        assert item['BarReduction'] == 1
+        assert item['BarOffset'] == -0.015
+        assert item['BarCalibration'] == 1.2
+        assert item['BarRaw'] == 29.804
+        assert item['BarAbsolute'] == 28.712
+        assert item['Altimeter'] == 29.91
+        assert 'PacketType' not in item
+
+    def test_parse_loop_packet(self):
+        '''Test the parser is selected by the packet type.'''
+        dtime = datetime.now()
+        loop = parse_loop_packet(self.loop, dtime)
+        loop2 = parse_loop_packet(self.bytes, dtime)
+        assert type(loop) is LoopDataParserRevB
+        assert type(loop2) is Loop2DataParser
+        assert loop == LoopDataParserRevB(self.loop, dtime)
+        assert loop2 == Loop2DataParser(self.bytes, dtime)
+        with pytest.raises(ValueError):
+            parse_loop_packet(self.bytes[:4] + b'\x02' + self.bytes[5:],
+                              dtime)
+
+
+class TestArchiveDataParser:
+    ''' Test archive parser.'''
+    def setup_class(self):
+        '''Setup common data.'''
+        self.data = "5A1A1A04D102DA02C902000000002F751B00780016021E" \
+                    "4E02050C0BFF001B00FF00FFFFFFFFFFFFFFFF00FFFFFF5A" \
+                    "FFFFFFFFFF"
+        self.bytes = hex_to_bytes(self.data)
+
+    def test_unpack(self):
+        '''Test unpack archive record.'''
+        item = ArchiveDataParserRevB(self.bytes)
+        assert list(item.keys())[:3] == ['Datetime', 'TempOut', 'TempOutHi']
+        assert item['Datetime'] == datetime(2013, 2, 26, 10, 50)
+        assert item['TempOut'] == 72.1
+        assert item['TempOutHi'] == 73.0
+        assert item['Barometer'] == 29.999
+        assert item['TempIn'] == 53.4
+        assert item['HumIn'] == 30
+        assert item['HumOut'] == 78
+        assert item['UV'] == 25.5
+        assert item['ExtraTemps01'] == 165
+        assert item['ExtraTemps02'] == 0
+        assert item['SoilTemps04'] == 165
+        assert item['ExtraHum02'] == 255
+        assert item['raw_datestamp'] == '01011010000110100001101000000100'
+        assert 'DateStamp' not in item
+        assert 'ExtraTemps' not in item
+
+    def test_unpack_in_place(self):
+        '''Test parsing a record in place from a larger buffer.'''
+        buffer = bytearray(b'\x00' * 53) + bytearray(self.bytes)
+        item = ArchiveDataParserRevB(buffer, 53)
+        assert item == ArchiveDataParserRevB(self.bytes)
+        assert isinstance(item.raw_bytes, memoryview)
+        assert item.raw_bytes.obj is buffer
+        assert item.raw_bytes == self.bytes
+        assert item.raw.replace(' ', '') == self.data
+
+    def test_unpack_dmp_pages(self):
+        '''Test bulk decoding of dump pages with NumPy.'''
+        numpy = pytest.importorskip('numpy')
+        records = self.bytes * 3 + b'\xff' * 52 * 2
+        page = VantageProCRC(b'\x00' + records + b'\x00' * 4)
+        bad_page = b'\x01' + records + b'\x00' * 6
+        array = unpack_dmp_pages(page.data_with_checksum + bad_page)
+        assert len(array) == 3
+        item = ArchiveDataParserRevB(self.bytes)
+        keys = [key for key in item.keys() if key != 'raw_datestamp']
+        assert list(array.dtype.names) == keys
+        assert array['Datetime'][0] == numpy.datetime64('2013-02-26T10:50')
+        for key in keys[1:]:
+            assert array[key][0] == item[key]
+
+
+def test_dmp_page_parser():
+    '''Test dump page parser fields.'''
+    data = b'\x01' + b'\xff' * 260 + b'\x00' * 4
+    data = VantageProCRC(data).data_with_checksum
+    page = DmpPageParser(data)
+    assert page.crc_error is False
+    assert page['Index'] == 1
+    assert len(page['Records']) == 260
+    assert page['unused'] == (0, 0, 0, 0)
+
+
+def test_crc_backends():
+    '''Test the CRC backend against the CRC_TABLE implementation.'''
+    data = bytes(bytearray(random.getrandbits(8) for _ in range(1000)))
+    for size in (0, 1, 6, 99, 267, 1000):
+        assert crc16(data[:size], 0) == crc16_table(data[:size])
+        assert crc16(data[size:], 0x1021) == crc16_table(data[size:], 0x1021)
+
+
+def test_crc_update():
+    '''Test incremental CRC.'''
+    data = hex_to_bytes("25 35 0A 07 06 70 60 BA")
+    crc = VantageProCRC()
+    for i in range(len(data)):
+        crc.update(data[i:i + 1])
+    assert crc.checksum == 0
+    assert crc.check()
+    assert bytes(crc.data) == data
+    crc = VantageProCRC(data[:4]).update(data[4:6])
+    assert crc.data_with_checksum == data
+
+
+def test_check_crc_blocks():
+    '''Test batch CRC verification of contiguous pages.'''
+    page = VantageProCRC(b'\x01' + b'\xaa' * 264).data_with_checksum
+    bad_page = b'\x02' + b'\xaa' * 266
+    data = bytearray(page + bad_page + page)
+    assert check_crc_blocks(data, 267) == [True, False, True]
+
 
 def test_datetime_parser():
     '''Test pack and unpack datetime.'''
@@ -0,0 +1,100 @@
+# coding: utf8
+'''
+    pyvantagepro.tests.test_pool
+    ----------------------------
+
+    The pyvantagepro test suite.
+
+    :copyright: Copyright 2012 Salem Harrache and contributors, see AUTHORS.
+    :license: GNU GPL v3.
+
+'''
+from __future__ import unicode_literals
+import time
+from datetime import datetime, timedelta
+import pytest
+
+from .. import pool
+from ..emulator import Console, ConsoleLink
+from ..pool import StationPool
+
+START = datetime(2013, 1, 1)
+
+
+@pytest.fixture
+def station_links(monkeypatch):
+    '''Replaces the links of the stations by the links of one emulated
+    console by URL, with 7 archive records every 5 minutes from `START`,
+    and returns the list of the created links. The links of an URL
+    'tcp:<host>:<failures>' fail to open `failures` times.'''
+    consoles = {}
+    links = []
+
+    def link_from_url(url):
+        console = consoles.get(url)
+        if console is None:
+            console = consoles[url] = Console(7, start=START, baudrate=None)
+        link = ConsoleLink(console, timeout=0.05)
+        link.station_url = url
+        failures = int(url.split(':')[2]) - len(
+            [other for other in links if other.station_url == url])
+        links.append(link)
+        if failures > 0:
+            def fail():
+                raise IOError('Connection refused')
+            link.open = fail
+        return link
+    monkeypatch.setattr(pool, 'link_from_url', link_from_url)
+    return links
+
+
+def test_poll(station_links):
+    '''Test the concurrent polls, with reconnection and rate limit.'''
+    urls = dict(('station%d' % i, 'tcp:host%d:%d' % (i, i % 2))
+                for i in range(6))
+    stations = StationPool(urls, interval=0.05)
+    begin = time.time()
+    results = list(stations.current_data(rounds=3))
+    # at least 2 intervals between the 3 rounds of each station
+    assert 0.1 <= time.time() - begin < 1
+    assert sorted(result.station for result in results) == \
+        sorted(list(urls) * 3)
+    errors = [result for result in results if result.error is not None]
+    assert sorted(result.station for result in errors) == \
+        ['station1', 'station3', 'station5']
+    for result in results:
+        if result.error is None:
+            assert 28.5 <= result.value['Barometer'] <= 30.8
+    # one link by station, and a new one after the failure
+    assert len(station_links) == 9
+    stations.close()
+    assert all(station.device is None
+               for station in stations.stations.values())
+    assert all(link.session is None for link in station_links)
+
+
+def test_new_archives(station_links):
+    '''Test the archive records are downloaded since the last ones.'''
+    stations = StationPool(['tcp:host:0', 'tcp:host:00'])
+    results = list(stations.archives())
+    assert len(results) == 2
+    for result in results:
+        assert [r['Datetime'] for r in result.value] == [
+            START + timedelta(minutes=5 * i) for i in range(7)]
+    station = stations.stations['tcp:host:0']
+    assert station.last_archive == START + timedelta(minutes=30)
+    station.device.link.console.add_records(2)
+    [result] = [result for result in stations.archives()
+                if result.station == 'tcp:host:0']
+    assert [r['Datetime'] for r in result.value] == [
+        START + timedelta(minutes=35), START + timedelta(minutes=40)]
+
+
+def test_poll_arguments(station_links):
+    '''Test the positional arguments of a poll are given to the command,
+    and the rounds only by keyword.'''
+    stations = StationPool(['tcp:host:0'])
+    results = list(stations.poll(lambda station, *args: args, 2, 3))
+    assert [result.value for result in results] == [(2, 3)]
+    results = list(stations.poll('read_from_eeprom', '2D', 1, rounds=2))
+    assert [result.value for result in results] == [b'\x05'] * 2
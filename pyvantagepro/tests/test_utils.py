@@ -13,11 +13,17 @@
 from __future__ import unicode_literals
 import os
 import random
+import threading
 
-from ..utils import (cached_property, retry, Dict, hex_to_bytes,
+import pytest
+
+from ..utils import (cached_property, retry, RetryPolicy, Dict, hex_to_bytes,
                      bytes_to_hex, bytes_to_binary, hex_to_binary,
-                     binary_to_int, csv_to_dict, is_text, is_bytes)
+                     binary_to_int, csv_to_dict, is_text, is_bytes,
+                     record_type, UniqueRecords, LatencyHistogram,
+                     CommandStats, AdaptiveTimeouts)
 from ..compat import StringIO
+from .. import utils
 
 
 def test_is_text_or_byte():
@@ -47,6 +53,59 @@ def test_csv_to_dict_file():
     assert items[0]["Datetime"] == "2012-06-08 16:40:00"
 
 
+def test_csv_to_dict_compact():
+    '''Tests csv to compact records with file archives.'''
+    path = os.path.join('pyvantagepro', 'tests', 'ressources', 'archives.csv')
+    path = os.path.abspath(os.path.join('.', path))
+    with open(path, 'r') as file_input:
+        items = csv_to_dict(file_input)
+    with open(path, 'r') as file_input:
+        records = csv_to_dict(file_input, compact=True)
+    assert len(records) == len(items)
+    assert records[0] == items[0]
+    assert records.to_csv() == items.to_csv()
+    records = records.sorted_by("Datetime", reverse=True)
+    assert records[0]["Barometer"] == "31.838"
+    assert records[0]["Datetime"] == "2012-06-08 16:40:00"
+    assert type(records[0]) is type(records[1])
+    assert csv_to_dict(StringIO(""), compact=True) == []
+
+
+def test_record():
+    '''Tests compact records.'''
+    record = record_type(['f', 'a', 'b'])(['222', '111', '000'])
+    assert record['a'] == '111'
+    assert record.get('c') is None
+    assert 'a' in record and 'c' not in record
+    assert list(record) == ['f', 'a', 'b']
+    assert dict(record) == {'f': '222', 'a': '111', 'b': '000'}
+    assert "f,a,b\r\n222,111,000\r\n" == record.to_csv()
+    assert "a,f\r\n111,222\r\n" == record.filter(['a', 'f', 'c']).to_csv()
+    with pytest.raises(KeyError):
+        record['c']
+
+
+def test_record_memory():
+    '''Tests compact records use much less memory than `Dict`.'''
+    tracemalloc = pytest.importorskip('tracemalloc')
+    keys = ['Key%.2d' % i for i in range(50)]
+    rows = [list(range(i, i + 50)) for i in range(1000)]
+    record = record_type(keys)
+
+    def measure(make):
+        tracemalloc.start()
+        try:
+            items = [make(row) for row in rows]
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        assert len(items) == len(rows)
+        return size
+    dict_size = measure(lambda row: Dict(zip(keys, row)))
+    record_size = measure(record)
+    assert record_size * 4 < dict_size
+
+
 def test_csv_to_dict_empty_file():
     '''Tests csv to dict with empty file archives.'''
     path = os.path.join('pyvantagepro', 'tests', 'ressources', 'empty.csv')
@@ -116,6 +175,188 @@ class TestRetry:
         assert self.retries_func(5) is False
 
 
+class FakeTime(object):
+    '''Clock which records the sleeps instead of sleeping.'''
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestRetryPolicy:
+    '''Test retry policy.'''
+    def setup_method(self, method):
+        '''Use a fake clock.'''
+        self.time = utils.time
+        utils.time = FakeTime()
+        self.sleeps = utils.time.sleeps
+
+    def teardown_method(self, method):
+        utils.time = self.time
+
+    def failing(self, *errors):
+        '''Returns a function raising `errors` then returning True.'''
+        errors = list(errors)
+
+        def func():
+            if errors:
+                raise errors.pop(0)
+            return True
+        return func
+
+    def test_delays(self):
+        '''Tests backoff, maximum delay and immediate first retry.'''
+        policy = RetryPolicy(delay=1, backoff=2, max_delay=5, immediate=True)
+        delays = policy.delays()
+        assert [next(delays) for _ in range(6)] == [0, 1, 2, 4, 5, 5]
+        policy = RetryPolicy(delay=1, jitter=0.5)
+        delays = policy.delays()
+        assert all(0.5 <= next(delays) <= 1.5 for _ in range(100))
+
+    def test_call(self):
+        '''Tests retried exceptions and stats.'''
+        policy = RetryPolicy(tries=3, delay=1, backoff=2, immediate=True,
+                             exceptions=(IOError,))
+        func = self.failing(IOError(), IOError())
+        assert policy.call(func) is True
+        assert self.sleeps == [1]
+        with pytest.raises(IOError):
+            policy.call(self.failing(IOError(), IOError(), IOError()))
+        with pytest.raises(KeyError):
+            policy.call(self.failing(KeyError()))
+        assert policy.stats()['func'] == {'calls': 3, 'retries': 4,
+                                          'failures': 1, 'slept': 2}
+        assert policy.stats()['total']['calls'] == 3
+
+    def test_deadline(self):
+        '''Tests no retry is done after the deadline, which replaces the
+        number of tries.'''
+        policy = RetryPolicy(tries=2, delay=1, deadline=2.5)
+        with pytest.raises(IOError):
+            policy.call(self.failing(*[IOError()] * 10))
+        assert self.sleeps == [1, 1]
+        assert policy.call(lambda: 0) == 0
+        assert policy.stats()['<lambda>']['failures'] == 1
+
+    def test_instance_policy(self):
+        '''Tests the policy of an object replaces the decorator one.'''
+        class Device(object):
+            retry_policy = None
+
+            @retry(tries=3, delay=1)
+            def read(self):
+                return False
+        device = Device()
+        assert device.read() is False
+        assert self.sleeps == [1, 1]
+        device.retry_policy = RetryPolicy(tries=2, delay=0.1)
+        assert device.read() is False
+        assert self.sleeps == [1, 1, 0.1]
+        assert device.retry_policy.stats()['read']['retries'] == 1
+        # each object has its own default policy
+        other = Device()
+        assert other.read() is False
+        assert device.retry_policies['read'].stats()['read']['calls'] == 1
+        assert other.retry_policies['read'].stats()['read']['retries'] == 2
+
+    def test_threads(self):
+        '''Tests the counters of a policy shared by threads.'''
+        policy = RetryPolicy(tries=2, delay=0)
+        threads = [threading.Thread(target=lambda: [
+            policy.call(self.failing(IOError())) for i in range(1000)])
+            for j in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert policy.stats()['func'] == {'calls': 8000, 'retries': 8000,
+                                          'failures': 0, 'slept': 0}
+
+
+def test_unique_records():
+    '''Tests the streaming deduplication of records.'''
+    def record(dtime, name, crc_error=False):
+        item = Dict(Datetime=dtime, name=name)
+        item.crc_error = crc_error
+        return item
+    unique = UniqueRecords()
+    # a record is released when a newer one is added
+    assert unique.add(record(1, 'a')) == []
+    assert unique.add(record(1, 'b')) == []
+    assert [r['name'] for r in unique.add(record(2, 'c'))] == ['a']
+    assert unique.add(record(1, 'd')) == []
+    assert unique.flush() == [record(2, 'c')]
+    assert unique.duplicates == 2 and not unique.reordered
+    records = [record(1, 'a', True), record(2, 'b'), record(2, 'c', True),
+               record(1, 'd'), record(3, 'e'), record(0, 'f'),
+               record(-1, 'g', True), record(-1, 'h')]
+    results = {}
+    for policy in UniqueRecords.POLICIES:
+        unique = UniqueRecords(policy)
+        results[policy] = ''.join(r['name'] for r in unique(records))
+        assert unique.reordered
+    # the older records are released at the end, the records kept by the
+    # 'last' and 'valid' policies are released in order by `flush`
+    assert results == {'first': 'abgfe', 'last': 'hfdce', 'valid': 'hfdbe'}
+    with pytest.raises(ValueError):
+        UniqueRecords('best')
+
+
+def test_unique_records_window():
+    '''Tests the policies of the duplicates which are not adjacent, inside
+    and outside the window of the records which are not released.'''
+    def record(dtime, name, crc_error=False):
+        item = Dict(Datetime=dtime, name=name)
+        item.crc_error = crc_error
+        return item
+    # a download merged with a second one of the same records
+    records = ([record(i, 'a%d' % i, i == 2) for i in range(5)] +
+               [record(i, 'b%d' % i) for i in range(1, 5)])
+    results = {}
+    for policy in UniqueRecords.POLICIES:
+        unique = UniqueRecords(policy)
+        results[policy] = [r['name'] for r in unique(records)]
+        assert unique.duplicates == 4
+        # the first records are released at once
+        assert unique.dropped == (3 if policy == 'first' else 0)
+    assert results == {'first': ['a0', 'a1', 'a2', 'a3', 'a4'],
+                       'last': ['a0', 'b1', 'b2', 'b3', 'b4'],
+                       'valid': ['a0', 'a1', 'b2', 'a3', 'a4']}
+    # the duplicates of the released records are dropped
+    unique = UniqueRecords('last', window=2)
+    assert [r['name'] for r in unique(records)] == \
+        ['a0', 'a1', 'a2', 'b3', 'b4']
+    assert unique.duplicates == 4 and unique.dropped == 2
+
+
+def test_unique_records_streaming():
+    '''Tests that the records are released a page behind the newest one and
+    that only the last released datetimes are kept.'''
+    records = [Dict(Datetime=i, name='a%d' % i) for i in range(100)]
+    for policy in UniqueRecords.POLICIES:
+        unique = UniqueRecords(policy)
+        window = unique.window
+        for i, record in enumerate(records):
+            released = unique.add(record)
+            assert released == ([records[i - window]] if i >= window else [])
+            assert len(unique.released) <= UniqueRecords.WINDOW
+        # the duplicates of the records which are not kept are dropped
+        assert unique.add(Dict(Datetime=10, name='b10')) == []
+        assert unique.dropped == 1 and not unique.reordered
+        # the older records are late
+        assert unique.add(Dict(Datetime=-1, name='b-1')) == []
+        assert unique.reordered
+        assert [r['name'] for r in unique.flush()] == \
+            ['b-1'] + ['a%d' % i for i in range(100 - window, 100)]
+        assert len(unique.released) == UniqueRecords.WINDOW
+
+
 def test_bytes_to_hex():
     '''Tests byte <-> hex and hex <-> byte.'''
     assert bytes_to_hex(b"\xFF") == "FF"
@@ -142,3 +383,63 @@ def test_bin_integer():
     assert binary_to_int(hexstr, 0, 1) == 0
     assert binary_to_int(hexstr, 0, 2) == 2
     assert binary_to_int(hexstr, 0, 3) == 6
+
+
+def test_latency_histogram():
+    '''Tests the percentiles of the latency histogram.'''
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    durations = [random.uniform(0.001, 2) for i in range(5000)]
+    for seconds in durations:
+        histogram.record(seconds)
+    durations.sort()
+    for percent in (50, 90, 99):
+        exact = durations[int(percent / 100.0 * len(durations)) - 1]
+        assert abs(histogram.percentile(percent) - exact) <= 0.04 * exact
+    assert histogram.percentile(100) == histogram.max == durations[-1]
+    assert histogram.summary()['count'] == 5000
+
+
+def test_command_stats():
+    '''Tests the command statistics and their hook.'''
+    calls = []
+    stats = CommandStats(lambda *args: calls.append(args),
+                         crc_errors=(ValueError,))
+    stats.record('EEBRD', 0.1, 12, 3, ValueError)
+    stats.record('EEBRD', 0.2, 12, 3, KeyError)
+    stats.record('EEBRD', 0.3, 12, 49)
+    stats.record('EEBRD', 0.4, 12, 49)
+    snapshot = stats.snapshot()['EEBRD']
+    assert [snapshot[key] for key in CommandStats.COUNTERS] == \
+        [4, 1, 1, 2, 48, 104]
+    assert snapshot['latency']['max'] == 0.4
+    assert calls[0] == ('EEBRD', 0.1, 12, 3, ValueError)
+    stats.reset()
+    assert stats.snapshot() == {}
+
+
+def test_adaptive_timeouts():
+    '''Tests the timeouts learned from the round trips.'''
+    timeouts = AdaptiveTimeouts(factor=2, floor=0.05, ceiling=1, samples=10,
+                                window=20)
+    for i in range(9):
+        timeouts.observe('LOOP', 0.1)
+    assert timeouts.timeout('LOOP') is None
+    timeouts.observe('LOOP', 0.1)
+    assert abs(timeouts.timeout('LOOP') - 0.2) < 0.01
+    # doubled after each failed try, until the ceiling
+    timeouts.failed('LOOP')
+    assert abs(timeouts.timeout('LOOP') - 0.4) < 0.02
+    for i in range(5):
+        timeouts.failed('LOOP')
+    assert timeouts.timeout('LOOP') == 1
+    # the old round trips are forgotten
+    for i in range(40):
+        timeouts.observe('LOOP', 0.01)
+    assert timeouts.timeout('LOOP') == 0.05
+    assert timeouts.timeout('DMPAFT') is None
+    # without a ceiling
+    timeouts = AdaptiveTimeouts(factor=2, floor=0.05, samples=1)
+    timeouts.observe('LOOP', 100)
+    timeouts.failed('LOOP')
+    assert timeouts.timeout('LOOP') == 400
@@ -8,10 +8,15 @@
 
 '''
 from __future__ import unicode_literals
+import os
 import sys
 import time
 import csv
+import json
 import binascii
+import random
+import threading
+from datetime import datetime
 
 from .compat import to_char, str, bytes, StringIO, is_py3, OrderedDict
 
@@ -68,37 +73,493 @@ class cached_property(object):
         return value
 
 
+class RetryPolicy(object):
+    '''Defines how a failed call (exception or false value) is retried, and
+    counts the retries.
+
+    :param tries: The maximum number of tries, unless there is a
+        `deadline`.
+
+    :param delay: The delay in seconds before the first delayed retry.
+
+    :param backoff: The factor by which the delay lengthens after each
+        retry.
+
+    :param max_delay: The maximum delay in seconds, None for no limit.
+
+    :param jitter: The delays are randomly spread by this fraction of them
+        (0.5 gives a delay between 50% and 150% of the computed one).
+
+    :param immediate: If True, the first retry is done without delay.
+
+    :param deadline: The maximum number of seconds of a call with its
+        retries, None for no limit. It replaces `tries`: the call is retried
+        until the delay of a retry would end after the deadline.
+
+    :param exceptions: The exception types which are retried, the other
+        ones are raised at once.
+    '''
+
+    def __init__(self, tries=3, delay=1, backoff=1, max_delay=None, jitter=0,
+                 immediate=False, deadline=None, exceptions=(Exception,)):
+        self.tries = tries
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.immediate = immediate
+        self.deadline = deadline
+        self.exceptions = tuple(exceptions)
+        self.counters = {}
+        # the policy may be shared by the threads of a `StationPool`
+        self._lock = threading.Lock()
+
+    def delays(self):
+        '''Yields the delays before each retry.'''
+        delay = self.delay
+        if self.immediate:
+            yield 0
+        while True:
+            if self.max_delay is not None:
+                delay = min(delay, self.max_delay)
+            if self.jitter:
+                yield delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+            else:
+                yield delay
+            delay *= self.backoff
+
+    def attempts(self):
+        '''Yields for each try if it is the last one, which is never known
+        with a `deadline`.'''
+        if self.deadline is not None:
+            while True:
+                yield False
+        for i in range(self.tries):
+            yield i == self.tries - 1
+
+    def call(self, func, *args, **kwargs):
+        '''Calls `func` with `args` and `kwargs` and retries it while it
+        fails. Returns the last value or raises the last exception.'''
+        counter = self.start(func)
+        begin = time.time()
+        delays = self.delays()
+        for last in self.attempts():
+            try:
+                ret = func(*args, **kwargs)
+                if ret or last:
+                    if not ret:
+                        self.failed(counter)
+                    return ret
+            except self.exceptions:
+                if last:
+                    self.failed(counter)
+                    raise
+                exc_info = sys.exc_info()
+            else:
+                exc_info = None
+            delay = self.next_delay(counter, begin, delays)
+            if delay is None:
+                if exc_info is None:
+                    return ret
+                raise exc_info[1]
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self, func):
+        '''Counts a new call of `func` and returns its counters.'''
+        with self._lock:
+            counter = self.counters.setdefault(func.__name__, {
+                'calls': 0, 'retries': 0, 'failures': 0, 'slept': 0})
+            counter['calls'] += 1
+        return counter
+
+    def failed(self, counter):
+        '''Counts a call which gave up.'''
+        with self._lock:
+            counter['failures'] += 1
+
+    def next_delay(self, counter, begin, delays):
+        '''Returns the next delay of the `delays` of a call started at
+        `begin` and counts the retry, or returns None and counts the failure
+        if the retry would end after the deadline.'''
+        delay = next(delays)
+        if self.deadline is not None and \
+                time.time() - begin + delay > self.deadline:
+            self.failed(counter)
+            return None
+        with self._lock:
+            counter['retries'] += 1
+            counter['slept'] += delay
+        return delay
+
+    def stats(self):
+        '''Returns the calls, retries, failures (the calls which gave up) and
+        seconds slept, by function name and in total.'''
+        with self._lock:
+            stats = dict((name, dict(counter))
+                         for name, counter in self.counters.items())
+        total = {'calls': 0, 'retries': 0, 'failures': 0, 'slept': 0}
+        for counter in stats.values():
+            for key in total:
+                total[key] += counter[key]
+        stats['total'] = total
+        return stats
+
+
 class retry(object):
     '''Retries a function or method until it returns True value.
-    delay sets the initial delay in seconds, and backoff sets the factor by
-    which the delay should lengthen after each failure.
-    Tries must be at least 0, and delay greater than 0.'''
+    delay sets the delay in seconds between the tries.
+    Tries must be at least 0, and delay greater than 0.
+
+    The `RetryPolicy` of the decorator can be replaced by the
+    `retry_policy` attribute of the object of a method. Without it, each
+    object with this attribute has its own policy of the decorator, in its
+    `retry_policies` by method name.'''
 
     def __init__(self, tries=3, delay=1):
         self.tries = tries
         self.delay = delay
+        self.policy = RetryPolicy(tries, delay)
+
+    def get_policy(self, args, name):
+        '''Returns the policy of a call with `args` of the method `name`.'''
+        if not args or not hasattr(args[0], 'retry_policy'):
+            return self.policy
+        if args[0].retry_policy is not None:
+            return args[0].retry_policy
+        policies = args[0].__dict__.setdefault('retry_policies', {})
+        policy = policies.get(name)
+        if policy is None:
+            policy = policies.setdefault(name,
+                                         RetryPolicy(self.tries, self.delay))
+        return policy
 
     def __call__(self, f):
         def wrapped_f(*args, **kwargs):
-            for i in range(self.tries):
-                try:
-                    ret = f(*args, **kwargs)
-                    if ret:
-                        return ret
-                    elif i == self.tries - 1:
-                        return ret
-                except Exception as e:
-                    if i == self.tries - 1:
-                        # last chance
-                        raise e
-                if self.delay > 0:
-                    time.sleep(self.delay)
+            return self.get_policy(args, f.__name__).call(f, *args, **kwargs)
         wrapped_f.__doc__ = f.__doc__
         wrapped_f.__name__ = f.__name__
         wrapped_f.__module__ = f.__module__
         return wrapped_f
 
 
+class LatencyHistogram(object):
+    '''Histogram of durations with a bounded relative error, as the HDR
+    histograms: the microseconds are counted in buckets whose width is a
+    `1 / 2 ** (PRECISION_BITS - 1)` fraction of their value (3% by
+    default). Recording a value is a few integer operations.'''
+    PRECISION_BITS = 6
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, micros):
+        '''Returns the bucket of `micros`.'''
+        shift = max(0, micros.bit_length() - self.PRECISION_BITS)
+        return (shift << (self.PRECISION_BITS - 1)) + (micros >> shift)
+
+    def _lowest(self, index):
+        '''Returns the lowest microseconds of the bucket `index`.'''
+        half = 1 << (self.PRECISION_BITS - 1)
+        shift = max(0, (index >> (self.PRECISION_BITS - 1)) - 1)
+        return (index - (shift << (self.PRECISION_BITS - 1))) << shift \
+            if index >= 2 * half else index
+
+    def record(self, seconds):
+        '''Counts a duration of `seconds`.'''
+        micros = int(seconds * 1e6)
+        index = self._index(micros)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        '''Adds the durations of the `other` histogram.'''
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        '''Returns the duration in seconds below which are `percent`% of
+        the durations (the highest value of its bucket), None if there is
+        no duration.'''
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        highest = (self._lowest(index + 1) - 1) / 1e6
+        return min(max(highest, self.min), self.max)
+
+    def summary(self):
+        '''Returns the count, min, mean, 50th, 90th and 99th percentiles
+        and max of the durations in seconds.'''
+        return {'count': self.count, 'min': self.min,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'max': self.max}
+
+
+class CommandStats(object):
+    '''Statistics of the commands of a station, by command name: the
+    number of tries, the errors and CRC errors, the retries (the tries
+    after a failed one), the bytes sent and received, and a
+    `LatencyHistogram` of the round trips.
+
+    :param hook: A function called after each try with the command name,
+        the duration in seconds, the bytes sent and received, and the
+        exception type (None if the try succeeded), for external
+        collectors.
+
+    :param crc_errors: The exception types counted as CRC errors.
+    '''
+    COUNTERS = ('calls', 'errors', 'crc_errors', 'retries', 'bytes_out',
+                'bytes_in')
+
+    def __init__(self, hook=None, crc_errors=()):
+        self.hook = hook
+        self.crc_errors = tuple(crc_errors)
+        self.commands = {}
+        # the commands whose last try failed
+        self._failed = set()
+
+    def record(self, command, seconds, sent=0, received=0, error=None):
+        '''Records a try of `command`.'''
+        stats = self.commands.get(command)
+        if stats is None:
+            stats = self.commands[command] = dict.fromkeys(self.COUNTERS, 0)
+            stats['latency'] = LatencyHistogram()
+        stats['calls'] += 1
+        stats['bytes_out'] += sent
+        stats['bytes_in'] += received
+        stats['latency'].record(seconds)
+        if command in self._failed:
+            stats['retries'] += 1
+        if error is None:
+            self._failed.discard(command)
+        else:
+            self._failed.add(command)
+            if issubclass(error, self.crc_errors):
+                stats['crc_errors'] += 1
+            else:
+                stats['errors'] += 1
+        if self.hook is not None:
+            self.hook(command, seconds, sent, received, error)
+
+    def snapshot(self):
+        '''Returns the counters and the latency summary by command.'''
+        snapshot = {}
+        for command, stats in self.commands.items():
+            snapshot[command] = dict((key, stats[key])
+                                     for key in self.COUNTERS)
+            snapshot[command]['latency'] = stats['latency'].summary()
+        return snapshot
+
+    def reset(self):
+        '''Forgets the recorded commands.'''
+        self.commands = {}
+        self._failed = set()
+
+
+class AdaptiveTimeouts(object):
+    '''Timeouts of the commands learned from their round trip times: the
+    `percentile` of the recent successful round trips times `factor`,
+    between `floor` and `ceiling` seconds. The timeout of a command doubles
+    after each failed try, until a successful one, and is never above the
+    `ceiling`. A command has no timeout (the link timeout is used) until
+    `samples` round trips are observed.
+
+    :param factor: The factor of the percentile.
+
+    :param percentile: The percentile of the round trip times.
+
+    :param floor: The minimum timeout in seconds.
+
+    :param ceiling: The maximum timeout in seconds, usually the link
+        timeout, None for no maximum.
+
+    :param samples: The number of round trips before a timeout is learned.
+
+    :param window: The number of round trips of a histogram, the timeouts
+        are learned from the last two histograms of a command.
+    '''
+
+    def __init__(self, factor=3, percentile=99, floor=1, ceiling=None,
+                 samples=20, window=500):
+        self.factor = factor
+        self.percentile = percentile
+        self.floor = floor
+        self.ceiling = ceiling
+        self.samples = samples
+        self.window = window
+        # [previous histogram, current histogram, learned timeout,
+        # failed tries] by command
+        self.commands = {}
+
+    def observe(self, command, seconds):
+        '''Learns the round trip time of a successful try of `command`.'''
+        state = self.commands.get(command)
+        if state is None:
+            state = self.commands[command] = [LatencyHistogram(),
+                                              LatencyHistogram(), None, 0]
+        previous, current = state[0], state[1]
+        current.record(seconds)
+        if current.count >= self.window:
+            previous, current = state[0], state[1] = \
+                current, LatencyHistogram()
+        histogram = LatencyHistogram()
+        histogram.merge(previous)
+        histogram.merge(current)
+        if histogram.count >= self.samples:
+            state[2] = self._capped(max(
+                self.floor, histogram.percentile(self.percentile) *
+                self.factor))
+        state[3] = 0
+
+    def failed(self, command):
+        '''Doubles the timeout of `command` after a failed try.'''
+        state = self.commands.get(command)
+        if state is not None:
+            state[3] += 1
+
+    def timeout(self, command):
+        '''Returns the timeout in seconds of `command`, None if it is not
+        learned yet.'''
+        state = self.commands.get(command)
+        if state is None or state[2] is None:
+            return None
+        return self._capped(state[2] * 2 ** min(state[3], 16))
+
+    def _capped(self, timeout):
+        '''Returns `timeout`, at most the `ceiling`.'''
+        if self.ceiling is None:
+            return timeout
+        return min(self.ceiling, timeout)
+
+
+class Checkpoint(object):
+    '''Small state file of a resumable archive download: the datetime of
+    the last downloaded record. The file is loaded if it exists.
+
+    :param path: The path of the state file.
+    '''
+    DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, path):
+        self.path = path
+        self.datetime = None
+        if os.path.exists(path):
+            self.load()
+
+    def load(self):
+        '''Reads the state file.'''
+        with open(self.path) as state_file:
+            state = json.load(state_file)
+        self.datetime = datetime.strptime(state['datetime'],
+                                          self.DATETIME_FORMAT)
+
+    def save(self, dtime):
+        '''Writes the `dtime` of the last record. The file is replaced at
+        once, it is never partially written.'''
+        self.datetime = dtime
+        write_json(self.path, {'datetime': dtime.strftime(
+            self.DATETIME_FORMAT)})
+
+
+class MetadataCache(object):
+    '''On-disk cache of the station metadata by link URL: the firmware
+    date and version and the EEPROM configuration blocks. A `VantagePro2`
+    using the cache does not query them again while the entry of its URL
+    is fresh.
+
+    :param path: The path of the cache file, shared by the stations.
+
+    :param ttl: The number of seconds an entry is used, None for no limit.
+
+    :param validate: If True, an entry is only used if the console still
+        has the same firmware version (one NVER command).
+    '''
+
+    def __init__(self, path, ttl=24 * 3600, validate=False):
+        self.path = path
+        self.ttl = ttl
+        self.validate = validate
+
+    def load(self):
+        '''Returns all the entries by URL, none if the file does not exist
+        or is not readable.'''
+        try:
+            with open(self.path) as cache_file:
+                entries = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    KEYS = ('firmware_date', 'firmware_version', 'eeprom')
+
+    def get(self, url):
+        '''Returns the metadata of `url`, or None if there is no fresh
+        entry. A malformed entry is removed.'''
+        entry = self.load().get(url)
+        if entry is None:
+            return None
+        try:
+            age = time.time() - entry['saved']
+            metadata = entry['metadata']
+            valid = all(key in metadata for key in self.KEYS)
+        except (KeyError, TypeError):
+            valid = False
+        if not valid:
+            self.remove(url)
+            return None
+        if self.ttl is not None and age >= self.ttl:
+            return None
+        return metadata
+
+    def set(self, url, metadata):
+        '''Saves the `metadata` dict of `url`.'''
+        entries = self.load()
+        entries[url] = {'saved': time.time(), 'metadata': metadata}
+        write_json(self.path, entries)
+
+    def remove(self, url):
+        '''Forgets the metadata of `url`.'''
+        entries = self.load()
+        if entries.pop(url, None) is not None:
+            write_json(self.path, entries)
+
+
+def write_json(path, value):
+    '''Writes `value` as JSON to the file `path`. The file is replaced at
+    once, it is never partially written.'''
+    temp_path = '%s.tmp' % path
+    with open(temp_path, 'w') as json_file:
+        json.dump(value, json_file)
+    if hasattr(os, 'replace'):
+        os.replace(temp_path, path)
+    else:
+        # Python 2 can not replace an existing file on Windows
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
+
+
 def bytes_to_hex(byte):
     '''Convert a bytearray to it's hex string representation.'''
     if sys.version_info[0] >= 3:
@@ -166,10 +627,29 @@ def binary_to_int(buf, start=0, stop=None):
     return int(buf[::-1][start:(stop or len(buf))][::-1], 2)
 
 
-def csv_to_dict(file_input, delimiter=','):
-    '''Deserialize csv to list of dictionaries.'''
+def csv_to_dict(file_input, delimiter=',', compact=False):
+    '''Deserialize csv to list of dictionaries.
+
+    :param compact: If True, the rows are returned as compact `Record`
+        sharing the keys of the csv header.
+    '''
     delimiter = to_char(delimiter)
     table = []
+    if compact:
+        reader = csv.reader(file_input, delimiter=delimiter,
+                            skipinitialspace=True)
+        for header in reader:
+            if header:
+                break
+        else:
+            return ListDict()
+        record = record_type(header)
+        size = len(header)
+        for row in reader:
+            if row:
+                row.extend([None] * (size - len(row)))
+                table.append(record(row[:size]))
+        return ListDict(table)
     reader = csv.DictReader(file_input, delimiter=delimiter,
                             skipinitialspace=True)
     for d in reader:
@@ -243,3 +723,213 @@ class ListDict(list):
         '''Returns list sorted by `keyword`.'''
         key_ = keyword
         return ListDict(sorted(self, key=lambda k: k[key_], reverse=reverse))
+
+
+class UniqueRecords(object):
+    '''Streaming deduplication of records by datetime, with a hash index.
+    The records are expected in ascending order, as downloaded: a record is
+    released when `window` newer records are added, so only the newest ones
+    are buffered. The records older than the released ones (after the
+    wrap-around of the archive memory, or from another download) are
+    buffered and released by `flush`, sorted.
+
+    The `policy` chooses among the duplicates which are not released yet. A
+    later duplicate of a released record is dropped and counted in
+    `dropped`, which only keeps the first record. The default window of the
+    'last' and 'valid' policies holds the records of a DMP page, where a
+    resumed download resends its records.
+
+    Only the datetimes of the last `WINDOW` released records are kept, a
+    record between the oldest released one and these datetimes is taken for
+    a duplicate.
+
+    :param policy: The record kept among duplicates: 'first', 'last' or
+        'valid' (the first one without CRC error).
+
+    :param key: The key of the datetime of the records.
+
+    :param window: The number of records which are not released, by default
+        1 for the 'first' policy and `WINDOW` for the others.
+    '''
+    POLICIES = ('first', 'last', 'valid')
+    # the records of a DMP page
+    WINDOW = 5
+
+    def __init__(self, policy='first', key='Datetime', window=None):
+        if policy not in self.POLICIES:
+            raise ValueError('Unknown duplicates policy: %s' % policy)
+        self.policy = policy
+        self.key = key
+        if window is None:
+            window = 1 if policy == 'first' else self.WINDOW
+        self.window = max(1, window)
+        # the newest records, which are not released, by datetime
+        self.pending = OrderedDict()
+        # the datetime of the newest record
+        self.newest = None
+        # the records older than the released ones, by datetime
+        self.late = {}
+        # the datetimes of the last released records
+        self.released = OrderedDict()
+        # the oldest released datetime and the newest one which is not kept
+        # in `released`
+        self.first = None
+        self.floor = None
+        self.duplicates = 0
+        # the duplicates of released records, which the policy may not keep
+        self.dropped = 0
+        # True if records were added out of order
+        self.reordered = False
+
+    def _keep(self, kept, record):
+        '''Returns the record kept among the duplicates `kept` and
+        `record`.'''
+        self.duplicates += 1
+        if self.policy == 'last' or (self.policy == 'valid' and
+                                     getattr(kept, 'crc_error', False) and
+                                     not getattr(record, 'crc_error', False)):
+            return record
+        return kept
+
+    def add(self, record):
+        '''Adds a `record` and returns the list of the released records.'''
+        dtime = record[self.key]
+        if self.newest is None or dtime > self.newest:
+            self.newest = dtime
+            self.pending[dtime] = record
+            released = []
+            while len(self.pending) > self.window:
+                released.append(self.pending.popitem(last=False)[1])
+            self._release(released)
+            return released
+        if dtime in self.pending:
+            self.pending[dtime] = self._keep(self.pending[dtime], record)
+        elif dtime in self.released or (self.floor is not None and
+                                        self.first <= dtime <= self.floor):
+            self.duplicates += 1
+            self.dropped += 1
+        elif dtime in self.late:
+            self.late[dtime] = self._keep(self.late[dtime], record)
+        else:
+            self.late[dtime] = record
+            self.reordered = True
+        return []
+
+    def flush(self):
+        '''Returns the list of the records which are not released, sorted.
+        '''
+        records = list(self.pending.values())
+        if self.late:
+            records.extend(self.late.values())
+            records.sort(key=lambda record: record[self.key])
+        self._release(records)
+        self.pending = OrderedDict()
+        self.newest = None
+        self.late = {}
+        return records
+
+    def _release(self, records):
+        '''Remembers the datetimes of the released `records`, only the last
+        `WINDOW` ones are kept.'''
+        for record in records:
+            dtime = record[self.key]
+            self.released[dtime] = True
+            if self.first is None or dtime < self.first:
+                self.first = dtime
+        while len(self.released) > self.WINDOW:
+            dtime = self.released.popitem(last=False)[0]
+            if self.floor is None or dtime > self.floor:
+                self.floor = dtime
+
+    def __call__(self, records):
+        '''Yields the unique `records`, in ascending order unless they are
+        `reordered`.'''
+        for record in records:
+            for released in self.add(record):
+                yield released
+        for released in self.flush():
+            yield released
+
+
+class Record(object):
+    '''A compact read-only record, its values are stored in a tuple and its
+    keys are shared by all the records of the same type (see `record_type`).
+    It supports the mapping API of `Dict` (`record['key']`, `keys`, `items`,
+    `filter`, `to_csv`...) at a fraction of its memory.'''
+    __slots__ = ('_values',)
+    _keys = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = tuple(values)
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self.items() == other.items()
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def get(self, key, default=None):
+        '''Return the value of `key` if it exists, else `default`.'''
+        index = self._index.get(key)
+        if index is None:
+            return default
+        return self._values[index]
+
+    def keys(self):
+        return list(self._keys)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return list(zip(self._keys, self._values))
+
+    def to_dict(self):
+        '''Return the record as a `Dict`.'''
+        return Dict(zip(self._keys, self._values))
+
+    def filter(self, keys):
+        '''Create a record with only the following `keys`.'''
+        keys = [key for key in keys if key in self._index]
+        return record_type(keys)(self[key] for key in keys)
+
+    def to_csv(self, delimiter=',', header=True):
+        '''Serialize list of dictionaries to csv.'''
+        return dict_to_csv([self], delimiter, header)
+
+    def __repr__(self):
+        return str("%s(%r)" % (self.__class__.__name__, self.items()))
+
+
+_RECORD_TYPES = {}
+
+
+def record_type(keys):
+    '''Return the `Record` class of the given `keys`. The classes are
+    cached, so records with the same keys share the same key index.'''
+    keys = tuple(keys)
+    cls = _RECORD_TYPES.get(keys)
+    if cls is None:
+        index = dict((key, i) for i, key in reversed(list(enumerate(keys))))
+        cls = type(str('Record'), (Record,), {'__slots__': (),
+                                              '_keys': keys,
+                                              '_index': index})
+        _RECORD_TYPES[keys] = cls
+    return cls
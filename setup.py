@@ -71,6 +71,7 @@ setup(
     packages=find_packages(),
     zip_safe=False,
     install_requires=REQUIREMENTS,
+    extras_require={'numpy': ['numpy']},
     test_suite='pyvantagepro.tests',
     entry_points={
         'console_scripts': [